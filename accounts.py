@@ -0,0 +1,237 @@
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from logging_setup import logging, log_csv, log_path, ensure_log_dir
+from aws_clients import get_client, get_session, register_session, use_account, current_account
+
+# Multi-account fan-out
+# --accounts runs the selected action once per member account, in parallel. Each account's role
+# (from "accounts" in config.json) is assumed once and its session registered with the client
+# registry, so every client created on that account's threads uses the assumed credentials.
+# STS credentials are cached on disk until shortly before they expire, and sessions refresh them
+# (through the same cache) on their own, so runs longer than the role duration keep working.
+#
+# "accounts": [
+#   "arn:aws:iam::111111111111:role/OpsAuditor",
+#   {"role_arn": "arn:aws:iam::222222222222:role/OpsAuditor", "name": "prod", "external_id": "..."}
+# ]
+
+STS_CACHE = os.path.join(log_path, "sts_credentials.json")
+REFRESH_MARGIN = timedelta(minutes=15)   # botocore's advisory refresh window; anything closer is refreshed anyway
+
+
+def load_accounts(config):
+    accounts = []
+    for entry in config.get("accounts") or []:
+        if isinstance(entry, str):
+            entry = {"role_arn": entry}
+        account_id = entry.get("id") or entry["role_arn"].split(":")[4]
+        accounts.append(dict(entry, id=account_id, name=entry.get("name") or account_id))
+    return accounts
+
+
+#"all", or account IDs / names from config
+def select_accounts(config, requested):
+    accounts = load_accounts(config)
+    if not accounts:
+        raise ValueError("--accounts needs an 'accounts' list of role ARNs in the config file")
+    if "all" in requested:
+        return accounts
+    by_key = {key: account for account in accounts for key in (account["id"], account["name"])}
+    unknown = [key for key in requested if key not in by_key]
+    if unknown:
+        raise ValueError(f"Unknown account(s): {', '.join(unknown)} (not in the config 'accounts' list)")
+    return list({by_key[key]["id"]: by_key[key] for key in requested}.values())
+
+
+# Assumed-role credentials by role, shared between runs; the file is readable by the owner only
+class CredentialCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as file:
+                self._entries = json.load(file)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            credentials = self._entries.get(key)
+        if credentials and datetime.fromisoformat(credentials["Expiration"]) - REFRESH_MARGIN > datetime.now(timezone.utc):
+            return credentials
+        return None
+
+    def put(self, key, credentials):
+        with self._lock:
+            self._entries[key] = credentials
+            now = datetime.now(timezone.utc)
+            self._entries = {key: entry for key, entry in self._entries.items()
+                             if datetime.fromisoformat(entry["Expiration"]) > now}
+            ensure_log_dir()
+            tmp_path = f"{self.path}.tmp"
+            with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+                json.dump(self._entries, file)
+            os.replace(tmp_path, self.path)
+
+
+#Credentials for one account's role: from the cache while they have time left, otherwise from STS
+def role_credentials(account, config, cache):
+    key = f"{account['role_arn']}|{account.get('external_id', '')}"
+    credentials = cache.get(key)
+    if credentials:
+        logging.debug(f"Using cached STS credentials for {account['id']} until {credentials['Expiration']}")
+        return credentials
+    params = {
+        "RoleArn": account["role_arn"],
+        "RoleSessionName": config.get("role_session_name", "aws-cloud-operations-tool"),
+        "DurationSeconds": config.get("role_duration_seconds", 3600),
+    }
+    if account.get("external_id"):
+        params["ExternalId"] = account["external_id"]
+    #Always through the default credentials: botocore refreshes on whichever thread needs the keys,
+    #usually one running under use_account for this very account
+    with use_account(None):
+        response = get_client("sts").assume_role(**params)["Credentials"]
+    credentials = {
+        "AccessKeyId": response["AccessKeyId"],
+        "SecretAccessKey": response["SecretAccessKey"],
+        "SessionToken": response["SessionToken"],
+        "Expiration": response["Expiration"].isoformat(),
+    }
+    cache.put(key, credentials)
+    logging.debug(f"Assumed {account['role_arn']} until {credentials['Expiration']}")
+    return credentials
+
+
+#Register a session for the account whose credentials botocore refreshes before they expire.
+#The first AssumeRole happens here, so an account that cannot be assumed fails up front.
+def assume_role(account, config, cache):
+    import boto3
+    import botocore.session
+    from botocore.credentials import CredentialProvider, RefreshableCredentials
+
+    class AssumedRoleProvider(CredentialProvider):
+        METHOD = "sts-assume-role"
+
+        def __init__(self, credentials):
+            self.credentials = credentials
+
+        def load(self):
+            return self.credentials
+
+    def refresh():
+        credentials = role_credentials(account, config, cache)
+        return {
+            "access_key": credentials["AccessKeyId"],
+            "secret_key": credentials["SecretAccessKey"],
+            "token": credentials["SessionToken"],
+            "expiry_time": credentials["Expiration"],
+        }
+
+    credentials = RefreshableCredentials.create_from_metadata(
+        metadata=refresh(), refresh_using=refresh, method=AssumedRoleProvider.METHOD)
+    core_session = botocore.session.get_session()
+    core_session.get_component("credential_provider").insert_before("env", AssumedRoleProvider(credentials))
+    register_session(account["id"], boto3.Session(botocore_session=core_session, region_name=get_session().region_name))
+
+
+#Assume every account's role concurrently; returns the accounts that failed with their errors
+def prepare_sessions(accounts, config, workers=8):
+    cache = CredentialCache(config.get("sts_cache_path") or STS_CACHE)
+    failed = {}
+
+    def assume(account):
+        try:
+            assume_role(account, config, cache)
+        except Exception as e:
+            logging.error(f"Could not assume {account['role_arn']}: {e}")
+            log_csv("STS", account["id"], "assume-role", "Failed")
+            failed[account["id"]] = str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(accounts)))) as pool:
+        list(pool.map(assume, accounts))
+    return failed
+
+
+# Prefixes every line printed from an account's threads with its ID. Lines are buffered per thread
+# and written whole, so output from accounts running in parallel never interleaves mid-line.
+class AccountTaggedStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        account = current_account()
+        if not account:
+            return self.stream.write(text)
+        pending = getattr(self._local, "pending", "") + text
+        *lines, self._local.pending = pending.split("\n")
+        if lines:
+            with self._lock:
+                self.stream.write("".join(f"[{account}] {line}\n" for line in lines))
+        return len(text)
+
+    def flush(self):
+        pending = getattr(self._local, "pending", "")
+        if pending:
+            self.write("\n")
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+#Run action(args, config) once per selected account in parallel; returns {account_id: result}
+def run_across_accounts(action, args, config):
+    accounts = select_accounts(config, args.accounts)
+    workers = args.account_workers or config.get("account_workers", 8)
+    failed = prepare_sessions(accounts, config, workers)
+    results = {account_id: {"error": error} for account_id, error in failed.items()}
+    label = f"{args.service} {getattr(args, 'action', None) or ''}".strip()
+
+    def run(account):
+        with use_account(account["id"]):
+            try:
+                result = action(args, config)
+                log_csv("Accounts", account["id"], label, "Success")
+                return account["id"], {"result": result}
+            except Exception as e:
+                logging.error(f"{label} failed: {e}")
+                log_csv("Accounts", account["id"], label, "Failure")
+                return account["id"], {"error": str(e)}
+            finally:
+                sys.stdout.flush()
+
+    ready = [account for account in accounts if account["id"] not in failed]
+    stdout = sys.stdout
+    sys.stdout = AccountTaggedStream(stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(ready) or 1))) as pool:
+            results.update(pool.map(run, ready))
+    finally:
+        sys.stdout = stdout
+
+    names = {account["id"]: account["name"] for account in accounts}
+    succeeded = sum(1 for outcome in results.values() if "error" not in outcome)
+    print(f"\n{label} across {len(accounts)} account(s): {succeeded} succeeded, {len(accounts) - succeeded} failed")
+    for account_id in sorted(results):
+        outcome = results[account_id]
+        name = f" ({names[account_id]})" if names.get(account_id) != account_id else ""
+        print(f"  {account_id}{name}: {summarize(outcome)}")
+    return results
+
+
+def summarize(outcome):
+    if "error" in outcome:
+        return f"FAILED - {outcome['error']}"
+    result = outcome["result"]
+    if isinstance(result, dict):
+        return ", ".join(f"{key}={value}" for key, value in result.items() if not isinstance(value, (list, dict)))
+    if isinstance(result, (list, tuple, set)):
+        return f"{len(result)} item(s)"
+    return "ok" if result is None else str(result)
@@ -0,0 +1,257 @@
+import csv
+import gzip
+import json
+import os
+import sys
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import logging_setup
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Rotating audit store
+# report.csv is the active segment. Once it passes the size or age limit it is compressed into
+# csv_log/audit/ and one line describing it (time range, row count, services, resources) is appended
+# to audit/index.jsonl, so report queries only open segments that can contain matching rows.
+
+INDEX_FILE = "index.jsonl"
+LOCK_FILE = "rotate.lock"
+MAX_INDEXED_RESOURCES = 1000   # beyond this a segment's resources are not indexed (matches any resource)
+SERVICE, RESOURCE, ACTION, STATUS, TIMESTAMP, ACCOUNT = range(6)
+
+
+def audit_dir():
+    return os.path.join(logging_setup.log_path, "audit")
+
+
+def index_path():
+    return os.path.join(audit_dir(), INDEX_FILE)
+
+
+# Lock shared by every process writing to this log directory: appends hold it shared, rotation exclusive,
+# so two processes never rotate at once and no append lands in a segment that is being archived.
+# Windows has no shared byte-range locks, so there every holder is exclusive.
+@contextmanager
+def locked(shared=False):
+    os.makedirs(audit_dir(), exist_ok=True)
+    with open(os.path.join(audit_dir(), LOCK_FILE), "a+") as file:
+        if fcntl:
+            fcntl.flock(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue    #LK_LOCK gives up after about 10 seconds; keep waiting
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(file, fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def is_row(row):
+    return len(row) > TIMESTAMP and row[TIMESTAMP] != "Timestamp"
+
+
+#Rows written without --accounts belong to the default credentials ("")
+def row_account(row):
+    return row[ACCOUNT] if len(row) > ACCOUNT else ""
+
+
+#Timestamp of the first row in a segment, None if it has no rows yet
+def first_timestamp(path):
+    try:
+        with open(path, newline="") as file:
+            for row in csv.reader(file):
+                if is_row(row):
+                    return row[TIMESTAMP]
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def compact(timestamp):
+    return timestamp[:19].replace("-", "").replace(":", "")
+
+
+#Compress one finished segment into the store and index it
+def archive(staging):
+    directory = audit_dir()
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix="segment-", suffix=".tmp")
+    os.close(handle)
+    services, resources, accounts = Counter(), set(), set()
+    start = end = None
+    rows = 0
+    with open(staging, newline="") as source, gzip.open(tmp_path, "wt", newline="") as target:
+        writer = csv.writer(target)
+        for row in csv.reader(source):
+            if not is_row(row):
+                continue
+            writer.writerow(row)
+            rows += 1
+            services[row[SERVICE]] += 1
+            accounts.add(row_account(row))
+            if resources is not None:
+                resources.add(row[RESOURCE])
+                if len(resources) > MAX_INDEXED_RESOURCES:
+                    resources = None
+            start = min(start, row[TIMESTAMP]) if start else row[TIMESTAMP]
+            end = max(end, row[TIMESTAMP]) if end else row[TIMESTAMP]
+
+    if not rows:
+        os.remove(tmp_path)
+        os.remove(staging)
+        return None
+
+    name = f"report-{compact(start)}-{compact(end)}.csv.gz"
+    suffix = 1
+    while os.path.exists(os.path.join(directory, name)):
+        suffix += 1
+        name = f"report-{compact(start)}-{compact(end)}-{suffix}.csv.gz"
+    os.replace(tmp_path, os.path.join(directory, name))
+    entry = {"segment": name, "start": start, "end": end, "rows": rows, "services": dict(services),
+             "resources": sorted(resources) if resources is not None else None, "accounts": sorted(accounts)}
+    with open(index_path(), "a") as file:
+        file.write(json.dumps(entry) + "\n")
+    os.remove(staging)
+    return entry
+
+
+#Move the active segment aside and archive it (also finishes a rotation interrupted by a crash).
+#due() is checked again once the lock is held, since another process may have rotated in the meantime
+def rotate(path, due=None):
+    with locked():
+        staging = f"{path}.rotating"
+        if os.path.exists(staging):
+            archive(staging)
+        if not os.path.exists(path) or (due is not None and not due()):
+            return None
+        os.replace(path, staging)
+        return archive(staging)
+
+
+def read_index():
+    try:
+        with open(index_path()) as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+#Archived segments that can hold rows in [since, until) for the service/resource filters
+def select_segments(since=None, until=None, service=None, resource=None, account=None):
+    for entry in read_index():
+        if since and entry["end"][:19] < since:
+            continue
+        if until and entry["start"][:19] >= until:
+            continue
+        if service and service.lower() not in {name.lower() for name in entry["services"]}:
+            continue
+        if resource and entry["resources"] is not None and resource not in entry["resources"]:
+            continue
+        if account and "accounts" in entry and account not in entry["accounts"]:
+            continue
+        yield os.path.join(audit_dir(), entry["segment"])
+
+
+def iter_segment_rows(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", newline="") as file:
+            for row in csv.reader(file):
+                if is_row(row):
+                    yield row
+    except FileNotFoundError:
+        return
+
+
+#Stream matching rows from the selected segments and the active report.csv
+def query(since=None, until=None, service=None, resource=None, status=None, action=None, account=None):
+    paths = list(select_segments(since, until, service, resource, account)) + [logging_setup.csv_file]
+    for path in paths:
+        for row in iter_segment_rows(path):
+            stamp = row[TIMESTAMP][:19]
+            if since and stamp < since:
+                continue
+            if until and stamp >= until:
+                continue
+            if service and row[SERVICE].lower() != service.lower():
+                continue
+            if resource and row[RESOURCE] != resource:
+                continue
+            if status and row[STATUS].lower() != status.lower():
+                continue
+            if action and action.lower() not in row[ACTION].lower():
+                continue
+            if account and row_account(row) != account:
+                continue
+            yield row
+
+
+GROUP_FIELDS = {
+    "day": lambda row: row[TIMESTAMP][:10],
+    "hour": lambda row: row[TIMESTAMP][:13],
+    "service": lambda row: row[SERVICE],
+    "resource": lambda row: row[RESOURCE],
+    "action": lambda row: row[ACTION],
+    "status": lambda row: row[STATUS],
+    "account": row_account,
+}
+
+
+#"2025-01-31" or "2025-01-31T12:00:00" -> fixed-width UTC string comparable with row timestamps
+def parse_bound(value):
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def report(args, config):
+    since = parse_bound(args.since)
+    if args.days:
+        since = (datetime.now(timezone.utc) - timedelta(days=args.days)).strftime("%Y-%m-%dT%H:%M:%S")
+    until = parse_bound(args.until)
+    rows = query(since, until, args.report_service, args.resource, args.status, args.action_contains, args.account)
+
+    if args.rows:
+        fields = logging_setup.CSV_HEADER + ["Account"]
+        emit = output_writer(args.format, fields)
+        count = 0
+        for row in rows:
+            emit(dict(zip(fields, row[:ACCOUNT] + [row_account(row)])))
+            count += 1
+        return count
+
+    group_by = args.group_by or ["day", "action", "status"]
+    keys = [GROUP_FIELDS[field] for field in group_by]
+    counts = Counter(tuple(key(row) for key in keys) for row in rows)
+    emit = output_writer(args.format, group_by + ["count"])
+    for group, count in sorted(counts.items()):
+        emit(dict(zip(group_by, group), count=count))
+    return dict(rows=sum(counts.values()), groups=len(counts))
+
+
+def output_writer(output_format, fields):
+    if output_format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=fields)
+        writer.writeheader()
+        return writer.writerow
+    if output_format == "ndjson":
+        return lambda record: print(json.dumps(record))
+    print("\t".join(fields))
+    return lambda record: print("\t".join(str(record[field]) for field in fields))
@@ -0,0 +1,158 @@
+from logging_setup import logging, context
+from contextlib import contextmanager
+import instrumentation
+import threading
+import time
+
+# Central client registry
+# Clients are created on first use and shared per (service, region, account). Every client gets the
+# same connection-pool/retry settings and passes each API call through a per-family token bucket
+# (per account, since AWS throttles each account separately).
+
+DEFAULT_SETTINGS = {
+    "max_pool_connections": 50,
+    "retry_mode": "adaptive",
+    "max_attempts": 10,
+    "rate_limits": {},
+}
+
+_settings = dict(DEFAULT_SETTINGS)
+_sessions = {}
+_clients = {}
+_resources = {}
+_resource_classes = {}
+_limiters = {}
+_lock = threading.RLock()
+
+
+# Token bucket: `rate` calls per second with bursts of up to `burst` calls
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Read settings from config.json; call before the first client is created
+def configure(config):
+    with _lock:
+        for key in ("max_pool_connections", "retry_mode", "max_attempts", "rate_limits"):
+            if config.get(key) is not None:
+                _settings[key] = config[key]
+        _limiters.clear()
+
+
+# API family of an operation: "<service>:read" for Describe/List/Get/Head calls, "<service>:write" otherwise
+def api_family(service, operation):
+    kind = "read" if operation.startswith(("Describe", "List", "Get", "Head")) else "write"
+    return f"{service}:{kind}"
+
+
+def get_limiter(family, account=None):
+    key = (family, account)
+    with _lock:
+        if key not in _limiters:
+            limit = _settings["rate_limits"].get(family)
+            rate, burst = (limit.get("rate"), limit.get("burst")) if isinstance(limit, dict) else (limit, None)
+            if limit and not rate:
+                logging.warning(f"rate_limits.{family} has no rate; {family} calls are not rate limited")
+            _limiters[key] = RateLimiter(rate, burst) if rate else None
+        return _limiters[key]
+
+
+def _rate_limit_hook(service, account):
+    def before_call(model, **kwargs):
+        limiter = get_limiter(api_family(service, model.name), account)
+        if limiter:
+            limiter.acquire()
+    return before_call
+
+
+# Account the current thread works in (None = default credentials); clients default to it
+def current_account():
+    return getattr(context, "account", None)
+
+
+@contextmanager
+def use_account(account):
+    previous = current_account()
+    context.account = account
+    try:
+        yield
+    finally:
+        context.account = previous
+
+
+# ThreadPoolExecutor initializer that carries the submitting thread's account into the pool's workers
+def inherit_account():
+    account = current_account()
+
+    def initializer():
+        context.account = account
+    return initializer
+
+
+# Sessions per account; None is the default credential chain
+def register_session(account, session):
+    with _lock:
+        _sessions[account] = session
+
+
+def get_session(account=None):
+    with _lock:
+        if account not in _sessions:
+            if account is not None:
+                raise KeyError(f"No session registered for account {account}")
+            import boto3
+            _sessions[None] = boto3.Session()
+        return _sessions[account]
+
+
+def client_config():
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=_settings["max_pool_connections"],
+        retries={"mode": _settings["retry_mode"], "max_attempts": _settings["max_attempts"]},
+    )
+
+
+def get_client(service, region=None, account=None):
+    account = account or current_account()
+    key = (service, region, account)
+    with _lock:
+        if key not in _clients:
+            client = get_session(account).client(service, region_name=region, config=client_config())
+            client.meta.events.register("before-call", _rate_limit_hook(service, account))
+            instrumentation.attach(client, service)
+            _clients[key] = client
+            logging.debug(f"Created {service} client for region {region or 'default'} account {account or 'default'}")
+        return _clients[key]
+
+
+# Resources are built on the registry's client so pooling, retries and rate limits still apply.
+# boto3 only builds a resource class together with a client of its own, so that happens once per
+# service; every resource after that is the cached class over the registry's client.
+def get_resource(service, region=None, account=None):
+    account = account or current_account()
+    key = (service, region, account)
+    with _lock:
+        if key not in _resources:
+            client = get_client(service, region, account)
+            if service not in _resource_classes:
+                _resource_classes[service] = type(get_session(account).resource(service, region_name=region))
+            _resources[key] = _resource_classes[service](client=client)
+        return _resources[key]
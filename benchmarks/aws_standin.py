@@ -0,0 +1,277 @@
+import csv
+import io
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+# Local AWS stand-in for the benchmarks
+# Synthetic EC2, S3 and IAM clients that generate production-sized fixtures lazily (nothing is
+# materialised up front) and count every API call. install() plugs them into the shared client
+# registry, so the actions run unchanged.
+
+NOW = datetime.now(timezone.utc)
+OLD = NOW - timedelta(days=400)
+S3_PREFIXES = 64
+
+
+class CallCounter:
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def hit(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+
+class Paginator:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return self.pages(**kwargs)
+
+
+def page_size(kwargs, default):
+    return min((kwargs.get("PaginationConfig") or {}).get("PageSize", default), default)
+
+
+class FakeEC2:
+    def __init__(self, counter, instances, region="us-east-1"):
+        self.counter = counter
+        self.count = instances
+        self.states = {}
+        self._lock = threading.Lock()
+        self.meta = SimpleNamespace(region_name=region)
+
+    def instance(self, n):
+        instance_id = f"i-{n:017x}"
+        tags = [{"Key": "env", "Value": "dev" if n % 4 == 0 else "prod"}, {"Key": "Name", "Value": f"worker-{n}"}]
+        if n % 3 == 0:
+            tags.append({"Key": "owner", "Value": "team-a"})
+        if n % 10 == 0:
+            tags.append({"Key": "ttl", "Value": (OLD if n % 20 == 0 else NOW + timedelta(days=30)).date().isoformat()})
+        return {
+            "InstanceId": instance_id,
+            "InstanceType": "t3.medium",
+            "State": {"Name": self.states.get(instance_id, "running")},
+            "LaunchTime": OLD + timedelta(minutes=n),
+            "Tags": tags,
+        }
+
+    def matches(self, instance, filters):
+        for f in filters:
+            name, values = f["Name"], f["Values"]
+            if name == "instance-state-name" and instance["State"]["Name"] not in values:
+                return False
+            if name == "instance-type" and instance["InstanceType"] not in values:
+                return False
+            tags = {tag["Key"]: tag["Value"] for tag in instance["Tags"]}
+            if name == "tag-key" and not set(values) & tags.keys():
+                return False
+            if name.startswith("tag:") and tags.get(name[4:]) not in values:
+                return False
+        return True
+
+    def describe_pages(self, Filters=(), **kwargs):
+        size = page_size(kwargs, 1000)
+        id_filter = next((f["Values"] for f in Filters if f["Name"] == "instance-id"), None)
+        numbers = (int(i[2:], 16) for i in id_filter) if id_filter is not None else range(self.count)
+        page = []
+        for n in numbers:
+            instance = self.instance(n)
+            if self.matches(instance, Filters):
+                page.append(instance)
+            if len(page) == size:
+                self.counter.hit("ec2.DescribeInstances")
+                yield {"Reservations": [{"Instances": page}]}
+                page = []
+        self.counter.hit("ec2.DescribeInstances")
+        yield {"Reservations": [{"Instances": page}]}
+
+    def get_paginator(self, name):
+        return Paginator(self.describe_pages)
+
+    def stop_instances(self, InstanceIds, DryRun=False):
+        self.counter.hit("ec2.StopInstances")
+        if DryRun:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {"Code": "DryRunOperation", "Message": "Request would have succeeded"}}, "StopInstances")
+        with self._lock:
+            for instance_id in InstanceIds:
+                self.states[instance_id] = "stopped"
+        return {}
+
+    def describe_regions(self, **kwargs):
+        self.counter.hit("ec2.DescribeRegions")
+        return {"Regions": [{"RegionName": self.meta.region_name}]}
+
+
+# Hourly CPU and network series per instance; every fifth instance is idle
+class FakeCloudWatch:
+    def __init__(self, counter):
+        self.counter = counter
+
+    def series(self, query, start, end):
+        stat = query["MetricStat"]
+        n = int(stat["Metric"]["Dimensions"][0]["Value"][2:], 16)
+        period = stat["Period"]
+        busy = n % 5 != 0
+        if stat["Metric"]["MetricName"] == "CPUUtilization":
+            value = 35.0 + n % 40 if busy else 0.5 + n % 3
+        else:
+            value = (200 if busy else 0.2) * 1024 * 1024 * period / 3600
+        stamps, moment = [], start
+        while moment < end:
+            stamps.append(moment)
+            moment += timedelta(seconds=period)
+        return {"Id": query["Id"], "Timestamps": stamps, "Values": [value] * len(stamps), "StatusCode": "Complete"}
+
+    def metric_pages(self, MetricDataQueries, StartTime, EndTime, **kwargs):
+        if len(MetricDataQueries) > 500:
+            raise ValueError("GetMetricData accepts at most 500 queries")
+        self.counter.hit("cloudwatch.GetMetricData")
+        yield {"MetricDataResults": [self.series(query, StartTime, EndTime) for query in MetricDataQueries]}
+
+    def get_paginator(self, name):
+        return Paginator(self.metric_pages)
+
+
+class FakeS3:
+    def __init__(self, counter, objects):
+        self.counter = counter
+        self.count = objects
+        self.uploaded_bytes = 0
+        self._lock = threading.Lock()
+
+    # Keys are spread over S3_PREFIXES folders (logs/NN/<n>.gz) so delimiter discovery has a layout to find
+    def keys(self, prefix, start_after):
+        for folder in range(S3_PREFIXES):
+            folder_prefix = f"logs/{folder:02d}/"
+            if not (folder_prefix.startswith(prefix) or prefix.startswith(folder_prefix)):
+                continue
+            if start_after and folder_prefix + "\uffff" < start_after:
+                continue
+            for n in range(folder, self.count, S3_PREFIXES):
+                key = f"{folder_prefix}{n:09d}.gz"
+                if key.startswith(prefix) and (not start_after or key > start_after):
+                    yield n, key
+
+    def entries(self, prefix, delimiter, start_after):
+        seen = None
+        for n, key in self.keys(prefix, start_after):
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest[:rest.index(delimiter) + 1]
+                if common != seen:
+                    seen = common
+                    yield {"Prefix": common}
+                continue
+            yield {"Key": key, "Size": 1024, "ETag": '"d41d8cd98f00b204e9800998ecf8427e"',
+                   "LastModified": OLD if n % 2 == 0 else NOW, "StorageClass": "STANDARD"}
+
+    def list_pages(self, Bucket, Prefix="", Delimiter=None, StartAfter=None, **kwargs):
+        size = page_size(kwargs, 1000)
+        entries = self.entries(Prefix, Delimiter, StartAfter)
+        page = [entry for _, entry in zip(range(size), entries)]
+        while True:
+            self.counter.hit("s3.ListObjectsV2")
+            following = [entry for _, entry in zip(range(size), entries)]
+            yield {"Contents": [entry for entry in page if "Key" in entry],
+                   "CommonPrefixes": [entry for entry in page if "Prefix" in entry],
+                   "IsTruncated": bool(following)}
+            if not following:
+                return
+            page = following
+
+    def get_paginator(self, name):
+        return Paginator(self.list_pages)
+
+    def delete_objects(self, Bucket, Delete):
+        self.counter.hit("s3.DeleteObjects")
+        return {"Deleted": [{"Key": obj["Key"]} for obj in Delete["Objects"]]}
+
+    def copy(self, CopySource, Bucket, Key, Config=None):
+        self.counter.hit("s3.CopyObject")
+
+    def upload_file(self, path, bucket, key, Config=None, ExtraArgs=None):
+        self.counter.hit("s3.PutObject")
+        with open(path, "rb") as file:
+            size = len(file.read())
+        with self._lock:
+            self.uploaded_bytes += size
+
+
+class FakeS3Resource:
+    def __init__(self, client):
+        self.meta = SimpleNamespace(client=client)
+        self.buckets = SimpleNamespace(all=lambda: [SimpleNamespace(name="bench-bucket")])
+
+    def Bucket(self, name):
+        return SimpleNamespace(name=name, meta=self.meta)
+
+
+class FakeIAM:
+    def __init__(self, counter, users):
+        self.counter = counter
+        self.count = users
+
+    def user_pages(self, **kwargs):
+        size = page_size(kwargs, 1000)
+        for start in range(0, self.count, size):
+            self.counter.hit("iam.ListUsers")
+            yield {"Users": [{"UserName": f"user-{n:05d}", "CreateDate": OLD} for n in range(start, min(start + size, self.count))]}
+
+    def get_paginator(self, name):
+        return Paginator(self.user_pages)
+
+    def list_access_keys(self, UserName):
+        self.counter.hit("iam.ListAccessKeys")
+        return {"AccessKeyMetadata": [
+            {"AccessKeyId": f"AKIAOLD{UserName}", "Status": "Active", "CreateDate": OLD},
+            {"AccessKeyId": f"AKIANEW{UserName}", "Status": "Active", "CreateDate": NOW},
+        ]}
+
+    def get_access_key_last_used(self, AccessKeyId):
+        self.counter.hit("iam.GetAccessKeyLastUsed")
+        return {"AccessKeyLastUsed": {"LastUsedDate": NOW}}
+
+    def delete_access_key(self, UserName, AccessKeyId):
+        self.counter.hit("iam.DeleteAccessKey")
+
+    def get_account_summary(self):
+        self.counter.hit("iam.GetAccountSummary")
+        return {"SummaryMap": {"Users": self.count}}
+
+    def generate_credential_report(self):
+        self.counter.hit("iam.GenerateCredentialReport")
+        return {"State": "COMPLETE"}
+
+    def get_credential_report(self):
+        self.counter.hit("iam.GetCredentialReport")
+        out = io.StringIO()
+        writer = csv.writer(out)
+        slots = ["active", "last_rotated", "last_used_date"]
+        writer.writerow(["user", "arn"] + [f"access_key_{slot}_{field}" for slot in (1, 2) for field in slots])
+        for n in range(self.count):
+            writer.writerow([f"user-{n:05d}", "arn", "true", OLD.isoformat(), NOW.isoformat(), "true", NOW.isoformat(), "N/A"])
+        return {"Content": out.getvalue().encode(), "GeneratedTime": NOW}
+
+
+# Register the stand-ins in the client registry and return the shared call counter
+def install(instances=50000, objects=1000000, users=5000):
+    import aws_clients
+
+    counter = CallCounter()
+    s3 = FakeS3(counter, objects)
+    aws_clients._clients[("ec2", None, None)] = FakeEC2(counter, instances)
+    aws_clients._clients[("s3", None, None)] = s3
+    aws_clients._resources[("s3", None, None)] = FakeS3Resource(s3)
+    aws_clients._clients[("iam", None, None)] = FakeIAM(counter, users)
+    aws_clients._clients[("cloudwatch", None, None)] = FakeCloudWatch(counter)
+    return counter
@@ -0,0 +1,167 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Production-scale fixture sizes (multiplied by --scale)
+INSTANCES = 50000
+OBJECTS = 1000000
+USERS = 5000
+LOCAL_FILES = 5000
+
+SCENARIOS = {
+    "ec2-list-instances": ["ec2", "list-instances"],
+    "ec2-filter-instances": ["ec2", "filter-instances", "--tag-key", "env", "--tag-value", "dev"],
+    "ec2-stop-instances": ["ec2", "stop-instances"],
+    "ec2-find-idle": ["ec2", "find-idle", "--refresh-metrics"],
+    "s3-upload-file": ["s3", "upload-file", "--bucket-name", "bench-bucket", "--local-file-path", "{files}"],
+    "s3-list-objects": ["s3", "list-objects", "--bucket-name", "bench-bucket", "--output", "{files}.ndjson"],
+    "s3-delete-file": ["s3", "delete-file", "--bucket-name", "bench-bucket", "--cut-off-days", "30"],
+    "iam-list-users": ["iam", "list-users"],
+    "iam-delete-old-keys": ["iam", "delete-old-keys", "--all-users", "--source", "api"],
+    "iam-delete-old-keys-report": ["iam", "delete-old-keys", "--all-users"],
+}
+
+# Allowed growth over the baseline before a metric counts as a regression.
+# Wall time depends on the machine and its load, so it is reported next to the baseline but never gated.
+TOLERANCE = {"api_calls": 0.0, "peak_rss_mb": 0.20, "rows_logged": 0.0}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:   # Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_local_files(directory, count):
+    for n in range(count):
+        subdir = os.path.join(directory, f"part-{n % 50:02d}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, f"artifact-{n:06d}.bin"), "wb") as file:
+            file.write(b"x" * 4096)
+
+
+# Runs inside a fresh interpreter so peak RSS belongs to this one action
+def run_one(name, scale):
+    import aws_standin
+    import logging_setup
+    import main
+
+    work = tempfile.mkdtemp(prefix="bench-")
+    logging_setup.log_path = work
+    logging_setup.log_file = os.path.join(work, "report.log")
+    logging_setup.csv_file = os.path.join(work, "report.csv")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    counter = aws_standin.install(int(INSTANCES * scale), int(OBJECTS * scale), int(USERS * scale))
+    files = os.path.join(work, "files")
+    if name == "s3-upload-file":
+        make_local_files(files, int(LOCAL_FILES * scale))
+
+    import iam_actions
+    iam_actions.CREDENTIAL_REPORT_CACHE = os.path.join(work, "credential_report.csv")
+
+    config = {"tag_to_check": "env", "stop_tag_value": "dev", "manifest_dir": work,
+              "account_id": "bench", "inventory_cache_path": os.path.join(work, "inventory.sqlite")}
+    sys.argv = ["main.py"] + [arg.format(files=files) for arg in SCENARIOS[name]]
+    args = main.get_args()
+
+    start = time.perf_counter()
+    main.run_action(main.get_actions(args.service), args, config)
+    logging_setup.get_audit_writer().flush()
+    wall = time.perf_counter() - start
+
+    with open(logging_setup.csv_file) as file:
+        rows = sum(1 for _ in file)
+    return {"wall_seconds": round(wall, 3), "api_calls": counter.total, "peak_rss_mb": peak_rss_mb(),
+            "rows_logged": rows, "calls": dict(counter.calls)}
+
+
+def run_isolated(name, scale):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", name, "--scale", str(scale)],
+                            capture_output=True, text=True, cwd=ROOT)
+    if output.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def compare(name, result, baseline):
+    regressions = []
+    for metric, tolerance in TOLERANCE.items():
+        old, new = baseline.get(metric), result.get(metric)
+        if old is None or new is None:
+            continue
+        if new > old * (1 + tolerance):
+            regressions.append(f"{name}: {metric} {old} -> {new} (allowed +{tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of every action against a local AWS stand-in")
+    parser.add_argument("--scale", type=float, default=0.1,
+                        help="Fixture size multiplier; 1.0 = 50k instances, 1M objects, 5k users (default:0.1, the committed baseline)")
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS), help="Run only these scenarios")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(args.run_one, args.scale)))
+        return
+
+    #Baselines are kept per scale; without one for this scale there is nothing to gate against
+    baselines = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as file:
+            baselines = json.load(file)
+    scale_key = str(args.scale)
+    baseline = baselines.get(scale_key, {})
+    names = args.only or list(SCENARIOS)
+    missing = [name for name in names if name not in baseline]
+    if missing and not args.update_baseline:
+        recorded = ", ".join(sorted(baselines)) or "none"
+        print(f"[ERROR] No baseline at scale {args.scale} for: {', '.join(missing)} (recorded scales: {recorded}).\n"
+              f"Run with a recorded --scale, or record one with --update-baseline.")
+        sys.exit(2)
+
+    results, regressions = {}, []
+    print(f"{'scenario':<28}{'wall s':>10}{'baseline s':>12}{'API calls':>12}{'peak RSS MB':>14}{'rows logged':>14}")
+    for name in names:
+        result = run_isolated(name, args.scale)
+        results[name] = result
+        rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "n/a"
+        was = baseline.get(name, {}).get("wall_seconds")
+        was = f"{was:.2f}" if was is not None else "n/a"
+        print(f"{name:<28}{result['wall_seconds']:>10.2f}{was:>12}{result['api_calls']:>12}{rss:>14}{result['rows_logged']:>14}")
+        if name in baseline:
+            regressions += compare(name, result, baseline[name])
+
+    if args.update_baseline:
+        baselines[scale_key] = dict(baseline, **results)
+        with open(BASELINE, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Baseline for scale {args.scale} written to {BASELINE}")
+        return
+
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo regressions against the scale {args.scale} baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logging_setup import AuditWriter
+
+
+# The pre-batching log_csv: open, write one row, close
+def per_row_log_csv(path, service, resource, action, status):
+    with open(path, "a", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow([service, resource, action, status, datetime.now(timezone.utc).isoformat()])
+
+
+def bench_per_row(path, rows):
+    start = time.perf_counter()
+    for i in range(rows):
+        per_row_log_csv(path, "S3", f"object-{i}", "file-added-to-deletelist", "Success")
+    return time.perf_counter() - start
+
+
+def bench_audit_writer(path, rows, batch_size):
+    writer = AuditWriter(path, batch_size=batch_size)
+    start = time.perf_counter()
+    for i in range(rows):
+        writer.write(["S3", f"object-{i}", "file-added-to-deletelist", "Success", datetime.now(timezone.utc).isoformat()])
+    writer.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row log_csv against the batched AuditWriter")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows to write (default:100000)")
+    parser.add_argument("--batch-size", type=int, default=500, help="AuditWriter batch size (default:500)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        per_row_path = os.path.join(tmp, "per_row.csv")
+        batched_path = os.path.join(tmp, "batched.csv")
+
+        per_row = bench_per_row(per_row_path, args.rows)
+        batched = bench_audit_writer(batched_path, args.rows, args.batch_size)
+
+        with open(batched_path) as file:
+            written = sum(1 for _ in file)
+
+    print(f"per-row log_csv : {args.rows / per_row:>12,.0f} rows/s ({per_row:.2f}s)")
+    print(f"AuditWriter     : {args.rows / batched:>12,.0f} rows/s ({batched:.2f}s, {written} rows written)")
+    print(f"speedup         : {per_row / batched:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aws_clients
+import ec2_actions
+
+
+# Build one describe_instances page with the fields a real response carries
+def make_page(page_number, page_size, total):
+    launch_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    first = page_number * page_size
+    instances = []
+    for n in range(first, min(first + page_size, total)):
+        instance_id = f"i-{n:017x}"
+        instances.append({
+            "InstanceId": instance_id,
+            "InstanceType": "t3.medium",
+            "ImageId": "ami-0123456789abcdef0",
+            "State": {"Code": 16, "Name": "running"},
+            "LaunchTime": launch_time,
+            "Placement": {"AvailabilityZone": "us-east-1a", "Tenancy": "default"},
+            "PrivateIpAddress": f"10.0.{(n >> 8) & 255}.{n & 255}",
+            "SubnetId": "subnet-0123456789abcdef0",
+            "VpcId": "vpc-0123456789abcdef0",
+            "SecurityGroups": [{"GroupName": "default", "GroupId": "sg-0123456789abcdef0"}],
+            "BlockDeviceMappings": [{"DeviceName": "/dev/xvda", "Ebs": {
+                "VolumeId": f"vol-{n:017x}", "Status": "attached", "AttachTime": launch_time, "DeleteOnTermination": True}}],
+            "Tags": [{"Key": "env", "Value": "dev"}, {"Key": "Name", "Value": f"worker-{n}"}],
+        })
+    return {"Reservations": [{"ReservationId": f"r-{page_number:017x}", "Instances": instances}]}
+
+
+# Stand-in for the EC2 client: each page is built fresh, the way botocore parses a response
+class StubPaginator:
+    def __init__(self, total, page_size=1000):
+        self.total = total
+        self.page_size = page_size
+
+    def paginate(self, **kwargs):
+        for page_number in range((self.total + self.page_size - 1) // self.page_size):
+            yield make_page(page_number, self.page_size, self.total)
+
+
+class StubClient:
+    def __init__(self, total):
+        self.total = total
+        self.meta = type("Meta", (), {"region_name": "us-east-1"})()
+
+    def get_paginator(self, name):
+        return StubPaginator(self.total)
+
+
+# The old list_instances kept every Instance resource, each holding its full describe payload
+def bench_resource_list(client):
+    instance_list = []
+    for page in client.get_paginator("describe_instances").paginate():
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                instance_list.append(instance)
+                _ = (instance["State"]["Name"], instance.get("Tags"))
+    return len(instance_list)
+
+
+def bench_record_stream(client):
+    return sum(1 for _ in ec2_actions.describe_instances(None))
+
+
+def measure(label, fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28}: {count} instances in {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory/latency of full resource listing vs streamed InstanceRecords")
+    parser.add_argument("--instances", type=int, default=50000, help="Synthetic fleet size (default:50000)")
+    args = parser.parse_args()
+
+    client = StubClient(args.instances)
+    aws_clients._clients[("ec2", None, None)] = client
+
+    measure("retained describe payloads", bench_resource_list, client)
+    measure("streamed InstanceRecords", bench_record_stream, client)
+
+
+if __name__ == "__main__":
+    main()
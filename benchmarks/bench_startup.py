@@ -0,0 +1,69 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs main.py in a fresh interpreter and stops it at the first API call. The shared client
+# registry sends every call through get_limiter, so the probe replaces it and reports
+# how long the process took to get there. Logs go to a scratch directory, never the configured one.
+PROBE = r"""
+import os, sys, time
+sys.path.insert(0, {root!r})
+sys.argv = ["main.py"] + {argv!r}
+import logging_setup
+logging_setup.log_path = {work!r}
+logging_setup.log_file = os.path.join({work!r}, "report.log")
+logging_setup.csv_file = os.path.join({work!r}, "report.csv")
+import aws_clients
+
+def first_call(family, account=None):
+    print(f"FIRST_CALL {{time.time()}} {{family}} {{len(sys.modules)}}", flush=True)
+    os._exit(0)
+
+aws_clients.get_limiter = first_call
+import main
+main.main()
+"""
+
+COMMANDS = [
+    ["iam", "list-keys", "--username", "benchmark-user"],
+    ["ec2", "list-instances"],
+    ["s3", "list-buckets"],
+]
+
+
+def time_to_first_call(argv):
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+               AWS_ACCESS_KEY_ID="benchmark", AWS_SECRET_ACCESS_KEY="benchmark")
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as work:
+        start = time.time()
+        output = subprocess.run([sys.executable, "-c", PROBE.format(root=ROOT, argv=argv, work=work)],
+                                capture_output=True, text=True, env=env, cwd=ROOT).stdout
+    for line in output.splitlines():
+        if line.startswith("FIRST_CALL"):
+            _, stamp, family, modules = line.split()
+            return float(stamp) - start, family, int(modules)
+    raise RuntimeError(f"{' '.join(argv)} never reached an API call:\n{output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time from process start to the first AWS API call")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per command (default:10)")
+    args = parser.parse_args()
+
+    for argv in COMMANDS:
+        timings = []
+        for _ in range(args.runs):
+            elapsed, family, modules = time_to_first_call(argv)
+            timings.append(elapsed)
+        print(f"{' '.join(argv):<45} median {statistics.median(timings) * 1000:7.1f} ms  "
+              f"min {min(timings) * 1000:7.1f} ms  ({family}, {modules} modules loaded)")
+
+
+if __name__ == "__main__":
+    main()
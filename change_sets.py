@@ -0,0 +1,53 @@
+import json
+import os
+from datetime import datetime, timezone
+from logging_setup import log_path, ensure_log_dir
+
+# Change sets for --dry-run / --apply
+# A change set is a JSON Lines file: the first line is a header (service, action, when it was
+# computed, permission checks, item count) and every following line is one affected resource.
+# Both sides stream, so a change set for ten million objects never sits in memory.
+
+
+def default_path(service, action, account=None):
+    ensure_log_dir()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    account = f"-{account}" if account else ""
+    return os.path.join(log_path, f"plan-{service}-{action}{account}-{stamp}.jsonl")
+
+
+def write_change_set(path, header, items):
+    count = 0
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        #Placeholder header; rewritten with the final count once all items are known
+        file.write(" " * 4096 + "\n")
+        for item in items:
+            file.write(json.dumps(item, default=str) + "\n")
+            count += 1
+        header = dict(header, items=count, created_at=datetime.now(timezone.utc).isoformat())
+        encoded = json.dumps(header, default=str)
+        if len(encoded) > 4096:
+            raise ValueError("Change set header is too large")
+        file.seek(0)
+        file.write(encoded.ljust(4096))
+    os.replace(tmp_path, path)
+    return header
+
+
+def read_header(path):
+    with open(path) as file:
+        return json.loads(file.readline())
+
+
+def read_items(path):
+    with open(path) as file:
+        file.readline()
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def plan_age_hours(header):
+    created = datetime.fromisoformat(header["created_at"])
+    return (datetime.now(timezone.utc) - created).total_seconds() / 3600
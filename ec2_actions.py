@@ -1,103 +1,486 @@
-import boto3
 from botocore.exceptions import ClientError
 from logging_setup import log_csv, logging
+from aws_clients import get_client, inherit_account
+from inventory_cache import get_inventory_cache, invalidate_inventory, open_cache
+from tag_policy import load_rules, single_tag_rule, plan_queries, first_match, has_wildcard
+from idle_detection import get_idle_settings, metric_window, instance_stats, score
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import queue
 import time
 
-ec2 = boto3.resource('ec2')
+# Client per region from the shared registry; None is the default region from the environment/profile
+def ec2_client(region=None):
+    return get_client("ec2", region)
 
-#List all instances
-def list_instances(args, config):
-    print("\n=== All Instances ===")
-    instance_list = []
-    for instance in ec2.instances.all():
+
+# Regions from --regions or config ("all" expands to every enabled region); [None] means the default region
+def get_regions(args, config):
+    regions = getattr(args, "regions", None) or config.get("regions")
+    if not regions:
+        return [None]
+    if isinstance(regions, str):
+        regions = [regions]
+    if "all" in regions:
+        response = ec2_client().describe_regions(AllRegions=False)
+        regions = sorted(region["RegionName"] for region in response["Regions"])
+    return regions
+
+
+def region_name(region):
+    return region or ec2_client().meta.region_name
+
+
+# Run fetch(region) for every region at once and merge what they produce into one stream of (region, item).
+# Items are yielded as soon as any region produces them, so a slow or failing region never holds up the others.
+def fan_out_regions(regions, fetch, max_workers=16):
+    if not regions:
+        return
+    results = queue.Queue()
+    done = object()
+
+    def run(region):
         try:
-            instance_list.append(instance)
-            logging.info(f"ID: {instance.id} | State: {instance.state['Name']} | Tags: {instance.tags}")
-            log_csv("EC2", instance.id, "Listing Instance", "Success")
+            for item in fetch(region):
+                results.put((region, item))
         except ClientError as e:
-            logging.error(f"An AWS error occured while trying to list instances: ({e.response['Error']['Code']}): {e}")
-            log_csv("EC2", instance.id, "Listing Instance", "Failed")
+            logging.error(f"AWS error occured in region {region_name(region)} ({e.response['Error']['Code']}): {e}")
+            log_csv("EC2", region_name(region), "region query", "Failed")
         except Exception as e:
-            logging.error(f"An unexpected error occured: {e}")
-            log_csv("EC2", instance.id, "Listing Instance", "Failed")
+            logging.error(f"An error occured in region {region_name(region)}: {e}")
+            log_csv("EC2", region_name(region), "region query", "Failed")
+        finally:
+            results.put(done)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions))), initializer=inherit_account()) as pool:
+        for region in regions:
+            pool.submit(run, region)
+        remaining = len(regions)
+        while remaining:
+            item = results.get()
+            if item is done:
+                remaining -= 1
+            else:
+                yield item
+
+
+# Lightweight projection of a describe_instances entry; only the fields the tool uses are kept
+class InstanceRecord:
+    __slots__ = ("id", "state", "type", "tags", "region", "launch_time")
+
+    def __init__(self, id, state, type, tags, region, launch_time):
+        self.id = id
+        self.state = state
+        self.type = type
+        self.tags = tags
+        self.region = region
+        self.launch_time = launch_time
 
-            
-    return instance_list
+    @classmethod
+    def from_api(cls, instance, region):
+        return cls(
+            instance["InstanceId"],
+            instance["State"]["Name"],
+            instance.get("InstanceType"),
+            {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])},
+            region,
+            instance.get("LaunchTime"),
+        )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "type": self.type,
+            "tags": self.tags,
+            "region": self.region,
+            "launch_time": self.launch_time.isoformat() if self.launch_time else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        launch_time = datetime.fromisoformat(data["launch_time"]) if data.get("launch_time") else None
+        return cls(data["id"], data["state"], data["type"], data["tags"], data["region"], launch_time)
+
+    def __repr__(self):
+        return f"InstanceRecord({self.id}, {self.state}, {self.region})"
+
+
+# Stream InstanceRecords from the describe_instances paginator; raw pages are dropped as soon as they are projected
+def describe_instances(region, filters=None, page_size=1000):
+    paginator = ec2_client(region).get_paginator("describe_instances")
+    name = region_name(region)
+    for page in paginator.paginate(Filters=filters or [], PaginationConfig={"PageSize": page_size}):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                yield InstanceRecord.from_api(instance, name)
+
+
+# One region's instances: served from the inventory cache when it is fresh enough,
+# otherwise listed live and written back to the cache as they stream past
+def region_instances(region, cache=None, max_age=None):
+    name = region_name(region)
+    if cache and cache.is_fresh(name, "ec2", max_age):
+        for data in cache.read(name, "ec2"):
+            yield InstanceRecord.from_dict(data)
+        return
+
+    records = describe_instances(region)
+    if cache:
+        refreshed = cache.refresh(name, "ec2", (record.to_dict() for record in records),
+                                  key_fn=lambda data: data["id"], tags_fn=lambda data: data["tags"])
+        records = (InstanceRecord.from_dict(data) for data in refreshed)
+    yield from records
+
+
+#List all instances (as a generator, so the fleet is never held in memory)
+def list_instances(args, config):
+    print("\n=== All Instances ===")
+    cache, max_age = get_inventory_cache(args, config)
+    for _, instance in fan_out_regions(get_regions(args, config), lambda region: region_instances(region, cache, max_age)):
+        logging.info(f"[{instance.region}] ID: {instance.id} | State: {instance.state} | Type: {instance.type} | Tags: {instance.tags}")
+        log_csv("EC2", instance.id, "Listing Instance", "Success")
+        yield instance
          
 
 
+#Rules to select with: --tag-key/--tag-value, else the config tag_policies (optionally --rules), else the legacy config pair
+def get_selection_rules(args, config):
+    tag_key, tag_value = getattr(args, "tag_key", None), getattr(args, "tag_value", None)
+    if tag_key or tag_value:
+        if not tag_key or not tag_value:
+            return None
+        return [single_tag_rule(tag_key, tag_value)]
+    if config.get("tag_policies"):
+        return load_rules(config, getattr(args, "rules", None))
+    tag_key, tag_value = config.get("tag_to_check"), config.get("stop_tag_value")
+    if not tag_key or not tag_value:
+        return None
+    return [single_tag_rule(tag_key, tag_value)]
+
+
+# Find instances selected by the tag policy in every selected region, as (region, instance id)
+def select_instances(args, config, regions):
+    rules = get_selection_rules(args, config)
+    if not rules:
+        print("[ERROR] Both --tag-key and --tag-value must be provided, or set in config (tag_policies or tag_to_check/stop_tag_value).")
+        return []
+
+    queries = plan_queries(rules)
+    logging.info(f"{len(rules)} rule(s) compiled into {len(queries)} describe_instances quer{'y' if len(queries) == 1 else 'ies'}: "
+                 + "; ".join(str(query.api_filters()) for query in queries))
+    cache, max_age = get_inventory_cache(args, config)
+
+    #Server-side filters narrow each query; every rule is then checked locally, in policy order, on what comes back.
+    #A fresh cache answers from its tag index (single tag rule) or a local pass, with no API calls
+    def matches(region):
+        name = region_name(region)
+        if cache and cache.is_fresh(name, "ec2", max_age):
+            single = len(rules) == 1 and [key for key in rules[0].filters if key.startswith("tag:")]
+            #The tag index matches exactly, so wildcard values stay on the local pass
+            if single and len(rules[0].filters[single[0]]) == 1 and not has_wildcard(next(iter(rules[0].filters[single[0]]))):
+                tag_key, tag_value = single[0][4:], next(iter(rules[0].filters[single[0]]))
+                records = (InstanceRecord.from_dict(data) for data in cache.read_by_tag(name, "ec2", tag_key, tag_value))
+            else:
+                records = (InstanceRecord.from_dict(data) for data in cache.read(name, "ec2"))
+            for record in records:
+                rule = first_match(rules, record)
+                if rule:
+                    yield record, rule
+            return
+
+        seen = set()
+        for query in queries:
+            for record in describe_instances(region, query.api_filters()):
+                if record.id in seen:
+                    continue
+                seen.add(record.id)
+                rule = first_match(rules, record)
+                if rule:
+                    yield record, rule
+
+    selected = []
+    for region, (instance, rule) in fan_out_regions(regions, matches):
+        selected.append((region, instance.id))
+        logging.info(f"[MATCH] [{instance.region}] {instance.id} -> selected by rule {rule.name} (Tags: {instance.tags})")
+        log_csv("EC2", instance.id, f"filtering for instances (rule {rule.name})", "Success")
+    match_count = len(selected)
+    if match_count == 1:
+         print(f"There is {match_count} match for the search")
+    else:
+        print(f"There are {match_count} matches for the search")
+    log_csv("EC2", None, f"[MATHCES] {match_count}", "Success")
+
+    return selected
+
+
 # Filter running instances and select those to stop and add them a selected list
 def filter_instances(args, config):
-    instances_to_stop = []
-    tag_key = args.tag_key or config.get("tag_to_check")
-    tag_value = args.tag_value or config.get("stop_tag_value")
+    return [instance_id for _, instance_id in select_instances(args, config, get_regions(args, config))]
 
-    if not tag_key or not tag_value:
-        print("[ERROR] Both --tag-key and --tag-value must be provided, or set in config.")
-        return []
-    
-    for instance in ec2.instances.filter(Filters=[ {"Name": f"tag:{tag_key}", "Values": [tag_value]},
-                                                  {'Name': 'instance-state-name', 'Values': ['running']}]):
+
+# One region's running instances with their window statistics. Statistics for the current window are
+# served from the inventory cache until the window moves on by a period; thresholds are applied after,
+# so changing them never needs new metric data
+def region_idle_stats(region, settings, cache, refresh=False):
+    name = region_name(region)
+    service = f"ec2-idle/{settings['lookback_days']}d-{settings['period']}s"
+    _, window_end = metric_window(settings)
+    if cache and not refresh and cache.is_fresh(name, service, time.time() - window_end.timestamp()):
+        yield from cache.read(name, service)
+        return
+
+    records = {record.id: record for record in describe_instances(region, [{"Name": "instance-state-name", "Values": ["running"]}])}
+    stats = (dict(entry, type=records[entry["id"]].type, tags=records[entry["id"]].tags)
+             for entry in instance_stats(get_client("cloudwatch", region), list(records), settings))
+    if cache:
+        stats = cache.refresh(name, service, stats, key_fn=lambda entry: entry["id"])
+    yield from stats
+
+
+# Score running instances on CPU and network use over the lookback window, in every selected region at once
+def idle_instances(args, config, regions):
+    settings = get_idle_settings(args, config)
+    cache = open_cache(config)
+    refresh = getattr(args, "refresh_metrics", False)
+    logging.info(f"Idle when p95 CPU < {settings['cpu_threshold']}% and p95 network < {settings['network_threshold_mb']} MB/h "
+                 f"over {settings['lookback_days']} day(s) ({settings['period']}s periods)")
+
+    idle, scored = [], 0
+    for region, stats in fan_out_regions(regions, lambda region: region_idle_stats(region, settings, cache, refresh)):
+        result = score(stats, settings)
+        scored += 1
+        if not result["idle"]:
+            logging.debug(f"[{region_name(region)}] {result['id']}: {result['reason']} (score {result['score']})")
+            continue
+        idle.append((region, result["id"]))
+        logging.info(f"[IDLE] [{region_name(region)}] {result['id']} ({result['type']}) score {result['score']} | "
+                     f"CPU p95 {result['cpu_p95']:.2f}% max {result['cpu_max']:.2f}% | "
+                     f"network p95 {result['network_mb_per_hour_p95'] or 0:.2f} MB/h | Name: {result['tags'].get('Name', '-')}")
+        log_csv("EC2", result["id"], f"idle instance (score {result['score']})", "Success")
+    print(f"{len(idle)} of {scored} running instance(s) are idle")
+    return idle
+
+
+#Idle instance IDs; as a plan-runner step they feed straight into stop-instances
+def find_idle(args, config):
+    return [instance_id for _, instance_id in idle_instances(args, config, get_regions(args, config))]
+
+
+EC2_BATCH_SIZE = 1000   # InstanceIds per stop_instances call
+FILTER_BATCH_SIZE = 200  # values per describe_instances filter
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# One poller tracks every pending instance with batched describe_instances calls,
+# reporting each instance as soon as it reaches "stopped"
+def wait_until_stopped(client, instance_ids, timeout=600, delay=2, max_delay=15):
+    pending = set(instance_ids)
+    stopped, states = [], {}
+    deadline = time.monotonic() + timeout
+
+    paginator = client.get_paginator("describe_instances")
+
+    while pending:
+        #Filter by instance-id rather than InstanceIds so one terminated ID cannot fail the whole batch
+        for batch in chunked(sorted(pending), FILTER_BATCH_SIZE):
+            seen = set()
+            try:
+                for page in paginator.paginate(Filters=[{"Name": "instance-id", "Values": batch}]):
+                    for reservation in page["Reservations"]:
+                        for instance in reservation["Instances"]:
+                            instance_id = instance["InstanceId"]
+                            state = instance["State"]["Name"]
+                            states[instance_id] = state
+                            seen.add(instance_id)
+                            if instance_id not in pending:
+                                continue
+                            if state == "stopped":
+                                pending.discard(instance_id)
+                                stopped.append(instance_id)
+                                logging.info(f"[DONE] {instance_id} is now stopped")
+                                log_csv("EC2", instance_id, "stopped instance", "Success")
+                            elif state in ("shutting-down", "terminated"):
+                                #It will never reach "stopped"; stop polling for it
+                                pending.discard(instance_id)
+                                logging.warning(f"{instance_id} is {state}, not stopping")
+                                log_csv("EC2", instance_id, "stopped instance", "Terminated")
+            except ClientError as e:
+                logging.error(f"AWS error occured while polling instance states ({e.response['Error']['Code']}): {e}")
+                continue
+
+            #IDs a complete poll no longer returns are gone
+            for instance_id in set(batch) - seen:
+                pending.discard(instance_id)
+                logging.warning(f"{instance_id} no longer exists, not waiting for it")
+                log_csv("EC2", instance_id, "stopped instance", "NotFound")
+
+        if not pending:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        logging.info(f"[WAITING].. {len(pending)} instance(s) still stopping, next check in {delay:.0f}s")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, max_delay)
+
+    for instance_id in sorted(pending):
+        logging.error(f"Timed out waiting for {instance_id} to stop (last state: {states.get(instance_id, 'unknown')})")
+        log_csv("EC2", instance_id, "stopped instance", "Timeout")
+    return stopped
+
+
+# Work out which region each instance ID lives in (only needed when more than one region is selected)
+def locate_instances(instance_ids, regions):
+    located = {}
+    def fetch(region):
+        for batch in chunked(list(instance_ids), FILTER_BATCH_SIZE):
+            yield from describe_instances(region, [{"Name": "instance-id", "Values": batch}])
+    for region, instance in fan_out_regions(regions, fetch):
+        located[instance.id] = region
+    for instance_id in instance_ids:
+        if instance_id not in located:
+            logging.error(f"{instance_id} was not found in any selected region")
+            log_csv("EC2", instance_id, "stopped instance", "Not-found")
+    return [(region, instance_id) for instance_id, region in located.items()]
+
+
+# Stop one region's instances in batches, then wait on them with the shared poller
+def stop_region_instances(region, instance_ids, timeout):
+    client = ec2_client(region)
+    requested = []
+
+    for batch in chunked(list(instance_ids), EC2_BATCH_SIZE):
         try:
-                instances_to_stop.append(instance.id)
-                logging.info(f"[MATCH] {instance.id} -> Will be stopped (Tags: {tag_key}, {tag_value})")
-                log_csv("EC2", instance.id, "filtering for instances", "Success")
+            client.stop_instances(InstanceIds=batch)
+            logging.info(f"[{region_name(region)}] Stopping {len(batch)} instance(s): {', '.join(batch[:10])}{' ...' if len(batch) > 10 else ''}")
+            for instance_id in batch:
+                log_csv("EC2", instance_id, "Waiting to stop", "Success")
+            requested.extend(batch)
         except ClientError as e:
-                logging.error(f"AWS error occurred while filtering instances ({e.response['Error']['Code']}): {e}")
-                log_csv("EC2", instance.id, "filtering for instances", "Failed")
+            logging.error(f"AWS error occured while trying to Stop instances {batch}: ({e.response['Error']['Code']}): {e}")
+            for instance_id in batch:
+                log_csv("EC2", instance_id, "stopped instance", "Failed")
         except Exception as e:
-                logging.error(f"An Error occured while stopping instances {e}")
-                log_csv("EC2", instance.id, "filtering for instances", "Failed")
-    matches = len(instances_to_stop)
-    if matches == 1:
-         print(f"There is {matches} match for the search")
-    else:
-        print(f"There are {matches} matches for the search")
-    log_csv("EC2", None, f"[MATHCES] {matches}", "Success")
+            logging.error(f"An error occured while trying to Stop instances {batch}: {e}")
+            for instance_id in batch:
+                log_csv("EC2", instance_id, "stopped instance", "Failed")
 
+    if not requested:
+        return []
 
-    return instances_to_stop
-             
+    return wait_until_stopped(client, requested, timeout=timeout)
+
+
+# Resolve what stop-instances would act on as (region, instance id) pairs
+def resolve_stop_targets(args, config, instances_to_stop=None):
+    regions = get_regions(args, config)
 
-# Stop all instances in the list
-def stop_instances(args, config, instances_to_stop=None):
     if args.instance_ids:
         instances_to_stop = args.instance_ids
-    elif config.get("instance_ids"):
+    elif getattr(args, "idle", False):
+        return idle_instances(args, config, regions)
+    elif instances_to_stop is None and config.get("instance_ids"):
         instances_to_stop = config.get("instance_ids")
-    elif instances_to_stop is None:
-        instances_to_stop = filter_instances(args, config)
-    
 
-    if not instances_to_stop:
+    if instances_to_stop is None:
+        return select_instances(args, config, regions)
+    elif len(regions) == 1:
+        return [(regions[0], instance_id) for instance_id in instances_to_stop]
+    return locate_instances(instances_to_stop, regions)
+
+
+# Stop every target region by region (in parallel) and invalidate the cached inventory
+def stop_targets(targets, config, timeout):
+    by_region = {}
+    for region, instance_id in targets:
+        by_region.setdefault(region, []).append(instance_id)
+
+    stopped_instances_list = []
+    for _, instance_id in fan_out_regions(list(by_region),
+                                          lambda region: stop_region_instances(region, by_region[region], timeout)):
+        stopped_instances_list.append(instance_id)
+
+    for region in by_region:
+        invalidate_inventory(config, "ec2", region_name(region))
+        invalidate_inventory(config, "ec2-idle", region_name(region))
+
+    return stopped_instances_list
+
+
+# Stop all instances in the list
+def stop_instances(args, config, instances_to_stop=None):
+    targets = resolve_stop_targets(args, config, instances_to_stop)
+
+    if not targets:
         logging.info("No matching instances to stop")
         log_csv("EC2", None, "stopped instance", "No-match")
         return
     
-    stopped_instances_list = []
+    timeout = getattr(args, "timeout", None) or config.get("stop_timeout_seconds", 600)
+    return stop_targets(targets, config, timeout)
 
+
+# EC2's own DryRun=True check: DryRunOperation means the real call would be allowed
+def check_stop_permission(region, instance_ids):
     try:
-            ec2.meta.client.stop_instances(InstanceIds=instances_to_stop)
-            logging.info(f"\nStopping instances: {instances_to_stop}")
-            for instance_id in instances_to_stop:
-                instance = ec2.Instance(instance_id)
-                logging.info(f"[WAITING].. Stopping {instance.id} -> State: {instance.state['Name']}")
-                log_csv("EC2", instance_id, "Waiting to stop", "Success")
-                #time.sleep(2)
-                ec2.meta.client.get_waiter('instance_stopped').wait(InstanceIds=instances_to_stop)
-                instance.reload()
-                logging.info(f"[DONE] {instance.id} is now stopped")
-                log_csv("EC2", instance_id, "stopped instance", "Success")
-                stopped_instances_list.append(instance_id)
+        ec2_client(region).stop_instances(InstanceIds=instance_ids[:EC2_BATCH_SIZE], DryRun=True)
     except ClientError as e:
-                logging.error(f"AWS error occured while trying to Stop instance {instance_id}: ({e.response['Error']['Code']}): {e}")
-                log_csv("EC2", instance_id, "stopped instance", "Failed")
-    except Exception as e:
-                logging.error(f"An error occured while trying to Stop instance {instance_id}: {e}")
-                log_csv("EC2", instance_id, "stopped instance", "Failed")
+        code = e.response["Error"]["Code"]
+        if code == "DryRunOperation":
+            return "allowed"
+        return f"denied ({code})"
+    return "allowed"
 
 
-    return stopped_instances_list
+#--dry-run: resolve the targets once, check permission per region and record them
+def plan_stop_instances(args, config):
+    targets = resolve_stop_targets(args, config)
+    by_region = {}
+    for region, instance_id in targets:
+        by_region.setdefault(region, []).append(instance_id)
+
+    checks = {region_name(region): check_stop_permission(region, ids) for region, ids in by_region.items()}
+    for name, result in checks.items():
+        logging.info(f"[DryRun] stop-instances in {name}: {result}")
+    header = {"permission_checks": checks}
+    items = ({"region": region, "region_name": region_name(region), "id": instance_id} for region, instance_id in targets)
+    return header, items
+
+
+# Drop targets that are no longer running (one batched describe per region)
+def still_running(targets):
+    by_region = {}
+    for region, instance_id in targets:
+        by_region.setdefault(region, []).append(instance_id)
+
+    def fetch(region):
+        for batch in chunked(by_region[region], FILTER_BATCH_SIZE):
+            yield from describe_instances(region, [{"Name": "instance-id", "Values": batch},
+                                                   {"Name": "instance-state-name", "Values": ["running"]}])
+    running = {(region, instance.id) for region, instance in fan_out_regions(list(by_region), fetch)}
+    for target in targets:
+        if target not in running:
+            logging.info(f"[STALE] {target[1]} is no longer running, skipping")
+            log_csv("EC2", target[1], "stopped instance", "Stale")
+    return [target for target in targets if target in running]
+
+
+#--apply: stop exactly the instances in the change set, in the regions the plan resolved
+#(not "the default region", which may be a different one wherever the plan is applied)
+def apply_stop_instances(header, items, args, config):
+    targets = [(item["region_name"], item["id"]) for item in items]
+    if getattr(args, "check_stale", False):
+        targets = still_running(targets)
+    if not targets:
+        logging.info("No matching instances to stop")
+        return []
+    timeout = getattr(args, "timeout", None) or config.get("stop_timeout_seconds", 600)
+    return stop_targets(targets, config, timeout)
 
 
 
@@ -105,4 +488,10 @@ EC2_ACTIONS = {
      "list-instances": list_instances,
      "filter-instances": filter_instances,
      "stop-instances": stop_instances,
+     "find-idle": find_idle,
+}
+
+
+EC2_PLANNERS = {
+    "stop-instances": (plan_stop_instances, apply_stop_instances),
 }
@@ -1,17 +1,69 @@
-import boto3
 from botocore.exceptions import ClientError
-from logging_setup import logging, log_csv
+from logging_setup import logging, log_csv, log_path, ensure_log_dir
+from aws_clients import get_client, inherit_account, current_account
+from inventory_cache import get_inventory_cache, invalidate_inventory
+from instrumentation import THROTTLE_CODES
+from collections import deque
 from datetime import datetime, timedelta, timezone
-
-
-#Creating the boto3 object
-iam = boto3.client('iam')
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
+import csv
+import os
+
+
+#IAM client from the shared registry
+def iam_client():
+    return get_client("iam")
+
+
+#Shared adaptive backoff: every worker slows down when IAM throttles and speeds back up as calls succeed
+class AdaptiveThrottle:
+    def __init__(self, base_delay=0.0, max_delay=20.0, max_attempts=8):
+        self.delay = base_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+    def call(self, fn, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            with self._lock:
+                delay = self.delay
+            if delay:
+                time.sleep(delay)
+            try:
+                result = fn(**kwargs)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLE_CODES or attempt == self.max_attempts:
+                    raise
+                with self._lock:
+                    self.delay = min(max(self.delay * 2, 0.25), self.max_delay)
+                logging.warning(f"IAM throttled {fn.__name__}, backing off to {self.delay:.2f}s between calls")
+                continue
+            with self._lock:
+                self.delay = max(self.base_delay, self.delay * 0.8 if self.delay > 0.05 else 0.0)
+            return result
+
+
+#Page through every IAM user in the account
+def iter_users():
+    paginator = iam_client().get_paginator("list_users")
+    for page in paginator.paginate():
+        yield from page["Users"]
 
 
 def list_users(args, config):
     try:
-        users = iam.list_users()
-        usernames = [user['UserName'] for user in users['Users']]
+        cache, max_age = get_inventory_cache(args, config)
+        if cache and cache.is_fresh("global", "iam-users", max_age):
+            usernames = [user["UserName"] for user in cache.read("global", "iam-users")]
+        else:
+            users = iter_users()
+            if cache:
+                users = cache.refresh("global", "iam-users", ({"UserName": user["UserName"]} for user in users),
+                                      key_fn=lambda user: user["UserName"])
+            usernames = [user['UserName'] for user in users]
         for username in usernames:
             print(f'\nUser: {username}')
         logging.info(f"Usernames listed successfully: {usernames} ")
@@ -32,7 +84,13 @@ def list_keys(args, config):
 
 
     try: 
-        keys = iam.list_access_keys(UserName=username)["AccessKeyMetadata"]
+        cache, max_age = get_inventory_cache(args, config)
+        if cache and cache.is_fresh("global", f"iam-keys/{username}", max_age):
+            keys = list(cache.read("global", f"iam-keys/{username}"))
+        else:
+            keys = iam_client().list_access_keys(UserName=username)["AccessKeyMetadata"]
+            if cache:
+                deque(cache.refresh("global", f"iam-keys/{username}", keys, key_fn=lambda key: key["AccessKeyId"]), maxlen=0)
 
         if not keys:
             print(f"{username} does not have any keys at the moment")
@@ -60,7 +118,8 @@ def create_new_key(args, config, username=None):
         username = "user-adeoye"
 
     try:
-        new_key = iam.create_access_key(UserName=username)
+        new_key = iam_client().create_access_key(UserName=username)
+        invalidate_inventory(config, f"iam-keys/{username}")
         logging.info(f"New Access Key has been created for {username} successfully")
         log_csv("IAM", username, "Creating a new Access-Key", "Success")
         print("New Access keyId:", new_key['AccessKey']['AccessKeyId'])
@@ -85,7 +144,8 @@ def delete_key(args, config):
         return
 
     try:
-        iam.delete_access_key(UserName=username, AccessKeyId=key_id)
+        iam_client().delete_access_key(UserName=username, AccessKeyId=key_id)
+        invalidate_inventory(config, f"iam-keys/{username}")
         logging.info(f"Deleted access key {key_id} for user {username}.")
         log_csv("IAM", username, "Delete-Specific-Key", "Success")
     except Exception as e:
@@ -98,7 +158,7 @@ def delete_key(args, config):
 
 #helper function to filter for old iam keys
 def find_old_keys(username, cutoff_days):
-    keys = iam.list_access_keys(UserName=username)["AccessKeyMetadata"]
+    keys = iam_client().list_access_keys(UserName=username)["AccessKeyMetadata"]
     cutoff = datetime.now(timezone.utc) - timedelta(days=cutoff_days)
 
     old_keys = [
@@ -110,33 +170,303 @@ def find_old_keys(username, cutoff_days):
 
 
 
+#Delete one user's keys older than cut_off_days
+def delete_user_old_keys(username, cut_off_days, config):
+    old_keys = find_old_keys(username, cut_off_days)
+
+
+    if not old_keys:
+        logging.info(f"No old keys to delete for {username}")
+        return 0
+    
+
+    for key in old_keys:  
+        iam_client().delete_access_key(UserName=username, AccessKeyId=key)
+        logging.info(f"Old key for {username} has been deleted successfully")
+        log_csv("IAM", username, "Deleting-old-Access-Key", "Success")
+    invalidate_inventory(config, f"iam-keys/{username}")
+    return len(old_keys)
+
+
 def delete_old_keys(args, config):
     username = args.username or config.get("username")
     cut_off_days = args.key_max_age or config.get("key_max_age", 30)
 
+    if getattr(args, "all_users", False):
+        return delete_old_keys_all_users(args, config, cut_off_days)
+
     if not username:
         logging.error("No username provided (CLI or Config)")
         return
 
-    old_keys = find_old_keys(username, cut_off_days)
+    delete_user_old_keys(username, cut_off_days, config)
 
 
-    if not old_keys:
-        logging.info(f"No old keys to delete for {username}")
-        return
-    
+#Users that may have old keys: picked from the credential report, or every user with --source api
+def old_key_candidates(args, config, cut_off_days):
+    cutoff = datetime.now(timezone.utc) - timedelta(days=cut_off_days)
+
+    if (getattr(args, "source", None) or config.get("key_source", "credential-report")) == "api":
+        return [user["UserName"] for user in iter_users()]
+
+    candidates = set()
+    for key in iter_report_keys(config, getattr(args, "include_new_users", False)):
+        if key["last_rotated"] < cutoff:
+            candidates.add(key["username"])
+    return sorted(candidates)
 
-    for key in old_keys:  
-        iam.delete_access_key(UserName=username, AccessKeyId=key)
-        logging.info(f"Old key for {username} has been deleted successfully")
-        log_csv("IAM", username, "Deleting-old-Access-Key", "Success")
+
+#Account-wide delete-old-keys: the credential report (or a full API scan) picks the users to touch,
+#and only those users get per-user calls to resolve key IDs
+def delete_old_keys_all_users(args, config, cut_off_days):
+    candidates = old_key_candidates(args, config, cut_off_days)
+
+    deleted = 0
+    for username in candidates:
+        try:
+            deleted += delete_user_old_keys(username, cut_off_days, config)
+        except Exception as e:
+            logging.error(f"Error deleting old keys for {username}: {e}")
+            log_csv("IAM", username, "Deleting-old-Access-Key", "Failed")
+    logging.info(f"Deleted {deleted} access keys older than {cut_off_days} days across {len(candidates)} users")
+    return deleted
+
+
+#--dry-run: resolve exactly which keys delete-old-keys would remove
+def plan_delete_old_keys(args, config):
+    cut_off_days = args.key_max_age or config.get("key_max_age", 30)
+    if getattr(args, "all_users", False):
+        usernames = old_key_candidates(args, config, cut_off_days)
+    else:
+        usernames = [args.username or config.get("username")]
+
+    def items():
+        for username in usernames:
+            for key_id in find_old_keys(username, cut_off_days):
+                yield {"username": username, "access_key_id": key_id}
+    return {"key_max_age": cut_off_days}, items()
+
+
+def plan_delete_key(args, config):
+    username = args.username or config.get("username")
+    return {}, iter([{"username": username, "access_key_id": args.access_key_id}])
+
+
+#--apply: delete exactly the keys in the change set
+def apply_delete_keys(header, items, args, config):
+    deleted, users = 0, set()
+    for item in items:
+        username, key_id = item["username"], item["access_key_id"]
+        try:
+            iam_client().delete_access_key(UserName=username, AccessKeyId=key_id)
+            logging.info(f"Deleted access key {key_id} for user {username}.")
+            log_csv("IAM", username, "Deleting-planned-Access-Key", "Success")
+            deleted += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchEntity":
+                logging.info(f"[STALE] Access key {key_id} for {username} no longer exists, skipping")
+                log_csv("IAM", username, "Deleting-planned-Access-Key", "Stale")
+            else:
+                logging.error(f"Error deleting access key {key_id} for {username}: {e}")
+                log_csv("IAM", username, "Deleting-planned-Access-Key", "Failed")
+        users.add(username)
+    for username in users:
+        invalidate_inventory(config, f"iam-keys/{username}")
+    return deleted
+
+
+#Credential report: one CSV covering every user's keys, generated by IAM and cached locally
+#until it falls outside its validity window
+CREDENTIAL_REPORT_CACHE = os.path.join(log_path, "credential_report.csv")
+
+
+#One cached report per account
+def credential_report_path():
+    account = current_account()
+    if not account:
+        return CREDENTIAL_REPORT_CACHE
+    base, extension = os.path.splitext(CREDENTIAL_REPORT_CACHE)
+    return f"{base}-{account}{extension}"
+
+
+def fetch_credential_report(config, timeout=120):
+    max_age_hours = config.get("credential_report_max_age_hours", 4)
+    path = credential_report_path()
+    if os.path.exists(path):
+        generated = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        if datetime.now(timezone.utc) - generated < timedelta(hours=max_age_hours):
+            logging.info(f"Using cached credential report generated at {generated.isoformat()}")
+            return path, generated
+
+    deadline = time.monotonic() + timeout
+    delay = 1
+    while iam_client().generate_credential_report()["State"] != "COMPLETE":
+        if time.monotonic() > deadline:
+            raise TimeoutError("Credential report generation did not complete in time")
+        time.sleep(delay)
+        delay = min(delay * 2, 10)
+
+    report = iam_client().get_credential_report()
+    ensure_log_dir()
+    generated = report["GeneratedTime"]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(report["Content"])
+    os.replace(tmp_path, path)
+    #The file's mtime records when IAM generated the report, which drives cache expiry
+    os.utime(path, (generated.timestamp(), generated.timestamp()))
+    log_csv("IAM", "N/A", "Credential report downloaded", "Success")
+    return path, generated
+
+
+def parse_report_date(value):
+    if not value or value in ("N/A", "no_information", "not_supported"):
+        return None
+    return datetime.fromisoformat(value)
+
+
+#Users created after the report was generated: only when asked to, or when the account holds more
+#users than the report lists (one GetAccountSummary call), is the full user list paged through
+def report_missing_users(config, covered, include_new_users):
+    if include_new_users or config.get("credential_report_include_new_users"):
+        return True
+    users = iam_client().get_account_summary()["SummaryMap"].get("Users", 0)
+    if users > len(covered):
+        logging.info(f"The account has {users} users and the credential report {len(covered)}; looking up the others")
+        return True
+    return False
+
+
+#Stream one entry per access key slot from the report; users the report does not cover yet
+#are looked up per user and marked uncovered
+def iter_report_keys(config, include_new_users=False):
+    path, generated = fetch_credential_report(config)
+    covered = set()
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file):
+            if row["user"] == "<root_account>":
+                continue
+            covered.add(row["user"])
+            for slot in (1, 2):
+                last_rotated = parse_report_date(row[f"access_key_{slot}_last_rotated"])
+                if not last_rotated:
+                    continue
+                yield {
+                    "username": row["user"],
+                    "slot": slot,
+                    "status": "Active" if row[f"access_key_{slot}_active"] == "true" else "Inactive",
+                    "last_rotated": last_rotated,
+                    "last_used": parse_report_date(row[f"access_key_{slot}_last_used_date"]),
+                    "uncovered": False,
+                }
+
+    if not report_missing_users(config, covered, include_new_users):
+        return
+    paginator = iam_client().get_paginator("list_users")
+    for page in paginator.paginate(PaginationConfig={"PageSize": 1000}):
+        for user in page["Users"]:
+            if user["UserName"] in covered:
+                continue
+            keys = iam_client().list_access_keys(UserName=user["UserName"])["AccessKeyMetadata"]
+            for slot, key in enumerate(keys, start=1):
+                yield {
+                    "username": user["UserName"],
+                    "slot": slot,
+                    "status": key["Status"],
+                    "last_rotated": key["CreateDate"],
+                    "last_used": None,
+                    "uncovered": True,
+                }
+
+
+#Account-wide key-age report straight from the credential report
+def key_age_report(args, config):
+    now = datetime.now(timezone.utc)
+    count = 0
+    for key in iter_report_keys(config, getattr(args, "include_new_users", False)):
+        last_used = key["last_used"].isoformat() if key["last_used"] else "Never"
+        print(f"User: {key['username']} | Key {key['slot']} | Status: {key['status']} | "
+              f"Age: {(now - key['last_rotated']).days} days | Last used: {last_used}")
+        count += 1
+        yield key
+    logging.info(f"Key-age report listed {count} access keys")
+    log_csv("IAM", "N/A", f"Key-age report ({count} keys)", "Success")
+
+
+
+#Keys for one user with their age, status and last-used date
+def audit_user_keys(username, throttle):
+    now = datetime.now(timezone.utc)
+    keys = throttle.call(iam_client().list_access_keys, UserName=username)["AccessKeyMetadata"]
+    results = []
+    for key in keys:
+        last_used = throttle.call(iam_client().get_access_key_last_used, AccessKeyId=key["AccessKeyId"])
+        results.append({
+            "username": username,
+            "access_key_id": key["AccessKeyId"],
+            "status": key["Status"],
+            "age_days": (now - key["CreateDate"]).days,
+            "last_used": last_used.get("AccessKeyLastUsed", {}).get("LastUsedDate"),
+        })
+    return results
+
+
+#Account-wide key audit: pages through all users and fetches their keys through a bounded pool,
+#streaming each key out as soon as its user has been audited
+def audit_keys(args, config):
+    workers = getattr(args, "workers", None) or config.get("iam_audit_workers", 8)
+    throttle = AdaptiveThrottle()
+    audited_users = 0
+
+    def finished(futures):
+        nonlocal audited_users
+        for future in futures:
+            username = future.username
+            try:
+                keys = future.result()
+            except ClientError as e:
+                logging.error(f"AWS error occured while auditing keys for {username} ({e.response['Error']['Code']}): {e}")
+                log_csv("IAM", username, "Audit Access Keys", "Failed")
+                continue
+            except Exception as e:
+                logging.error(f"Error occured while auditing keys for {username}: {e}")
+                log_csv("IAM", username, "Audit Access Keys", "Failed")
+                continue
+            audited_users += 1
+            for key in keys:
+                last_used = key["last_used"].isoformat() if key["last_used"] else "Never"
+                print(f"User: {key['username']} | Key ID: {key['access_key_id']} | Status: {key['status']} | "
+                      f"Age: {key['age_days']} days | Last used: {last_used}")
+                log_csv("IAM", key["username"], "Audit Access Key", "Success")
+                yield key
+
+    with ThreadPoolExecutor(max_workers=workers, initializer=inherit_account()) as pool:
+        in_flight = set()
+        for user in iter_users():
+            future = pool.submit(audit_user_keys, user["UserName"], throttle)
+            future.username = user["UserName"]
+            in_flight.add(future)
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+        yield from finished(in_flight)
+
+    logging.info(f"Audited access keys for {audited_users} users")
 
 
 
 IAM_ACTIONS = {
+    "audit-keys": audit_keys,
+    "key-age-report": key_age_report,
     "list-users": list_users,
     "create-key": create_new_key,
     "delete-key": delete_key,
     "delete-old-keys": delete_old_keys,
     "list-keys": list_keys
-}
\ No newline at end of file
+}
+
+
+IAM_PLANNERS = {
+    "delete-old-keys": (plan_delete_old_keys, apply_delete_keys),
+    "delete-key": (plan_delete_key, apply_delete_keys),
+}
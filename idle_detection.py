@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta, timezone
+
+# Idle detection from CloudWatch
+# One GetMetricData call carries up to 500 metric queries, so instances are scored in batches of
+# 166 (three metrics each) instead of one get_metric_statistics call per instance and metric.
+# The window is aligned to the period, which makes results for the same window reusable until
+# the next period begins.
+
+MAX_QUERIES = 500   # GetMetricData limit per call
+METRICS = (("cpu", "CPUUtilization", "Average"), ("net_in", "NetworkIn", "Sum"), ("net_out", "NetworkOut", "Sum"))
+INSTANCES_PER_CALL = MAX_QUERIES // len(METRICS)
+
+DEFAULT_SETTINGS = {
+    "lookback_days": 7,
+    "period": 3600,
+    "cpu_threshold": 5.0,          # percent, p95 of the period averages
+    "network_threshold_mb": 5.0,   # MB per hour in+out, p95
+    "min_coverage": 0.8,           # share of the window that needs datapoints
+}
+
+
+#CLI options over config ("idle_*" keys) over defaults
+def get_idle_settings(args, config):
+    settings = dict(DEFAULT_SETTINGS)
+    for key in settings:
+        value = getattr(args, key, None)
+        if value is None:
+            value = config.get(f"idle_{key}")
+        if value is not None:
+            settings[key] = value
+    settings["period"] = max(60, int(settings["period"]) // 60 * 60)
+    return settings
+
+
+#(start, end) of the lookback window, with end rounded down to a period boundary
+def metric_window(settings, now=None):
+    now = now or datetime.now(timezone.utc)
+    period = settings["period"]
+    end = datetime.fromtimestamp(int(now.timestamp()) // period * period, timezone.utc)
+    return end - timedelta(days=settings["lookback_days"]), end
+
+
+def metric_queries(instance_ids, period):
+    queries, owners = [], {}
+    for index, instance_id in enumerate(instance_ids):
+        for short, metric, stat in METRICS:
+            query_id = f"m{index}_{short}"
+            owners[query_id] = (instance_id, short)
+            queries.append({
+                "Id": query_id,
+                "MetricStat": {
+                    "Metric": {"Namespace": "AWS/EC2", "MetricName": metric,
+                               "Dimensions": [{"Name": "InstanceId", "Value": instance_id}]},
+                    "Period": period,
+                    "Stat": stat,
+                },
+                "ReturnData": True,
+            })
+    return queries, owners
+
+
+#{instance id: {metric: {timestamp: value}}} for up to INSTANCES_PER_CALL instances, following NextToken pages
+def fetch_series(client, instance_ids, start, end, period):
+    queries, owners = metric_queries(instance_ids, period)
+    series = {instance_id: {short: {} for short, _, _ in METRICS} for instance_id in instance_ids}
+    paginator = client.get_paginator("get_metric_data")
+    for page in paginator.paginate(MetricDataQueries=queries, StartTime=start, EndTime=end, ScanBy="TimestampAscending"):
+        for result in page["MetricDataResults"]:
+            instance_id, short = owners[result["Id"]]
+            series[instance_id][short].update(zip(result["Timestamps"], result["Values"]))
+    return series
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+#Window statistics for one instance (what gets cached; thresholds are applied later by score())
+def summarize(instance_id, metrics, settings):
+    per_hour = 3600 / settings["period"]
+    network = [(metrics["net_in"].get(stamp, 0) + metrics["net_out"].get(stamp, 0)) * per_hour / (1024 * 1024)
+               for stamp in set(metrics["net_in"]) | set(metrics["net_out"])]
+    cpu = list(metrics["cpu"].values())
+    return {
+        "id": instance_id,
+        "cpu_p95": percentile(cpu, 95),
+        "cpu_max": max(cpu) if cpu else None,
+        "network_mb_per_hour_p95": percentile(network, 95),
+        "datapoints": len(cpu),
+    }
+
+
+#Idle score in [0, 1]: 1 is completely quiet, 0 is at or above a threshold (or too little data to tell)
+def score(stats, settings):
+    expected = settings["lookback_days"] * 86400 / settings["period"]
+    if stats["datapoints"] < expected * settings["min_coverage"] or stats["cpu_p95"] is None:
+        return dict(stats, score=0.0, idle=False, reason="insufficient data")
+    load = max(stats["cpu_p95"] / settings["cpu_threshold"],
+               (stats["network_mb_per_hour_p95"] or 0) / settings["network_threshold_mb"])
+    idle_score = round(max(0.0, 1 - load), 3)
+    return dict(stats, score=idle_score, idle=load < 1, reason="idle" if load < 1 else "busy")
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+#Window statistics for a list of instance IDs, one GetMetricData call (plus pages) per batch
+def instance_stats(client, instance_ids, settings):
+    start, end = metric_window(settings)
+    for batch in chunked(instance_ids, INSTANCES_PER_CALL):
+        series = fetch_series(client, batch, start, end, settings["period"])
+        for instance_id in batch:
+            yield summarize(instance_id, series[instance_id], settings)
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+
+# Per-API-call instrumentation
+# attach() hooks botocore events on a client and records call counts, latency histograms,
+# retries, throttles, errors and bytes sent/received per operation.
+
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+THROTTLE_CODES = {"Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException",
+                  "SlowDown", "RequestThrottled", "ProvisionedThroughputExceededException"}
+
+
+class OperationStats:
+    __slots__ = ("calls", "errors", "retries", "throttles", "bytes_sent", "bytes_received", "latency_sum", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, latency_ms):
+        self.calls += 1
+        self.latency_sum += latency_ms
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    # Approximate percentile from the histogram (upper bound of the bucket it falls in)
+    def percentile(self, pct):
+        target = self.calls * pct / 100
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else float("inf")
+        return 0
+
+
+class Metrics:
+    def __init__(self):
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def stats(self, operation):
+        with self._lock:
+            if operation not in self.operations:
+                self.operations[operation] = OperationStats()
+            return self.operations[operation]
+
+    def record(self, operation, **changes):
+        stats = self.stats(operation)
+        with self._lock:
+            latency = changes.pop("latency_ms", None)
+            if latency is not None:
+                stats.observe(latency)
+            for field, amount in changes.items():
+                setattr(stats, field, getattr(stats, field) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                operation: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "throttles": stats.throttles,
+                    "bytes_sent": stats.bytes_sent,
+                    "bytes_received": stats.bytes_received,
+                    "latency_ms_sum": round(stats.latency_sum, 3),
+                    "latency_ms_buckets": dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"], stats.buckets)),
+                }
+                for operation, stats in sorted(self.operations.items())
+            }
+
+
+metrics = Metrics()
+
+
+def attach(client, service):
+    events = client.meta.events
+
+    def before_call(model, context, **kwargs):
+        context["instrumentation_start"] = time.perf_counter()
+
+    def request_created(request, operation_name, **kwargs):
+        body = request.body
+        size = len(body) if isinstance(body, (bytes, str)) else int(request.headers.get("Content-Length", 0) or 0)
+        metrics.record(f"{service}.{operation_name}", bytes_sent=size)
+
+    # Sees every attempt's response, including throttles botocore goes on to retry
+    def needs_retry(response, operation, **kwargs):
+        if response and response[1].get("Error", {}).get("Code") in THROTTLE_CODES:
+            metrics.record(f"{service}.{operation.name}", throttles=1)
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        start = context.get("instrumentation_start")
+        latency = (time.perf_counter() - start) * 1000 if start else 0.0
+        received = int(http_response.headers.get("Content-Length", 0) or 0) if http_response is not None else 0
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        errors = 1 if "Error" in parsed else 0
+        metrics.record(f"{service}.{model.name}", latency_ms=latency, bytes_received=received, retries=retries, errors=errors)
+
+    # Raised after botocore gave up (connection errors and the like); carries no model, only the event name
+    def after_call_error(context, exception, event_name, **kwargs):
+        start = context.get("instrumentation_start")
+        latency = (time.perf_counter() - start) * 1000 if start else 0.0
+        metrics.record(f"{service}.{event_name.rsplit('.', 1)[-1]}", latency_ms=latency, errors=1)
+
+    events.register("before-call", before_call)
+    events.register("request-created", request_created)
+    #First on the service's own needs-retry event, ahead of botocore's retry handler registered there
+    events.register_first(f"needs-retry.{client.meta.service_model.service_id.hyphenize()}", needs_retry)
+    events.register("after-call", after_call)
+    events.register("after-call-error", after_call_error)
+
+
+def print_summary():
+    snapshot = metrics.snapshot()
+    if not snapshot:
+        return
+    print("\n=== AWS API calls ===")
+    print(f"{'operation':<40}{'calls':>8}{'errors':>8}{'retries':>9}{'throttled':>11}{'avg ms':>9}{'p95 ms':>9}{'sent KB':>10}{'recv KB':>10}")
+    for operation, stats in sorted(metrics.operations.items()):
+        avg = stats.latency_sum / stats.calls if stats.calls else 0
+        print(f"{operation:<40}{stats.calls:>8}{stats.errors:>8}{stats.retries:>9}{stats.throttles:>11}"
+              f"{avg:>9.1f}{stats.percentile(95):>9}{stats.bytes_sent / 1024:>10.1f}{stats.bytes_received / 1024:>10.1f}")
+
+
+def write_json(path):
+    with open(f"{path}.tmp", "w") as file:
+        json.dump({"generated_at": time.time(), "operations": metrics.snapshot()}, file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+# Prometheus textfile-collector format; written atomically so node_exporter never reads half a file
+COUNTERS = [
+    ("aws_tool_api_calls_total", "calls", "API calls made by the tool."),
+    ("aws_tool_api_errors_total", "errors", "API calls that returned or raised an error."),
+    ("aws_tool_api_retries_total", "retries", "Retries performed by botocore."),
+    ("aws_tool_api_throttles_total", "throttles", "Throttling responses received."),
+    ("aws_tool_api_bytes_sent_total", "bytes_sent", "Request body bytes sent."),
+    ("aws_tool_api_bytes_received_total", "bytes_received", "Response body bytes received."),
+]
+
+
+def write_prometheus(path):
+    snapshot = metrics.snapshot()
+    labelled = []
+    for operation, stats in snapshot.items():
+        service, name = operation.split(".", 1)
+        labelled.append((f'service="{service}",operation="{name}"', stats))
+
+    lines = []
+    for metric, field, help_text in COUNTERS:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f"{metric}{{{labels}}} {stats[field]}" for labels, stats in labelled]
+
+    lines += ["# HELP aws_tool_api_latency_seconds API call latency including retries.",
+              "# TYPE aws_tool_api_latency_seconds histogram"]
+    for labels, stats in labelled:
+        cumulative = 0
+        for bound, count in stats["latency_ms_buckets"].items():
+            cumulative += count
+            le = bound if bound == "+Inf" else str(int(bound) / 1000)
+            lines.append(f'aws_tool_api_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"aws_tool_api_latency_seconds_sum{{{labels}}} {stats['latency_ms_sum'] / 1000}")
+        lines.append(f"aws_tool_api_latency_seconds_count{{{labels}}} {stats['calls']}")
+
+    with open(f"{path}.tmp", "w") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(f"{path}.tmp", path)
+
+
+def export(args, config):
+    json_path = getattr(args, "metrics_json", None) or config.get("metrics_json")
+    prom_path = getattr(args, "metrics_textfile", None) or config.get("metrics_textfile")
+    if json_path:
+        write_json(json_path)
+    if prom_path:
+        write_prometheus(prom_path)
@@ -0,0 +1,167 @@
+from logging_setup import logging, log_path, ensure_log_dir
+from aws_clients import get_client, current_account
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Local inventory cache
+# Every read action can serve its results from here instead of AWS. Rows are keyed by
+# (account, region, service) and each key has a snapshot time used for --max-age checks.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    account TEXT, region TEXT, service TEXT, fetched_at REAL,
+    PRIMARY KEY (account, region, service)
+);
+CREATE TABLE IF NOT EXISTS resources (
+    account TEXT, region TEXT, service TEXT, resource_id TEXT, data TEXT, generation INTEGER,
+    PRIMARY KEY (account, region, service, resource_id)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    account TEXT, region TEXT, service TEXT, resource_id TEXT, key TEXT, value TEXT,
+    PRIMARY KEY (account, region, service, resource_id, key)
+);
+CREATE INDEX IF NOT EXISTS tags_by_value ON tags (account, service, key, value, region);
+"""
+
+WRITE_BATCH_SIZE = 1000
+
+
+class InventoryCache:
+    def __init__(self, path, account):
+        self.path = path
+        self.account = account
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    # One connection per thread so region workers can read and write concurrently
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def is_fresh(self, region, service, max_age):
+        row = self._connect().execute(
+            "SELECT fetched_at FROM snapshots WHERE account=? AND region=? AND service=?",
+            (self.account, region, service)).fetchone()
+        return bool(row) and time.time() - row[0] <= max_age
+
+    def read(self, region, service):
+        rows = self._connect().execute(
+            "SELECT data FROM resources WHERE account=? AND region=? AND service=? ORDER BY resource_id",
+            (self.account, region, service))
+        for (data,) in rows:
+            yield json.loads(data)
+
+    # Indexed tag lookup: no scan over resources that do not carry the tag
+    def read_by_tag(self, region, service, key, value):
+        rows = self._connect().execute(
+            "SELECT r.data FROM tags t JOIN resources r USING (account, region, service, resource_id) "
+            "WHERE t.account=? AND t.service=? AND t.key=? AND t.value=? AND t.region=? ORDER BY t.resource_id",
+            (self.account, service, key, value, region))
+        for (data,) in rows:
+            yield json.loads(data)
+
+    # Pass items through while writing them to the cache in small transactions.
+    # Only once the listing finishes are leftovers from older snapshots dropped and the snapshot marked fresh,
+    # so a listing that fails halfway never looks fresh.
+    def refresh(self, region, service, items, key_fn, tags_fn=None):
+        generation = time.time_ns()
+        batch = []
+        for item in items:
+            batch.append(item)
+            yield item
+            if len(batch) >= WRITE_BATCH_SIZE:
+                self._write(region, service, batch, key_fn, tags_fn, generation)
+                batch = []
+        self._write(region, service, batch, key_fn, tags_fn, generation)
+
+        db = self._connect()
+        with db:
+            key = (self.account, region, service)
+            db.execute("DELETE FROM tags WHERE account=? AND region=? AND service=? AND resource_id IN "
+                       "(SELECT resource_id FROM resources WHERE account=? AND region=? AND service=? AND generation<>?)",
+                       key + key + (generation,))
+            db.execute("DELETE FROM resources WHERE account=? AND region=? AND service=? AND generation<>?", key + (generation,))
+            db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)", key + (time.time(),))
+
+    def _write(self, region, service, batch, key_fn, tags_fn, generation):
+        if not batch:
+            return
+        db = self._connect()
+        with db:
+            for item in batch:
+                resource_id = key_fn(item)
+                key = (self.account, region, service, resource_id)
+                db.execute("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)",
+                           key + (json.dumps(item, default=str), generation))
+                if tags_fn:
+                    db.execute("DELETE FROM tags WHERE account=? AND region=? AND service=? AND resource_id=?", key)
+                    db.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?)",
+                                   [key + (tag_key, tag_value) for tag_key, tag_value in tags_fn(item).items()])
+
+    # Drop snapshots after a mutating action; "iam-keys" also covers every "iam-keys/<user>"
+    def invalidate(self, service, region=None):
+        query = "DELETE FROM snapshots WHERE account=? AND (service=? OR service LIKE ?)"
+        params = (self.account, service, f"{service}/%")
+        if region is not None:
+            query += " AND region=?"
+            params += (region,)
+        db = self._connect()
+        with db:
+            db.execute(query, params)
+        logging.info(f"Inventory cache invalidated for {service}{f' in {region}' if region else ''}")
+
+
+_caches = {}
+_cache_lock = threading.Lock()
+
+
+def get_cache_path(config):
+    return config.get("inventory_cache_path") or os.path.join(log_path, "inventory.sqlite")
+
+
+def get_max_age(args, config):
+    max_age = getattr(args, "max_age", None)
+    if max_age is None:
+        max_age = config.get("cache_max_age_seconds")
+    return max_age
+
+
+def get_account_id(config):
+    return current_account() or config.get("account_id") or get_client("sts").get_caller_identity()["Account"]
+
+
+# The cache is only used when --max-age (or cache_max_age_seconds) is set; returns (cache, max_age) or (None, None)
+def get_inventory_cache(args, config):
+    max_age = get_max_age(args, config)
+    if max_age is None:
+        return None, None
+    return open_cache(config), max_age
+
+
+#One cache handle per account (they share the database file)
+def open_cache(config):
+    account = current_account()
+    with _cache_lock:
+        if account not in _caches:
+            ensure_log_dir()
+            _caches[account] = InventoryCache(get_cache_path(config), get_account_id(config))
+    return _caches[account]
+
+
+# Called after mutating actions; does nothing when no cache has ever been written
+def invalidate_inventory(config, service, region=None):
+    if not _caches and not os.path.exists(get_cache_path(config)):
+        return
+    try:
+        open_cache(config).invalidate(service, region)
+    except Exception as e:
+        logging.error(f"Could not invalidate the inventory cache for {service}: {e}")
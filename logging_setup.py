@@ -1,64 +1,245 @@
 import logging
-from colorama import Fore, Style, init
 import csv
 from datetime import datetime, timezone
 import os
+from collections import deque
+import threading
+import atexit
 
-# Resets the color of the log after each print/log
-init(autoreset=True)
+# Nothing here touches the filesystem or loads colorama at import time:
+# the log directory and handlers are created the first time something is logged.
 
 # Directories paths for logs
 main_source = "c:/Users/OLUWAPELUMI/.vscode/python/aws resource cleaner & auditor"
 log_path = os.path.join(main_source, "csv_log")
-os.makedirs(log_path, exist_ok=True)   # Create csv_log/ if not exists
 
 log_file = os.path.join(log_path, "report.log")
 csv_file = os.path.join(log_path, "report.csv")
 
 
+# Per-thread context shared by logging and the client registry: the AWS account an action runs in
+# (set by the multi-account fan-out; unset means the default credentials)
+context = threading.local()
+
+
+def ensure_log_dir():
+    os.makedirs(log_path, exist_ok=True)   # Create csv_log/ if not exists
+
+
 # Custom Formatter for Console Colors
-class ColorFormatter(logging.Formatter):
-    COLORS = {
-        logging.DEBUG: Fore.CYAN,
-        logging.INFO: Fore.GREEN, 
-        logging.WARNING: Fore.YELLOW, 
-        logging.ERROR: Fore.RED, 
-        logging.CRITICAL: Fore.MAGENTA,
-    }
+def color_formatter(fmt):
+    from colorama import Fore, Style, init
+
+    # Resets the color of the log after each print/log
+    init(autoreset=True)
 
-    def format(self, record):
-        color = self.COLORS.get(record.levelno, "")
-        message = super().format(record)
-        return f"{color}{message}{Style.RESET_ALL}"
+    class ColorFormatter(logging.Formatter):
+        COLORS = {
+            logging.DEBUG: Fore.CYAN,
+            logging.INFO: Fore.GREEN, 
+            logging.WARNING: Fore.YELLOW, 
+            logging.ERROR: Fore.RED, 
+            logging.CRITICAL: Fore.MAGENTA,
+        }
+
+        def format(self, record):
+            color = self.COLORS.get(record.levelno, "")
+            message = super().format(record)
+            return f"{color}{message}{Style.RESET_ALL}"
+
+    return ColorFormatter(fmt)
 
 
 # Logging Setup
-file_handler = logging.FileHandler(log_file)
-file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+# Stands in for the console and file handlers until the first record arrives
+class LazyHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self._handlers = None
+        self._setup_lock = threading.Lock()
+
+    def _build(self):
+        ensure_log_dir()
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+
+        console = logging.StreamHandler()
+        console.setFormatter(color_formatter("%(levelname)s - %(message)s"))
+        return [console, file_handler]
 
-console = logging.StreamHandler()
-console.setFormatter(ColorFormatter("%(levelname)s - %(message)s"))
+    def emit(self, record):
+        if self._handlers is None:
+            with self._setup_lock:
+                if self._handlers is None:
+                    self._handlers = self._build()
+        account = getattr(context, "account", None)
+        if account and isinstance(record.msg, str):
+            record.msg = f"[{account}] {record.msg}"
+        for handler in self._handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
 
-logging.basicConfig(level=logging.INFO, handlers=[console, file_handler])
+    def flush(self):
+        for handler in self._handlers or []:
+            handler.flush()
+
+    def close(self):
+        for handler in self._handlers or []:
+            handler.close()
+        super().close()
+
+
+logging.basicConfig(level=logging.INFO, handlers=[LazyHandler()])
 
 
 # CSV Setup
+CSV_HEADER = ["Service", "Resource", "Action", "Status", "Timestamp"]
+
+
 def init_csv():
     #Create a CSV file with headers if it does not exist.
+    ensure_log_dir()
     if not os.path.exists(csv_file):
         with open(csv_file, "w", newline="") as file:
             writer = csv.writer(file)
-            writer.writerow(["Service", "Resource", "Action", "Status", "Timestamp"])
+            writer.writerow(CSV_HEADER)
+
+
+# Audit rotation limits (set from config by configure_audit); None disables that limit
+ROTATE_BYTES = 64 * 1024 * 1024
+ROTATE_HOURS = 24
+
+
+def configure_audit(config):
+    global ROTATE_BYTES, ROTATE_HOURS
+    if "audit_rotate_mb" in config:
+        ROTATE_BYTES = int(config["audit_rotate_mb"] * 1024 * 1024) if config["audit_rotate_mb"] else None
+    if "audit_rotate_hours" in config:
+        ROTATE_HOURS = config["audit_rotate_hours"] or None
+
+
+# Background audit writer
+# Rows are queued in memory and a single thread appends them to the CSV in batches,
+# so callers never pay for an open/close per row. Once the file passes max_bytes or
+# holds rows older than max_age_hours it is rotated into the compressed audit store.
+class AuditWriter:
+    def __init__(self, path, batch_size=500, flush_interval=1.0, max_bytes=None, max_age_hours=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age_hours = max_age_hours
+        self._segment_start = None
+        self._rows = deque()
+        self._kick = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._kick.set()
+
+    def _write_pending(self):
+        #Write everything queued so far; flush markers are released once the rows ahead of them are on disk
+        batch, markers = [], []
+        while self._rows:
+            item = self._rows.popleft()
+            if isinstance(item, threading.Event):
+                markers.append(item)
+            else:
+                batch.append(item)
+        if batch:
+            try:
+                self._append(batch)
+                self._maybe_rotate(batch)
+            except Exception as e:
+                print(f"[AUDIT] Failed to write {len(batch)} rows to {self.path}: {e}")
+        for marker in markers:
+            marker.set()
+
+    def _append(self, batch):
+        if not self.max_bytes and not self.max_age_hours:
+            with open(self.path, "a", newline="") as file:
+                csv.writer(file).writerows(batch)
+            return
+        import audit_store
+
+        #Other processes may rotate this file; never append while one of them is archiving it
+        with audit_store.locked(shared=True):
+            with open(self.path, "a", newline="") as file:
+                csv.writer(file).writerows(batch)
+
+    def _maybe_rotate(self, batch):
+        if not self.max_bytes and not self.max_age_hours:
+            return
+        import audit_store
+
+        if self._segment_start is None:
+            self._segment_start = audit_store.first_timestamp(self.path) or batch[0][4]
+        if self._rotation_due(self._segment_start):
+            #Recheck against the file itself: another process may have rotated it already
+            audit_store.rotate(self.path, due=lambda: self._rotation_due(audit_store.first_timestamp(self.path)))
+            self._segment_start = None
+
+    def _rotation_due(self, segment_start):
+        if segment_start is None:
+            return False
+        try:
+            too_big = self.max_bytes and os.path.getsize(self.path) >= self.max_bytes
+        except FileNotFoundError:
+            return False
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(segment_start)
+        too_old = self.max_age_hours and age.total_seconds() >= self.max_age_hours * 3600
+        return bool(too_big or too_old)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._kick.wait(self.flush_interval)
+            self._kick.clear()
+            self._write_pending()
+        self._write_pending()
+
+    def flush(self, timeout=None):
+        #Block until every row queued before this call has been written
+        marker = threading.Event()
+        self._rows.append(marker)
+        if not self._thread.is_alive():
+            self._write_pending()
+        self._kick.set()
+        return marker.wait(timeout)
+
+    def close(self, timeout=None):
+        self._stop.set()
+        self._kick.set()
+        self._thread.join(timeout)
+
+
+_audit_writer = None
+_audit_lock = threading.Lock()
+
+
+def get_audit_writer():
+    global _audit_writer
+    with _audit_lock:
+        if _audit_writer is None:
+            ensure_log_dir()
+            _audit_writer = AuditWriter(csv_file, max_bytes=ROTATE_BYTES, max_age_hours=ROTATE_HOURS)
+            atexit.register(_audit_writer.close)
+    return _audit_writer
 
 
 def log_csv(service, resource, action, status):
-    #Append an entry to the CSV report
-    with open(csv_file, "a", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow([
-            service,
-            resource,
-            action,
-            status,
-            datetime.now(timezone.utc).isoformat()
-        ])
+    #Queue an entry for the CSV report (rows written under --accounts carry the account ID as a sixth column)
+    row = [
+        service,
+        resource,
+        action,
+        status,
+        datetime.now(timezone.utc).isoformat()
+    ]
+    account = getattr(context, "account", None)
+    if account:
+        row.append(account)
+    get_audit_writer().write(row)
@@ -1,11 +1,75 @@
 import argparse
 import os
 import json
-from logging_setup import log_csv
-
-from ec2_actions import EC2_ACTIONS
-from s3_actions import S3_ACTIONS
-from iam_actions import IAM_ACTIONS
+import importlib
+from functools import partial
+from types import GeneratorType
+from logging_setup import log_csv, configure_audit
+from aws_clients import configure, current_account, use_account
+import instrumentation
+
+#Service modules are imported only when their service is selected
+SERVICE_MODULES = {
+    "ec2": ("ec2_actions", "EC2_ACTIONS", "EC2_PLANNERS"),
+    "s3": ("s3_actions", "S3_ACTIONS", "S3_PLANNERS"),
+    "iam": ("iam_actions", "IAM_ACTIONS", "IAM_PLANNERS"),
+}
+
+
+def get_actions(service):
+    module_name, table, _ = SERVICE_MODULES[service]
+    return getattr(importlib.import_module(module_name), table)
+
+
+#(plan, apply) pairs for the actions that support --dry-run change sets
+def get_planners(service):
+    module_name, _, table = SERVICE_MODULES[service]
+    return getattr(importlib.import_module(module_name), table, {})
+
+
+#--dry-run: run the read side once and write the exact change set to a plan file
+def write_plan(args, config):
+    import change_sets
+
+    plan, _ = get_planners(args.service)[args.action]
+    header, items = plan(args, config)
+    account = current_account()
+    path = args.plan_file or change_sets.default_path(args.service, args.action, account)
+    if account and args.plan_file:
+        base, extension = os.path.splitext(args.plan_file)
+        path = f"{base}-{account}{extension}"
+    header = dict(header, service=args.service, action=args.action)
+    if account:
+        header["account"] = account
+    header = change_sets.write_change_set(path, header, items)
+    print(f"[DryRun] {header['items']} change(s) for {args.action} on {args.service} written to {path}")
+    print(f"[DryRun] Review it, then run: python main.py --apply {path}")
+    log_csv("Main()", path, f"Plan {args.service} {args.action} ({header['items']} items)", "Success")
+
+
+#--apply: execute a change set directly, without listing again
+def apply_plan(args, config):
+    import change_sets
+
+    header = change_sets.read_header(args.apply)
+    max_age = args.max_plan_age if args.max_plan_age is not None else config.get("max_plan_age_hours", 24)
+    age = change_sets.plan_age_hours(header)
+    if max_age and age > max_age:
+        raise ValueError(f"Plan {args.apply} is {age:.1f}h old (limit {max_age}h); compute a new one with --dry-run")
+
+    _, apply = get_planners(header["service"])[header["action"]]
+    account = header.get("account")
+    if account:
+        import accounts
+        failed = accounts.prepare_sessions(accounts.select_accounts(config, [account]), config)
+        if failed:
+            raise RuntimeError(f"Could not assume the role for account {account}: {failed[account]}")
+    print(f"Applying {header['items']} change(s) for {header['action']} on {header['service']} from {args.apply}"
+          + (f" in account {account}" if account else ""))
+    with use_account(account):
+        result = apply(header, change_sets.read_items(args.apply), args, config)
+        log_csv("Main()", args.apply, f"Apply {header['service']} {header['action']}", "Success")
+    return result
 
 
 def load_config(config_path):
@@ -15,15 +79,52 @@ def load_config(config_path):
     return {}
     
 
-def get_args():
+#--apply, --dry-run or the action itself
+def dispatch(args, config):
+    if args.apply:
+        return apply_plan(args, config)
+    if args.dry_run:
+        return write_plan(args, config)
+    #Linking EC2, S3 and IAM Actions
+    return run_action(get_actions(args.service), args, config)
+
+
+#With --accounts, run once per selected account in parallel (results keyed by account ID)
+def run_for_accounts(action, args, config):
+    if args.accounts:
+        import accounts
+        return accounts.run_across_accounts(action, args, config)
+    return action(args, config)
+
+
+# Run an action; streaming actions return generators, which are drained here (returning how many items they produced)
+def run_action(actions, args, config, *inputs):
+    result = actions[args.action](args, config, *inputs)
+    if isinstance(result, GeneratorType):
+        return sum(1 for _ in result)
+    return result
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="An AWS resource cleaner & auditor")
 
     parser.add_argument("--config", default="config.json", help="Path to config file")
     parser.add_argument("--dry-run", action="store_true", help="Simulate actions without executing")
-
-
-    #Create a Subparser
-    subparsers = parser.add_subparsers(dest="service", required=True)
+    parser.add_argument("--plan-file", help="Where --dry-run writes the change set (default: csv_log/plan-<service>-<action>-<time>.jsonl)")
+    parser.add_argument("--apply", metavar="PLAN", help="Execute a change set written by --dry-run")
+    parser.add_argument("--max-plan-age", type=float, help="Refuse to --apply a plan older than this many hours (default:24, 0 disables)")
+    parser.add_argument("--check-stale", action="store_true", help="With --apply, skip resources that no longer match (EC2: not running)")
+    parser.add_argument("--timeout", type=int, help="With --apply, seconds to wait for stopped instances (default:600)")
+    parser.add_argument("--metrics-json", help="Write per-API-call metrics to this JSON file")
+    parser.add_argument("--metrics-textfile", help="Write per-API-call metrics in Prometheus textfile format")
+    parser.add_argument("--accounts", type=lambda value: [item.strip() for item in value.split(",") if item.strip()],
+                        help="Comma-separated member accounts (IDs or names from config 'accounts', or 'all') to run in via their roles")
+    parser.add_argument("--account-workers", type=int, help="Accounts processed at once with --accounts (default:8)")
+    parser.add_argument("--max-age", type=int, help="Serve read actions from the local inventory cache if it is younger than this many seconds")
+
+
+    #Create a Subparser (optional only for --apply, which takes the service from the plan file)
+    subparsers = parser.add_subparsers(dest="service")
 
     #EC2 Sub-command
     ec2_parser = subparsers.add_parser("ec2", help="Manage EC2 instances")
@@ -32,17 +133,36 @@ def get_args():
     #EC2 subarser
     ec2_subparsers = ec2_parser.add_subparsers(dest="action", required=True)
     
+    #Regions shared by every EC2 action
+    regions_parser = argparse.ArgumentParser(add_help=False)
+    regions_parser.add_argument("--regions", nargs="+", help="Regions to query, or 'all' (default: configured region)")
+
     #List instances action(parser)
-    ec2_subparsers.add_parser("list-instances", help="List EC2 instances")
+    ec2_subparsers.add_parser("list-instances", parents=[regions_parser], help="List EC2 instances")
 
     #Filter instances action(parser)
-    filter_instances_parser = ec2_subparsers.add_parser("filter-instances", help="Filter EC2 instances")
+    filter_instances_parser = ec2_subparsers.add_parser("filter-instances", parents=[regions_parser], help="Filter EC2 instances")
     filter_instances_parser.add_argument("--tag-key", help="Tag key to filter instances")
     filter_instances_parser.add_argument("--tag-value", help="Tag value to filter instances")
+    filter_instances_parser.add_argument("--rules", nargs="+", help="Only these tag_policies rules from config (default: all)")
+
+    #Idle detection settings shared by find-idle and stop-instances --idle
+    idle_parser = argparse.ArgumentParser(add_help=False)
+    idle_parser.add_argument("--lookback-days", type=int, help="Days of CloudWatch metrics to score (default:7)")
+    idle_parser.add_argument("--period", type=int, help="Metric period in seconds, a multiple of 60 (default:3600)")
+    idle_parser.add_argument("--cpu-threshold", type=float, help="Idle below this p95 CPU percent (default:5)")
+    idle_parser.add_argument("--network-threshold-mb", type=float, help="Idle below this p95 network MB per hour, in+out (default:5)")
+    idle_parser.add_argument("--refresh-metrics", action="store_true", help="Ignore metrics cached for the current window")
+
+    #Find idle instances action(parser)
+    ec2_subparsers.add_parser("find-idle", parents=[regions_parser, idle_parser], help="Find idle running instances from CloudWatch metrics")
 
     #Stop instances action(parser)
-    stop_instances_parser = ec2_subparsers.add_parser("stop-instances", help="Stop EC2 instances")
+    stop_instances_parser = ec2_subparsers.add_parser("stop-instances", parents=[regions_parser, idle_parser], help="Stop EC2 instances")
+    stop_instances_parser.add_argument("--idle", action="store_true", help="Stop the instances find-idle reports")
     stop_instances_parser.add_argument("--instance-ids", nargs="+", help="Stop one or more EC2 instances with their ID")
+    stop_instances_parser.add_argument("--timeout", type=int, help="Seconds to wait for all instances to stop (default:600)")
+    stop_instances_parser.add_argument("--rules", nargs="+", help="Select with only these tag_policies rules from config (default: all)")
 
     #--------------------------------------------------------------------------------------------------------------------
 
@@ -55,16 +175,40 @@ def get_args():
     #List s3 buckets
     s3_subparser.add_parser("list-buckets", help="List S3 Buckets")
 
+    #List objects in a bucket
+    list_objects_parser = s3_subparser.add_parser("list-objects", help="Stream a bucket's objects as NDJSON or CSV")
+    list_objects_parser.add_argument("--bucket-name", required=True, help="The S3 bucket name")
+    list_objects_parser.add_argument("--prefix", help="Only list keys under this prefix")
+    list_objects_parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson", help="Output format (default:ndjson)")
+    list_objects_parser.add_argument("--output", help="Write to this file instead of stdout")
+    list_objects_parser.add_argument("--min-size", type=int, help="Only objects of at least this many bytes")
+    list_objects_parser.add_argument("--max-size", type=int, help="Only objects of at most this many bytes")
+    list_objects_parser.add_argument("--older-than-days", type=int, help="Only objects last modified more than this many days ago")
+    list_objects_parser.add_argument("--newer-than-days", type=int, help="Only objects last modified within this many days")
+    list_objects_parser.add_argument("--storage-class", nargs="+", help="Only objects in these storage classes (e.g. STANDARD GLACIER)")
+    list_objects_parser.add_argument("--ordered", action="store_true", help="Emit objects in key order (default: as shards produce them)")
+    list_objects_parser.add_argument("--list-workers", type=int, help="Number of prefix shards listed at once (default:8)")
+
     #s3 Upload file
     upload_file_parser = s3_subparser.add_parser("upload-file", help="Upload a file")
     upload_file_parser.add_argument("--bucket-name", required=True, help="The S3 bucket name")
     upload_file_parser.add_argument("--local-file-path", required=True, help="The file path")
     upload_file_parser.add_argument("--prefix", help="Build file path in S3")
+    upload_file_parser.add_argument("--concurrency", type=int, help="Number of files uploaded at once (default:16)")
+    upload_file_parser.add_argument("--multipart-threshold", type=int, help="File size in MB before multipart upload is used (default:8)")
+    upload_file_parser.add_argument("--chunk-size", type=int, help="Multipart chunk size in MB (default:8)")
+    upload_file_parser.add_argument("--sync", action="store_true", help="Only upload new or changed files (uses a local manifest)")
+    upload_file_parser.add_argument("--checksum", choices=["sha256", "md5", "none"], help="Content checksum computed before upload (default: none)")
+    upload_file_parser.add_argument("--compress", choices=["gzip", "zstd", "none"], help="Compress text-like files before upload and set Content-Encoding (default: none)")
+    upload_file_parser.add_argument("--hash-workers", type=int, help="Processes used for checksums and compression (default: CPU count)")
     
     #S3 Delete files
     delete_file_parser = s3_subparser.add_parser("delete-file", help="Delete files")
     delete_file_parser.add_argument("--bucket-name", required=True, help="The S3 bucket name")
     delete_file_parser.add_argument("--cut-off-days", type=int, default=30, help="Number of days before now to filter objects (default:30)")
+    delete_file_parser.add_argument("--delete-workers", type=int, help="Number of parallel delete batches (default:4)")
+    delete_file_parser.add_argument("--inventory", help="S3 Inventory manifest.json (local path or s3://bucket/key) to read candidates from instead of listing")
+    delete_file_parser.add_argument("--list-workers", type=int, help="Number of prefix shards listed at once (default:8)")
 
     #-------------------------------------------------------------------------------------------------------------------------------------------------------
 
@@ -75,7 +219,11 @@ def get_args():
     iam_subparser = iam_parser.add_subparsers(dest="action", required=True)
     
     #IAM List Users parser
-    iam_subparser.add_parser("--list-users", help="List IAM Users")
+    iam_subparser.add_parser("list-users", help="List IAM Users")
+
+    #IAM account-wide key audit parser
+    audit_keys_parser = iam_subparser.add_parser("audit-keys", help="Audit every user's access keys (age, status, last used)")
+    audit_keys_parser.add_argument("--workers", type=int, help="Number of users audited at once (default:8)")
 
     #IAM List User Keys
     list_keys = iam_subparser.add_parser("list-keys", help="List user access keys")
@@ -94,31 +242,84 @@ def get_args():
     delete_oldkey_parser =  iam_subparser.add_parser("delete-old-keys", help="Delete old IAM Access keys")
     delete_oldkey_parser.add_argument("--username", help="IAM Username to delete Keys for")
     delete_oldkey_parser.add_argument("--key-max-age", type=int, default=30, help="Days after key are considered old")
+    delete_oldkey_parser.add_argument("--all-users", action="store_true", help="Delete old keys for every user in the account")
+    delete_oldkey_parser.add_argument("--source", choices=["credential-report", "api"], help="Where --all-users finds old keys (default:credential-report)")
+    delete_oldkey_parser.add_argument("--include-new-users", action="store_true", help="With the credential report, also list every user to find ones created after it")
 
-    return parser.parse_args()
+    #IAM key-age report parser
+    key_age_parser = iam_subparser.add_parser("key-age-report", help="Account-wide key ages from the IAM credential report")
+    key_age_parser.add_argument("--include-new-users", action="store_true", help="Also list every user to find ones created after the report")
+
+    #-------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    #Plan runner: many actions in one process
+    run_parser = subparsers.add_parser("run", help="Run a plan file of actions in one process")
+    run_parser.add_argument("--plan", required=True, help="Path to the plan JSON file")
+    run_parser.add_argument("--max-parallel", type=int, help="Independent steps run at once (default: plan's max_parallel or 4)")
+    run_parser.add_argument("--report", help="Write the consolidated report to this JSON file")
+
+    #Audit report: query the audit trail without loading it all
+    report_parser = subparsers.add_parser("report", help="Query the audit trail (filtered counts or rows)")
+    report_parser.add_argument("--since", help="Start date/time, inclusive (e.g. 2025-01-31 or 2025-01-31T12:00:00, UTC)")
+    report_parser.add_argument("--until", help="End date/time, exclusive")
+    report_parser.add_argument("--days", type=int, help="Only the last N days (overrides --since)")
+    report_parser.add_argument("--service", dest="report_service", help="Only rows for this service (EC2, S3, IAM, ...)")
+    report_parser.add_argument("--resource", help="Only rows for this resource (bucket, instance id, username, ...)")
+    report_parser.add_argument("--status", help="Only rows with this status (Success, Failed, ...)")
+    report_parser.add_argument("--account", help="Only rows written for this account ID (with --accounts)")
+    report_parser.add_argument("--action-contains", help="Only rows whose action contains this text")
+    report_parser.add_argument("--group-by", nargs="+", choices=["day", "hour", "service", "resource", "action", "status", "account"],
+                               help="Count rows per group (default: day action status)")
+    report_parser.add_argument("--rows", action="store_true", help="Stream the matching rows instead of counts")
+    report_parser.add_argument("--format", choices=["table", "csv", "ndjson"], default="table", help="Output format (default:table)")
+
+    return parser
+
+
+def get_args():
+    parser = build_parser()
+    args = parser.parse_args()
+    if not args.service and not args.apply:
+        parser.error("a service (ec2, s3, iam, run, report) is required unless --apply is given")
+    if args.accounts and args.apply:
+        parser.error("--apply takes the account from the plan file; do not combine it with --accounts")
+    return args
 
 def main():
     args = get_args()
     config = load_config(args.config)
+    configure(config)
+    configure_audit(config)
 
 
-    if args.dry_run:
+    if args.service == "report":
+        import audit_store
+        audit_store.report(args, config)
+        return
+
+    if args.service == "run":
+        import plan_runner
+        try:
+            #The runner gets the CLI parser and action lookup from here rather than importing this module again
+            run_plan = partial(plan_runner.run_plan, parser=build_parser(), get_actions=get_actions, run_action=run_action)
+            run_for_accounts(run_plan, args, config)
+        finally:
+            instrumentation.print_summary()
+            instrumentation.export(args, config)
+        return
+
+    if args.dry_run and not args.apply and args.action not in get_planners(args.service):
         print(f"[DryRun] Would execute: {args.action} on {args.service}")
         return
 
     try:
-        #Linking EC2 Actions
-        if args.service == "ec2":
-            EC2_ACTIONS[args.action](args, config)
-        #Linking S3 Actions
-        elif args.service == "s3":
-            S3_ACTIONS[args.action](args, config)
-        #Linking IAM Actions
-        elif args.service == "iam":
-            IAM_ACTIONS[args.action](args, config)
+        run_for_accounts(dispatch, args, config)
     except Exception as e:
         print(f"Error: {e}")
         log_csv("Main()", "Actions", {e}, "Failure")
+    finally:
+        instrumentation.print_summary()
+        instrumentation.export(args, config)
         
 
             
@@ -0,0 +1,200 @@
+import inspect
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logging_setup import logging, log_csv
+from aws_clients import inherit_account
+
+# Plan runner
+# Runs a list of actions from one plan file in a single process (so clients and credentials are shared),
+# starting each step once the steps it depends on have succeeded, with independent steps in parallel.
+#
+# {
+#   "max_parallel": 4,
+#   "steps": [
+#     {"id": "find-dev", "service": "ec2", "action": "filter-instances", "args": {"tag_key": "env", "tag_value": "dev"}},
+#     {"id": "stop-dev", "service": "ec2", "action": "stop-instances", "depends_on": ["find-dev"], "input": "find-dev"},
+#     {"id": "expire-logs", "service": "s3", "action": "delete-file", "args": {"bucket_name": "logs", "cut_off_days": 30}}
+#   ]
+# }
+#
+# "args" use the CLI option names with underscores; "config" overrides config.json for that step;
+# "input" passes another step's result to the action (e.g. filter-instances -> stop-instances).
+# Only actions that return a list can be an input: streaming actions (list-instances, list-objects, ...)
+# report how many items they produced, not the items.
+
+GLOBAL_OPTIONS = ("max_age",)
+
+
+def load_plan(path):
+    with open(path) as file:
+        plan = json.load(file)
+    steps = plan.get("steps", [])
+    ids = [step.get("id") for step in steps]
+    if None in ids or len(set(ids)) != len(ids):
+        raise ValueError("Every plan step needs a unique 'id'")
+    for step in steps:
+        for dependency in step_dependencies(step):
+            if dependency not in ids:
+                raise ValueError(f"Step {step['id']} depends on unknown step {dependency}")
+    check_cycles(steps)
+    return plan
+
+
+#Every "input" must come from an action that returns its items and go to one that takes them
+def check_inputs(steps, get_actions):
+    by_id = {step["id"]: step for step in steps}
+    for step in steps:
+        if not step.get("input"):
+            continue
+        source = by_id[step["input"]]
+        producer = get_actions(source["service"]).get(source["action"])
+        consumer = get_actions(step["service"]).get(step["action"])
+        if producer is None or consumer is None:
+            continue    #Unknown actions are reported when the step's args are parsed
+        if inspect.isgeneratorfunction(producer):
+            raise ValueError(f"Step {step['id']} takes its input from {source['id']}, but {source['service']} "
+                             f"{source['action']} streams its results and only returns a count")
+        if len(inspect.signature(consumer).parameters) < 3:
+            raise ValueError(f"Step {step['id']}: {step['service']} {step['action']} does not take an input")
+
+
+def step_dependencies(step):
+    dependencies = list(step.get("depends_on", []))
+    if step.get("input") and step["input"] not in dependencies:
+        dependencies.append(step["input"])
+    return dependencies
+
+
+def check_cycles(steps):
+    graph = {step["id"]: step_dependencies(step) for step in steps}
+    visiting, done = set(), set()
+
+    def visit(node):
+        if node in done:
+            return
+        if node in visiting:
+            raise ValueError(f"Plan has a dependency cycle through {node}")
+        visiting.add(node)
+        for dependency in graph[node]:
+            visit(dependency)
+        visiting.discard(node)
+        done.add(node)
+
+    for node in graph:
+        visit(node)
+
+
+# Turn a step's args into the argv the CLI would have parsed, so defaults and validation are identical
+def step_argv(step):
+    argv = [step["service"], step["action"]]
+    for name, value in step.get("args", {}).items():
+        flag = f"--{name.replace('_', '-')}"
+        if value is True:
+            argv.append(flag)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            argv += [flag] + [str(item) for item in value]
+        else:
+            argv += [flag, str(value)]
+    return argv
+
+
+def parse_step_args(parser, step, run_args):
+    try:
+        args = parser.parse_args(step_argv(step))
+    except SystemExit:
+        raise ValueError(f"Invalid args for step {step['id']}: {step_argv(step)}")
+    for option in GLOBAL_OPTIONS:
+        if getattr(args, option, None) is None:
+            setattr(args, option, getattr(run_args, option, None))
+    return args
+
+
+def summarize(result):
+    if result is None:
+        return ""
+    if isinstance(result, (list, tuple, set)):
+        return f"{len(result)} items"
+    if isinstance(result, int):
+        return f"{result} items"
+    if isinstance(result, dict):
+        return ", ".join(f"{key}={value}" for key, value in result.items() if isinstance(value, (int, float, str)))
+    return type(result).__name__
+
+
+#parser, get_actions and run_action come from main (the CLI parser, the service action tables and
+#the call that drains streaming actions), so every step runs exactly as it would from the command line
+def run_plan(args, config, parser, get_actions, run_action):
+    plan = load_plan(args.plan)
+    steps = {step["id"]: step for step in plan["steps"]}
+    max_parallel = args.max_parallel or plan.get("max_parallel", 4)
+    step_args = {step_id: parse_step_args(parser, step, args) for step_id, step in steps.items()}
+    check_inputs(plan["steps"], get_actions)
+
+    if args.dry_run:
+        for step_id, step in steps.items():
+            after = f" (after {', '.join(step_dependencies(step))})" if step_dependencies(step) else ""
+            print(f"[DryRun] Would execute: {step['action']} on {step['service']} as {step_id}{after}")
+        return
+
+    results, report = {}, {}
+    lock = threading.Lock()
+
+    def run_step(step_id):
+        step = steps[step_id]
+        step_config = dict(config, **step.get("config", {}))
+        inputs = [results[step["input"]]] if step.get("input") else []
+        start = time.perf_counter()
+        logging.info(f"[PLAN] Starting {step_id}: {step['service']} {step['action']}")
+        result = run_action(get_actions(step["service"]), step_args[step_id], step_config, *inputs)
+        return result, time.perf_counter() - start
+
+    pending = dict(steps)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_parallel, initializer=inherit_account()) as pool:
+        while pending or running:
+            #Skip steps whose dependencies failed; start steps whose dependencies all succeeded
+            for step_id, step in list(pending.items()):
+                dependencies = step_dependencies(step)
+                if any(report.get(dep, {}).get("status") in ("Failed", "Skipped") for dep in dependencies):
+                    report[step_id] = {"service": step["service"], "action": step["action"], "status": "Skipped",
+                                       "seconds": 0, "summary": "dependency did not succeed"}
+                    del pending[step_id]
+                elif all(report.get(dep, {}).get("status") == "Success" for dep in dependencies) and len(running) < max_parallel:
+                    running[pool.submit(run_step, step_id)] = step_id
+                    del pending[step_id]
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step_id = running.pop(future)
+                step = steps[step_id]
+                entry = {"service": step["service"], "action": step["action"]}
+                try:
+                    result, seconds = future.result()
+                    with lock:
+                        results[step_id] = result
+                    entry.update(status="Success", seconds=round(seconds, 2), summary=summarize(result))
+                except Exception as e:
+                    logging.error(f"[PLAN] Step {step_id} failed: {e}")
+                    entry.update(status="Failed", seconds=0, summary=str(e))
+                report[step_id] = entry
+                log_csv("Plan", step_id, f"{step['service']} {step['action']}", entry["status"])
+
+    print_report(report, [step["id"] for step in plan["steps"]])
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2, default=str)
+    return report
+
+
+def print_report(report, order):
+    print("\n=== Plan report ===")
+    print(f"{'step':<24}{'service':<9}{'action':<20}{'status':<10}{'seconds':>9}  summary")
+    for step_id in order:
+        entry = report[step_id]
+        print(f"{step_id:<24}{entry['service']:<9}{entry['action']:<20}{entry['status']:<10}{entry['seconds']:>9}  {entry['summary']}")
@@ -1,19 +1,29 @@
-import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
-from logging_setup import logging, log_csv
+from logging_setup import logging, log_csv, log_path
+from aws_clients import get_resource, inherit_account
+from inventory_cache import get_inventory_cache
+from s3_listing import iter_objects
+from s3_inventory import iter_inventory_objects
+from s3_prepare import get_prepare_settings, prepare_file, upload_args, discard, ContentIndex
+from collections import deque
 from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import nullcontext
+import threading
+import tempfile
+import shutil
+import hashlib
+import time
+import sys
+import csv
 import os
 import json
 
-#Creating the boto 3 object
-s3 = boto3.resource('s3')
-
+MB = 1024 * 1024
 
 #Get the Bucket name (config/CLI)
 def get_bucket(args, config):
-    #Creating the boto 3 object
-    s3 = boto3.resource('s3')
-
     if args.bucket_name:
         bucket_name = args.bucket_name
     elif config.get("bucket_name"):
@@ -21,14 +31,20 @@ def get_bucket(args, config):
     else:
         raise ValueError("Bucket name not provided (use --bucket-name or config file)")
     
-    return s3.Bucket(bucket_name)
+    return get_resource("s3").Bucket(bucket_name)
 
 
 
 
 #List s3 buckets
 def list_all_buckets(args, config):
-    bucket_names = [bucket.name for bucket in s3.buckets.all()]
+    cache, max_age = get_inventory_cache(args, config)
+    if cache and cache.is_fresh("global", "s3", max_age):
+        bucket_names = [bucket["name"] for bucket in cache.read("global", "s3")]
+    else:
+        bucket_names = [bucket.name for bucket in get_resource("s3").buckets.all()]
+        if cache:
+            deque(cache.refresh("global", "s3", ({"name": name} for name in bucket_names), key_fn=lambda bucket: bucket["name"]), maxlen=0)
     try: 
         for name in bucket_names:
             print(name)
@@ -41,85 +57,513 @@ def list_all_buckets(args, config):
     return bucket_names
 
 
+#Upload settings (CLI/config), falling back to defaults
+def get_upload_settings(args, config):
+    config = config or {}
+    concurrency = getattr(args, "concurrency", None) or config.get("upload_concurrency", 16)
+    threshold_mb = getattr(args, "multipart_threshold", None) or config.get("multipart_threshold_mb", 8)
+    chunk_size_mb = getattr(args, "chunk_size", None) or config.get("multipart_chunksize_mb", 8)
+
+    transfer_config = TransferConfig(
+        multipart_threshold=int(threshold_mb * MB),
+        multipart_chunksize=int(chunk_size_mb * MB),
+        max_concurrency=4,
+    )
+    return int(concurrency), transfer_config
+
+
+#Recursively walk the local directory and yield (path, relative key, stat) one file at a time
+def walk_files(local_file_path):
+    for root, dirs, files in os.walk(local_file_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative_key = os.path.relpath(path, local_file_path).replace(os.sep, "/")
+            try:
+                yield path, relative_key, os.stat(path)
+            except OSError as e:
+                logging.error(f"Skipping {path}: {e}")
+                log_csv("S3", path, "upload-file", "Failed")
+
+
+#Upload one file; failures are logged and reported back so one bad file never stops the batch
+def upload_one(bucket, path, s3_key, transfer_config, extra_args=None):
+    try:
+        bucket.meta.client.upload_file(path, bucket.name, s3_key, Config=transfer_config, ExtraArgs=extra_args)
+        logging.info(f"{s3_key} has been uploaded to {bucket.name}")
+        log_csv("S3", bucket.name, "upload-file", "Success")
+        return True
+    except ClientError as e:
+        logging.error(f"An AWS error occured when trying to uploading {path}: ({e.response['Error']['Code']}): {e}")
+        log_csv("S3", bucket.name, "upload-file", "Failed")
+    except Exception as e:
+        logging.error(f"An error occured when trying to uploading {path}: {e}")
+        log_csv("S3", bucket.name, "upload-file", "Failed")
+    return False
+
+
+#Sync manifest: remembers the size, mtime and content hash of every uploaded file
+#so unchanged files are skipped with a stat instead of being uploaded again
+def get_manifest_path(bucket_name, prefix, config):
+    manifest_dir = (config or {}).get("manifest_dir") or log_path
+    safe_prefix = prefix.strip("/").replace("/", "_") or "root"
+    return os.path.join(manifest_dir, f"manifest-{bucket_name}-{safe_prefix}.json")
+
+
+#Returns (manifest, stale); a missing or unreadable manifest is always stale
+def load_manifest(path, max_age_hours):
+    try:
+        with open(path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {"reconciled_at": 0, "files": {}}, True
+    stale = time.time() - manifest.get("reconciled_at", 0) > max_age_hours * 3600
+    return manifest, stale
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, path)
+
+
+#One paginated listing of the destination prefix, no HEAD per object
+def list_remote_objects(bucket, prefix):
+    remote = {}
+    paginator = bucket.meta.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket.name, Prefix=f"{prefix}/"):
+        for obj in page.get("Contents", []):
+            remote[obj["Key"]] = {"size": obj["Size"], "etag": obj["ETag"].strip('"')}
+    return remote
+
+
+#Drop manifest entries whose object is gone or has a different size in the bucket
+def reconcile_manifest(manifest, remote):
+    files = manifest["files"]
+    for key in list(files):
+        remote_entry = remote.get(key)
+        if not remote_entry or remote_entry["size"] != files[key]["size"]:
+            del files[key]
+    manifest["reconciled_at"] = time.time()
+
+
+#SHA-256 of the content plus the ETag S3 would give the object under this transfer config
+def file_hashes(path, transfer_config):
+    chunk_size = transfer_config.multipart_chunksize
+    sha256 = hashlib.sha256()
+    whole_md5 = hashlib.md5()
+    part_digests = []
+    size = 0
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            sha256.update(chunk)
+            whole_md5.update(chunk)
+            part_digests.append(hashlib.md5(chunk).digest())
+
+    if size >= transfer_config.multipart_threshold and len(part_digests) > 1:
+        etag = f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+    else:
+        etag = whole_md5.hexdigest()
+    return sha256.hexdigest(), etag
+
+
+#Send a file, or what the pre-upload stage made of it; returns (status, bytes sent).
+#size is the walk's stat of the file, so a file that vanished meanwhile fails its upload and nothing else.
+#Content already uploaded in this run is copied server-side instead of sent again.
+def send_file(bucket, path, s3_key, size, transfer_config, prepared=None, stage=None):
+    if prepared is None:
+        if upload_one(bucket, path, s3_key, transfer_config):
+            return "uploaded", size
+        return "failed", 0
+
+    options, contents = stage
+    try:
+        source_key = contents.find(prepared)
+        if source_key:
+            try:
+                bucket.meta.client.copy({"Bucket": bucket.name, "Key": source_key}, bucket.name, s3_key, Config=transfer_config)
+                logging.info(f"{s3_key} has the same content as {source_key}, copied within {bucket.name}")
+                log_csv("S3", bucket.name, "upload-file (copy)", "Success")
+                return "copied", 0
+            except Exception as e:
+                logging.warning(f"Could not copy {source_key} to {s3_key}, uploading instead: {e}")
+        if upload_one(bucket, prepared["upload_path"], s3_key, transfer_config, upload_args(prepared, options)):
+            contents.add(prepared, s3_key)
+            return "uploaded", prepared["upload_size"]
+        return "failed", 0
+    finally:
+        discard(prepared)
+
+
+#Hash a changed/unknown file and upload it only if its content differs from what is already in S3
+def sync_one(bucket, path, s3_key, stat, entry, remote_entry, transfer_config, prepared=None, stage=None):
+    try:
+        if prepared:
+            sha256, etag = prepared["sha256"], prepared["etag"]
+        else:
+            sha256, etag = file_hashes(path, transfer_config)
+    except OSError as e:
+        logging.error(f"An error occured when trying to hash {path}: {e}")
+        log_csv("S3", bucket.name, "upload-file", "Failed")
+        return "failed", None, 0
+
+    new_entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256, "etag": etag}
+    if (entry and entry.get("sha256") == sha256) or \
+            (remote_entry and remote_entry["size"] == (prepared or {}).get("upload_size", stat.st_size) and remote_entry["etag"] == etag):
+        discard(prepared)
+        return "skipped", new_entry, 0
+
+    status, sent = send_file(bucket, path, s3_key, stat.st_size, transfer_config, prepared, stage)
+    return status, (new_entry if status != "failed" else None), sent
+
+
+def plain_upload(bucket, path, s3_key, size, transfer_config, prepared=None, stage=None):
+    status, sent = send_file(bucket, path, s3_key, size, transfer_config, prepared, stage)
+    return status, None, sent
+
+
 #Upload files to S3 bucket
+#Files stream from a recursive walk into a bounded worker pool
+#With --sync, keys are stable (prefix/<path>) and unchanged files are skipped via the manifest
 def upload_files_s3(args, config=None):
     bucket = get_bucket(args, config)
+    config = config or {}
 
     if hasattr(args, "prefix") and args.prefix:
         prefix = args.prefix
-    elif config and config.get("prefix"):
+    elif config.get("prefix"):
         prefix = config.get("prefix")
     else:
         prefix = "default"
 
+    sync = getattr(args, "sync", False) or config.get("sync", False)
 
     today = datetime.now().date().strftime("%Y-%m-%d")
+    key_base = prefix if sync else f"{prefix}/{today}"
 
     local_file_path = args.local_file_path or config.get("local_file_path")
-    for file in os.listdir(local_file_path):
-        s3_file_path = os.path.join(local_file_path, file)
-        s3_key = f"{prefix}/{str(today)}/{os.path.basename(s3_file_path)}"
-    #Ensure we upload only files
-        if os.path.isfile(s3_file_path):
-          try:
-               bucket.upload_file(s3_file_path, s3_key)
-               logging.info(f"{file} has been uploaded to {bucket.name}")
-               log_csv("S3", bucket.name, "upload-file", "Success")
-          except ClientError as e:
-               logging.error(f"An AWS error occured when trying to uploading {file}: ({e.response['Error']['Code']}): {e}")
-               log_csv("S3", bucket.name, "upload-file", "Failed")
-          except Exception as e:
-               logging.error(f"An error occured when trying to uploading {file}: {e}")
-               log_csv("S3", bucket.name, "upload-file", "Failed")
-
-               
+    if not local_file_path or not os.path.isdir(local_file_path):
+        raise FileNotFoundError(f"Local directory not found: {local_file_path}")
+    concurrency, transfer_config = get_upload_settings(args, config)
+    #Optional pre-upload stage: checksums and compression in a process pool
+    options = get_prepare_settings(args, config, transfer_config, sync)
+    stage = (options, ContentIndex()) if options else None
 
-#Delete old files based on the last-time-modification
-#Set a cut-off day for files to be deleted
+    manifest, remote = None, {}
+    if sync:
+        manifest_file = get_manifest_path(bucket.name, prefix, config)
+        manifest, stale = load_manifest(manifest_file, config.get("manifest_max_age_hours", 24))
+        if stale:
+            logging.info(f"Manifest for {bucket.name}/{prefix} is missing or stale, reconciling against the bucket listing")
+            remote = list_remote_objects(bucket, prefix)
+            reconcile_manifest(manifest, remote)
 
-def delete_files_s3(args, config):
-    bucket = get_bucket(args, config)
-    if hasattr(args, "cut_off_days") and args.cut_off_days:
-        days = args.cut_off_days
-    elif config and config.get("cut_off_days"):
-        days = config.get("cut_off_days")
-    else:
-        days = 30
-    cut_off_day = datetime.now(timezone.utc) - timedelta(days=days)
-    files_to_delete = []
-    for obj in bucket.objects.all():
+    #Bound the number of queued files so a huge tree is never materialised in memory
+    slots = threading.BoundedSemaphore(concurrency * 2 + (options["workers"] if options else 0))
+    lock = threading.Lock()
+    totals = {"uploaded": 0, "copied": 0, "skipped": 0, "failed": 0, "bytes": 0, "source_bytes": 0}
+
+    #The slot is always released, whatever the upload did, or the walk would eventually block for good
+    def on_done(future, s3_key, size):
         try:
-            if obj.last_modified < cut_off_day:
-              files_to_delete.append(obj.key)
-              logging.info(f"{obj.key} has been added to the files to be deleted")
-              log_csv("S3", bucket.name, "file-added-to-deletelist", "Success")
-        except ClientError as e:
-              logging.error(f"An AWS error occured when adding {obj.key} to the files to be deleted ({e.response['Error']['Code']}): {e}")
-              log_csv("S3", bucket.name, "file-added-to-deletelist", "Failed")
+            status, entry, sent = future.result()
         except Exception as e:
-              logging.error(f"An error occured when adding {obj.key} to the files to be deleted {e}")
-              log_csv("S3", bucket.name, "file-added-to-deletelist", "Failed") 
-        
+            logging.error(f"An error occured when trying to upload {s3_key}: {e}")
+            log_csv("S3", bucket.name, "upload-file", "Failed")
+            status, entry, sent = "failed", None, 0
+        try:
+            with lock:
+                totals[status] += 1
+                if status == "uploaded":
+                    totals["bytes"] += sent
+                    totals["source_bytes"] += size
+                if entry:
+                    manifest["files"][s3_key] = entry
+        finally:
+            slots.release()
+
+    def submit_upload(task, s3_key, size):
+        future = pool.submit(*task)
+        future.add_done_callback(lambda done: on_done(done, s3_key, size))
 
-    if files_to_delete:
-        delete_dict = {'Objects': [{'Key': key} for key in files_to_delete]}
+    #Runs on the process pool's result thread: hand the prepared file to an upload thread
+    def on_prepared(future, task, s3_key, size):
         try:
-            bucket.delete_objects(Delete=delete_dict)
-            logging.info(f" Objects have been deleted from {bucket.name} successfully")
-            log_csv("S3", bucket.name, "file-deletion", "Success")    
-        except ClientError as e:
-            logging.error(f"An AWS error occured while deleting the objects: {e.response['Error']['Code']}): {e} ")
-            log_csv("S3", bucket.name, "file-deletion", "Failed")      
+            prepared = future.result()
         except Exception as e:
-            logging.error(f"An error occurred while deleting the objects: {e}")
+            logging.error(f"An error occured when trying to prepare {task[2]}: {e}")
+            log_csv("S3", bucket.name, "upload-file", "Failed")
+            with lock:
+                totals["failed"] += 1
+            slots.release()
+            return
+        submit_upload(task + (prepared, stage), s3_key, size)
+
+    start = time.perf_counter()
+    if options:
+        options["staging"] = tempfile.mkdtemp(prefix="upload-staging-")
+    try:
+        #The process pool closes first, so every prepared file reaches the upload pool before it shuts down
+        with ThreadPoolExecutor(max_workers=concurrency, initializer=inherit_account()) as pool, \
+                (ProcessPoolExecutor(max_workers=options["workers"]) if options else nullcontext()) as processes:
+            for path, relative_key, stat in walk_files(local_file_path):
+                s3_key = f"{key_base}/{relative_key}"
+                if sync:
+                    entry = manifest["files"].get(s3_key)
+                    #Fast path: same size and mtime as the last upload
+                    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                        with lock:
+                            totals["skipped"] += 1
+                        continue
+                    task = (sync_one, bucket, path, s3_key, stat, entry, remote.get(s3_key), transfer_config)
+                else:
+                    task = (plain_upload, bucket, path, s3_key, stat.st_size, transfer_config)
+                slots.acquire()
+                if processes:
+                    future = processes.submit(prepare_file, path, options)
+                    future.add_done_callback(lambda done, task=task, key=s3_key, size=stat.st_size: on_prepared(done, task, key, size))
+                else:
+                    submit_upload(task, s3_key, stat.st_size)
+    finally:
+        if sync:
+            save_manifest(manifest_file, manifest)
+        if options:
+            shutil.rmtree(options["staging"], ignore_errors=True)
+    elapsed = time.perf_counter() - start
+
+    rate = totals["bytes"] / elapsed / MB if elapsed else 0
+    logging.info(f"Uploaded {totals['uploaded']} files ({totals['source_bytes'] / MB:.1f} MB, {totals['bytes'] / MB:.1f} MB sent) "
+                 f"to {bucket.name} in {elapsed:.1f}s ({rate:.2f} MB/s), {totals['copied']} copied, "
+                 f"{totals['skipped']} unchanged, {totals['failed']} failed")
+    log_csv("S3", bucket.name, f"[UPLOADED] {totals['uploaded']} [SKIPPED] {totals['skipped']} [FAILED] {totals['failed']}",
+            "Success" if not totals["failed"] else "Partial")
+    return totals
+
+
+
+DELETE_BATCH_SIZE = 1000   # delete_objects API limit
+
+
+def get_list_workers(args, config):
+    return getattr(args, "list_workers", None) or (config or {}).get("list_workers", 8)
+
+
+#Stream every object older than the cut-off. The bucket is listed as concurrent prefix shards (s3_listing),
+#not one paginator chain, so objects arrive in no particular key order
+def iter_old_objects(bucket, cut_off_day, workers=8):
+    for obj in iter_objects(bucket.meta.client, bucket.name, workers=workers):
+        if obj["LastModified"] < cut_off_day:
+            yield obj
+
+
+#Send one batch of up to 1000 keys and account for the per-key Errors array
+def delete_batch(bucket, batch_number, keys):
+    try:
+        response = bucket.meta.client.delete_objects(
+            Bucket=bucket.name,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+        errors = response.get("Errors", [])
+        for error in errors:
+            logging.error(f"Could not delete {error.get('Key')} from {bucket.name}: ({error.get('Code')}) {error.get('Message')}")
             log_csv("S3", bucket.name, "file-deletion", "Failed")
+    except ClientError as e:
+        logging.error(f"An AWS error occured while deleting batch {batch_number}: ({e.response['Error']['Code']}): {e}")
+        errors = [{"Key": key, "Code": e.response["Error"]["Code"]} for key in keys]
+    except Exception as e:
+        logging.error(f"An error occurred while deleting batch {batch_number}: {e}")
+        errors = [{"Key": key, "Code": type(e).__name__} for key in keys]
+
+    deleted = len(keys) - len(errors)
+    logging.info(f"Batch {batch_number}: deleted {deleted}/{len(keys)} objects from {bucket.name}")
+    log_csv("S3", bucket.name, f"file-deletion batch {batch_number} ({deleted}/{len(keys)})", "Success" if not errors else "Failed")
+    return {"batch": batch_number, "requested": len(keys), "deleted": deleted, "errors": errors}
+
+
+#Cut full 1000-key batches from any key stream and hand them to a small pool of delete workers
+#while the stream keeps producing; only a bounded number of batches are ever held in memory
+def delete_keys_batched(bucket, keys, workers=4):
+    slots = threading.BoundedSemaphore(workers * 2)
+    lock = threading.Lock()
+    totals = {"listed": 0, "batches": 0, "deleted": 0, "failed": 0, "failed_batches": []}
+
+    def on_done(future):
+        result = future.result()
+        with lock:
+            totals["batches"] += 1
+            totals["deleted"] += result["deleted"]
+            totals["failed"] += len(result["errors"])
+            if result["errors"]:
+                totals["failed_batches"].append({"batch": result["batch"], "errors": len(result["errors"]),
+                                                 "codes": sorted({error.get("Code") for error in result["errors"]})})
+        slots.release()
+
+    def submit(batch_number, batch):
+        slots.acquire()
+        pool.submit(delete_batch, bucket, batch_number, batch).add_done_callback(on_done)
+
+    with ThreadPoolExecutor(max_workers=workers, initializer=inherit_account()) as pool:
+        batch, batch_number = [], 0
+        for key in keys:
+            batch.append(key)
+            totals["listed"] += 1
+            if len(batch) == DELETE_BATCH_SIZE:
+                batch_number += 1
+                submit(batch_number, batch)
+                batch = []
+        if batch:
+            submit(batch_number + 1, batch)
+    return totals
+
+
+def get_cut_off_days(args, config):
+    if hasattr(args, "cut_off_days") and args.cut_off_days:
+        return args.cut_off_days
+    elif config and config.get("cut_off_days"):
+        return config.get("cut_off_days")
+    return 30
+
+
+def get_delete_workers(args, config):
+    return getattr(args, "delete_workers", None) or (config or {}).get("delete_workers", 4)
+
+
+#Delete a stream of keys and report the totals
+def expire_keys(bucket, keys, days, workers):
+    try:
+        totals = delete_keys_batched(bucket, keys, workers)
+    except ClientError as e:
+        logging.error(f"An AWS error occured while listing {bucket.name}: ({e.response['Error']['Code']}): {e}")
+        log_csv("S3", bucket.name, "file-deletion", "Failed")
+        return
+    except Exception as e:
+        logging.error(f"An error occurred while listing {bucket.name}: {e}")
+        log_csv("S3", bucket.name, "file-deletion", "Failed")
+        return
+
+    logging.info(f"{totals['deleted']} of {totals['listed']} objects older than {days} days deleted from {bucket.name} "
+                 f"in {totals['batches']} batches, {totals['failed']} failed")
+    log_csv("S3", bucket.name, f"[DELETED] {totals['deleted']} [FAILED] {totals['failed']}",
+            "Success" if not totals["failed"] else "Partial")
+    return totals
+
+
+#Delete candidates as change-set items: from an S3 Inventory manifest when one is given, otherwise from a listing
+def iter_delete_candidates(args, config, bucket, cut_off_day):
+    inventory = getattr(args, "inventory", None) or (config or {}).get("inventory_manifest")
+    if inventory:
+        for key, size, last_modified in iter_inventory_objects(inventory, bucket.name, cut_off_day,
+                                                               (config or {}).get("inventory_max_age_hours", 48)):
+            yield {"key": key, "size": size, "last_modified": last_modified}
+        return
+    for obj in iter_old_objects(bucket, cut_off_day, get_list_workers(args, config)):
+        yield {"key": obj["Key"], "size": obj["Size"], "last_modified": obj["LastModified"].isoformat()}
+
+
+#Delete old files based on the last-time-modification
+#Set a cut-off day for files to be deleted
+def delete_files_s3(args, config):
+    bucket = get_bucket(args, config)
+    days = get_cut_off_days(args, config)
+    cut_off_day = datetime.now(timezone.utc) - timedelta(days=days)
+    keys = (item["key"] for item in iter_delete_candidates(args, config, bucket, cut_off_day))
+    return expire_keys(bucket, keys, days, get_delete_workers(args, config))
+
+
+#--dry-run: list once and record every object delete-file would remove
+def plan_delete_files_s3(args, config):
+    bucket = get_bucket(args, config)
+    days = get_cut_off_days(args, config)
+    cut_off_day = datetime.now(timezone.utc) - timedelta(days=days)
+    header = {"bucket": bucket.name, "cut_off_days": days}
+    return header, iter_delete_candidates(args, config, bucket, cut_off_day)
+
+
+#--apply: delete straight from the change set without listing the bucket again
+def apply_delete_files_s3(header, items, args, config):
+    bucket = get_resource("s3").Bucket(header["bucket"])
+    keys = (item["key"] for item in items)
+    return expire_keys(bucket, keys, header["cut_off_days"], get_delete_workers(args, config))
+
+
+
+OBJECT_FIELDS = ["key", "size", "last_modified", "storage_class", "etag"]
+
+
+#Size/age/storage-class filters for list-objects; every unset filter matches
+def object_filter(args):
+    now = datetime.now(timezone.utc)
+    older = now - timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+    newer = now - timedelta(days=args.newer_than_days) if args.newer_than_days is not None else None
+    classes = set(args.storage_class) if args.storage_class else None
+
+    def matches(obj):
+        if args.min_size is not None and obj["Size"] < args.min_size:
+            return False
+        if args.max_size is not None and obj["Size"] > args.max_size:
+            return False
+        if older and obj["LastModified"] >= older:
+            return False
+        if newer and obj["LastModified"] < newer:
+            return False
+        return classes is None or obj.get("StorageClass", "STANDARD") in classes
+    return matches
+
+
+def object_row(obj):
+    return {"key": obj["Key"], "size": obj["Size"], "last_modified": obj["LastModified"].isoformat(),
+            "storage_class": obj.get("StorageClass", "STANDARD"), "etag": obj.get("ETag", "").strip('"')}
+
+
+#Stream a bucket's objects as NDJSON or CSV (stdout or --output), listing prefix shards concurrently
+def list_objects_s3(args, config):
+    bucket = get_bucket(args, config)
+    matches = object_filter(args)
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    listed = written = 0
+    try:
+        if args.format == "csv":
+            writer = csv.DictWriter(output, fieldnames=OBJECT_FIELDS)
+            writer.writeheader()
+            emit = writer.writerow
+        else:
+            emit = lambda row: output.write(json.dumps(row) + "\n")
+
+        for obj in iter_objects(bucket.meta.client, bucket.name, args.prefix or "",
+                                workers=get_list_workers(args, config), ordered=args.ordered):
+            listed += 1
+            if matches(obj):
+                emit(object_row(obj))
+                written += 1
+    except ClientError as e:
+        logging.error(f"An AWS error occured while listing {bucket.name}: ({e.response['Error']['Code']}): {e}")
+        log_csv("S3", bucket.name, "list-objects", "Failed")
+        raise
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    logging.info(f"{written} of {listed} objects listed from {bucket.name}")
+    log_csv("S3", bucket.name, f"list-objects [LISTED] {listed} [MATCHED] {written}", "Success")
+    return {"listed": listed, "matched": written}
 
 
 
 
 S3_ACTIONS = {
     "list-buckets": list_all_buckets,
+    "list-objects": list_objects_s3,
     "upload-file": upload_files_s3,
     "delete-file": delete_files_s3
-}    
-                                       
+}
+
+
+S3_PLANNERS = {
+    "delete-file": (plan_delete_files_s3, apply_delete_files_s3),
+}
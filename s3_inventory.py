@@ -0,0 +1,140 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+from itertools import islice
+from urllib.parse import unquote_plus
+from logging_setup import logging
+from aws_clients import get_client
+
+# S3 Inventory as a candidate source
+# An inventory manifest (manifest.json) lists the data files of one daily/weekly inventory run.
+# Reading those files replaces listing the bucket: no LIST calls, one GET per data file.
+# CSV.gz is read with the standard library; ORC and Parquet need pyarrow.
+
+BATCH_ROWS = 10000
+
+
+#"s3://bucket/key" -> (bucket, key); local paths -> (None, path)
+def split_location(location):
+    if location.startswith("s3://"):
+        bucket, _, key = location[5:].partition("/")
+        return bucket, key
+    return None, location
+
+
+def load_manifest(location):
+    bucket, key = split_location(location)
+    if bucket:
+        body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"]
+        return json.loads(body.read())
+    with open(key) as file:
+        return json.load(file)
+
+
+def manifest_age_hours(manifest):
+    created = int(manifest.get("creationTimestamp", 0)) / 1000
+    return (time.time() - created) / 3600 if created else 0
+
+
+#Data files live in the destination bucket; for a local manifest they are looked up
+#under the manifest's directory (as written, or by file name in data/ next to or above it)
+def open_data_file(manifest, manifest_location, file_key):
+    bucket, path = split_location(manifest_location)
+    if bucket:
+        destination = manifest["destinationBucket"].split(":::")[-1]
+        spool = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+        get_client("s3").download_fileobj(destination, file_key, spool)
+        spool.seek(0)
+        return spool
+
+    directory = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(file_key)
+    for candidate in (os.path.join(directory, file_key), os.path.join(directory, "data", name),
+                      os.path.join(os.path.dirname(directory), "data", name)):
+        if os.path.exists(candidate):
+            return open(candidate, "rb")
+    raise FileNotFoundError(f"Inventory data file {file_key} not found next to {path}")
+
+
+#Inventory timestamps are fixed-width UTC strings, so the cut-off compares as a plain string
+def inventory_timestamp(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+#Batches of (key, size, last_modified) older than the cut-off from one CSV.gz data file
+def csv_batches(file, schema, cut_off_day):
+    columns = [name.strip() for name in schema.split(",")]
+    key_at, size_at, modified_at = columns.index("Key"), columns.index("Size"), columns.index("LastModifiedDate")
+    latest_at = columns.index("IsLatest") if "IsLatest" in columns else None
+    marker_at = columns.index("IsDeleteMarker") if "IsDeleteMarker" in columns else None
+    cut_off = inventory_timestamp(cut_off_day)
+
+    rows = csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=file), encoding="utf-8", newline=""))
+    while True:
+        batch = list(islice(rows, BATCH_ROWS))
+        if not batch:
+            return
+        yield [(unquote_plus(row[key_at]), int(row[size_at] or 0), row[modified_at]) for row in batch
+               if row[modified_at] and row[modified_at] < cut_off
+               and (latest_at is None or row[latest_at] == "true")
+               and (marker_at is None or row[marker_at] != "true")]
+
+
+def arrow_batches(file, file_format, cut_off_day):
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        raise RuntimeError(f"Reading {file_format} inventories needs pyarrow (pip install pyarrow)")
+
+    if file_format == "Parquet":
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(file).iter_batches(batch_size=BATCH_ROWS)
+    else:
+        import pyarrow.orc as orc
+        reader = orc.ORCFile(file)
+        batches = (reader.read_stripe(stripe) for stripe in range(reader.nstripes))
+
+    for batch in batches:
+        names = batch.schema.names
+        modified = batch.column(names.index("last_modified_date"))
+        cut_off = pa.scalar(cut_off_day, type=pa.timestamp("us", tz="UTC")).cast(modified.type)
+        mask = pc.fill_null(pc.less(modified, cut_off), False)
+        if "is_latest" in names:
+            mask = pc.and_(mask, pc.fill_null(batch.column(names.index("is_latest")), False))
+        if "is_delete_marker" in names:
+            mask = pc.and_(mask, pc.invert(pc.fill_null(batch.column(names.index("is_delete_marker")), False)))
+        kept = batch.filter(mask)
+        keys = kept.column(names.index("key")).to_pylist()
+        sizes = kept.column(names.index("size")).to_pylist()
+        dates = kept.column(names.index("last_modified_date")).to_pylist()
+        yield [(key, size or 0, date.isoformat()) for key, size, date in zip(keys, sizes, dates)]
+
+
+#Stream (key, size, last_modified) for every current object older than the cut-off, one data file at a time
+def iter_inventory_objects(location, bucket_name, cut_off_day, max_age_hours=None):
+    manifest = load_manifest(location)
+    source = manifest.get("sourceBucket")
+    if source and source != bucket_name:
+        raise ValueError(f"Inventory {location} is for bucket {source}, not {bucket_name}")
+    age = manifest_age_hours(manifest)
+    if max_age_hours and age > max_age_hours:
+        raise ValueError(f"Inventory {location} is {age:.1f}h old (limit {max_age_hours}h)")
+
+    file_format = manifest.get("fileFormat", "CSV")
+    files = manifest.get("files", [])
+    logging.info(f"Reading {len(files)} {file_format} inventory file(s) for {bucket_name} from {location}")
+    for entry in files:
+        with open_data_file(manifest, location, entry["key"]) as file:
+            if file_format == "CSV":
+                batches = csv_batches(file, manifest["fileSchema"], cut_off_day)
+            elif file_format in ("Parquet", "ORC"):
+                batches = arrow_batches(file, file_format, cut_off_day)
+            else:
+                raise ValueError(f"Unsupported inventory format: {file_format}")
+            for batch in batches:
+                yield from batch
@@ -0,0 +1,173 @@
+import bisect
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logging_setup import logging
+from aws_clients import inherit_account
+
+# Prefix-sharded bucket listing
+# Delimiter queries discover the bucket's prefix layout; each discovered prefix becomes a shard that
+# is listed by its own pagination chain, so listing throughput scales with the number of workers.
+# Levels too big to discover cheaply are cut into key ranges (StartAfter .. next boundary) instead.
+# Every shard covers a disjoint, contiguous key range, which is what makes the ordered merge possible.
+
+RANGE_BOUNDARIES = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+MAX_DISCOVERY_PAGES = 5
+SHARD_QUEUE_PAGES = 8
+_END = object()
+
+
+class Shard:
+    __slots__ = ("prefix", "low", "high", "objects")
+
+    def __init__(self, prefix, low=None, high=None, objects=None):
+        self.prefix = prefix
+        self.low = low          # first key in the shard (inclusive), None = start of prefix
+        self.high = high        # first key after the shard (exclusive), None = end of prefix
+        self.objects = objects  # already-listed objects (found during discovery)
+
+    @property
+    def sort_key(self):
+        return self.low if self.low is not None else self.prefix
+
+
+# Cut one prefix into key ranges on the character that follows the prefix
+def range_shards(prefix, count):
+    step = max(1, len(RANGE_BOUNDARIES) // max(1, count - 1))
+    bounds = [prefix + char for char in RANGE_BOUNDARIES[::step]]
+    lows = [None] + bounds
+    highs = bounds + [None]
+    return [Shard(prefix, low, high) for low, high in zip(lows, highs)]
+
+
+# A level's direct objects as shards. Objects and child prefixes interleave in key order, so the objects
+# are cut at every child prefix: each run stays a contiguous key range that sorts between its neighbours
+def object_shards(level, objects, children):
+    children = sorted(children)
+    shards, run, position = [], [], None
+    for obj in objects:
+        between = bisect.bisect_right(children, obj["Key"])
+        if run and between != position:
+            shards.append(Shard(level, run[0]["Key"], None, run))
+            run = []
+        position = between
+        run.append(obj)
+    if run:
+        shards.append(Shard(level, run[0]["Key"], None, run))
+    return shards
+
+
+# Delimiter query for one level; returns (child prefixes, direct objects) or None if the level is too big
+def discover_level(client, bucket, prefix):
+    paginator = client.get_paginator("list_objects_v2")
+    children, objects = [], []
+    pages = paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/", PaginationConfig={"PageSize": 1000})
+    for number, page in enumerate(pages, start=1):
+        children += [entry["Prefix"] for entry in page.get("CommonPrefixes", [])]
+        objects += page.get("Contents", [])
+        if number >= MAX_DISCOVERY_PAGES and page.get("IsTruncated"):
+            return None
+    return children, objects
+
+
+def discover_shards(client, bucket, prefix="", target=64, max_depth=4):
+    shards, frontier = [], [prefix]
+    for depth in range(max_depth + 1):
+        next_frontier = []
+        for level in frontier:
+            found = discover_level(client, bucket, level)
+            if found is None:
+                shards += range_shards(level, max(2, target // max(1, len(frontier))))
+                continue
+            children, objects = found
+            shards += object_shards(level, objects, children)
+            next_frontier += children
+        if not next_frontier:
+            break
+        if len(shards) + len(next_frontier) >= target or depth == max_depth:
+            shards += [Shard(child) for child in next_frontier]
+            break
+        frontier = next_frontier
+    shards.sort(key=lambda shard: shard.sort_key)
+    logging.info(f"Listing s3://{bucket}/{prefix} as {len(shards)} shards")
+    return shards
+
+
+# One shard's pagination chain; pages are passed on as lists of objects
+def list_shard(client, bucket, shard):
+    if shard.objects is not None:
+        yield shard.objects
+        return
+    params = {"Bucket": bucket, "Prefix": shard.prefix, "PaginationConfig": {"PageSize": 1000}}
+    if shard.low is not None:
+        #StartAfter is exclusive, so start just below the boundary and drop anything before it
+        params["StartAfter"] = shard.low[:-1] + chr(ord(shard.low[-1]) - 1) + "\U0010ffff"
+    for page in client.get_paginator("list_objects_v2").paginate(**params):
+        contents = page.get("Contents", [])
+        if shard.low is not None:
+            contents = [obj for obj in contents if obj["Key"] >= shard.low]
+        if shard.high is not None:
+            kept = [obj for obj in contents if obj["Key"] < shard.high]
+            yield kept
+            if len(kept) < len(contents):
+                return
+        else:
+            yield contents
+
+
+# Stream every object under the prefix, listing shards concurrently.
+# ordered=True yields in key order (shard by shard, each shard buffering at most a few pages);
+# otherwise objects are yielded as soon as any shard produces them.
+def iter_objects(client, bucket, prefix="", workers=8, ordered=False):
+    shards = discover_shards(client, bucket, prefix, target=workers * 4)
+    queues = [queue.Queue(maxsize=SHARD_QUEUE_PAGES if ordered else 0) for _ in shards]
+    merged = queue.Queue(maxsize=workers * SHARD_QUEUE_PAGES)
+    stop = threading.Event()
+
+    #Once the consumer has gone nothing drains the queues, so a put must never block past that point
+    def put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(index):
+        if stop.is_set():
+            return
+        target = queues[index] if ordered else merged
+        try:
+            for page in list_shard(client, bucket, shards[index]):
+                if not put(target, page):
+                    return
+        except Exception as e:
+            put(target, e)
+        finally:
+            put(target, _END)
+
+    with ThreadPoolExecutor(max_workers=workers, initializer=inherit_account()) as pool:
+        for index in range(len(shards)):
+            pool.submit(run, index)
+        try:
+            if ordered:
+                for shard_queue in queues:
+                    yield from drain(shard_queue, 1)
+            else:
+                yield from drain(merged, len(shards))
+        finally:
+            #Consumer stopped early or a shard failed: workers give up their puts and queued shards never start
+            stop.set()
+
+
+def drain(source, producers):
+    remaining = producers
+    while remaining:
+        page = source.get()
+        if page is _END:
+            remaining -= 1
+        elif isinstance(page, Exception):
+            raise page
+        else:
+            yield from page
@@ -0,0 +1,214 @@
+import base64
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+
+# Pre-upload stage
+# Hashing and compression run in a process pool so the CPU work never competes with the
+# upload threads. Each worker returns a small dict describing what to send: the file (or a
+# compressed copy in the staging directory), its content checksums and the S3 headers to set.
+# Nothing here imports boto3, so worker processes start quickly.
+
+COMPRESSIBLE_EXTENSIONS = {".log", ".txt", ".csv", ".tsv", ".json", ".jsonl", ".ndjson", ".xml", ".html",
+                           ".css", ".js", ".md", ".yaml", ".yml", ".sql", ".svg"}
+COMPRESS_MIN_BYTES = 1024
+MMAP_MIN_BYTES = 1024 * 1024
+READ_CHUNK = 8 * 1024 * 1024
+
+
+#Settings for the stage, or None when neither checksums nor compression are wanted
+def get_prepare_settings(args, config, transfer_config, sync):
+    config = config or {}
+    checksum = getattr(args, "checksum", None) or config.get("upload_checksum")
+    compress = getattr(args, "compress", None) or config.get("upload_compress")
+    if checksum == "none":
+        checksum = None
+    if compress == "none":
+        compress = None
+    if not checksum and not compress:
+        return None
+    if compress == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ValueError("--compress zstd needs the zstandard package (pip install zstandard)")
+
+    return {
+        "checksum": checksum,
+        "compress": compress,
+        "level": config.get("compress_level", 6 if compress == "gzip" else 3),
+        "extensions": set(config.get("compress_extensions") or COMPRESSIBLE_EXTENSIONS),
+        "etag": sync,
+        "chunk_size": transfer_config.multipart_chunksize,
+        "threshold": transfer_config.multipart_threshold,
+        "workers": getattr(args, "hash_workers", None) or config.get("hash_workers") or os.cpu_count() or 2,
+        "staging": None,
+    }
+
+
+#Feed a file to consume() buffer by buffer; large files are memory-mapped instead of copied through read().
+#Each buffer is only valid during its consume() call.
+def read_chunks(path, consume):
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        if size < MMAP_MIN_BYTES:
+            consume(file.read())
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for offset in range(0, size, READ_CHUNK):
+                with view[offset:offset + READ_CHUNK] as chunk:
+                    consume(chunk)
+
+
+class Digests:
+    def __init__(self, checksum, etag, chunk_size):
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5() if checksum == "md5" or etag else None
+        self.chunk_size = chunk_size if etag else None
+        self.parts, self._part, self._part_size = [], hashlib.md5(), 0
+        self.size = 0
+
+    def update(self, data):
+        self.size += len(data)
+        self.sha256.update(data)
+        if self.md5:
+            self.md5.update(data)
+        if self.chunk_size:
+            view = memoryview(data)
+            while len(view):
+                take = min(len(view), self.chunk_size - self._part_size)
+                self._part.update(view[:take])
+                self._part_size += take
+                view = view[take:]
+                if self._part_size == self.chunk_size:
+                    self.parts.append(self._part.digest())
+                    self._part, self._part_size = hashlib.md5(), 0
+
+    #The ETag S3 will report for these bytes under the given multipart threshold
+    def etag(self, threshold):
+        parts = self.parts + ([self._part.digest()] if self._part_size else [])
+        if self.size >= threshold and len(parts) > 1:
+            return f"{hashlib.md5(b''.join(parts)).hexdigest()}-{len(parts)}"
+        return self.md5.hexdigest()
+
+
+def compressor(kind, level):
+    if kind == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    # gzip container with a zero mtime, so the same input always compresses to the same bytes
+    return GzipStream(level)
+
+
+class GzipStream:
+    def __init__(self, level):
+        self._buffer = io.BytesIO()
+        self._file = gzip.GzipFile(fileobj=self._buffer, mode="wb", compresslevel=level, mtime=0)
+
+    def compress(self, data):
+        self._file.write(data)
+        return self._drain()
+
+    def flush(self):
+        self._file.close()
+        return self._drain()
+
+    def _drain(self):
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+#Runs in a worker process: hash the file, optionally compress it, and describe the upload
+def prepare_file(path, options):
+    size = os.path.getsize(path)
+    compress = options["compress"]
+    if compress and (size < COMPRESS_MIN_BYTES or os.path.splitext(path)[1].lower() not in options["extensions"]):
+        compress = None
+
+    raw = Digests(options["checksum"], options["etag"] and not compress, options["chunk_size"])
+    if not compress:
+        read_chunks(path, raw.update)
+        return describe(path, path, size, raw, raw, None, options)
+
+    sent = Digests(options["checksum"], options["etag"], options["chunk_size"])
+    handle, compressed_path = tempfile.mkstemp(dir=options["staging"], suffix=f".{compress}")
+    engine = compressor(compress, options["level"])
+    with os.fdopen(handle, "wb") as target:
+        def consume(chunk):
+            raw.update(chunk)
+            data = engine.compress(chunk)
+            if data:
+                sent.update(data)
+                target.write(data)
+
+        read_chunks(path, consume)
+        data = engine.flush()
+        sent.update(data)
+        target.write(data)
+
+    #Not worth it: send the original instead
+    if sent.size >= size * 0.9:
+        os.remove(compressed_path)
+        if options["etag"]:
+            return prepare_file(path, dict(options, compress=None))
+        return describe(path, path, size, raw, raw, None, options)
+    return describe(path, compressed_path, size, raw, sent, compress, options)
+
+
+def describe(path, upload_path, size, raw, sent, encoding, options):
+    prepared = {
+        "path": path,
+        "upload_path": upload_path,
+        "size": size,
+        "upload_size": sent.size,
+        "sha256": raw.sha256.hexdigest(),
+        "encoding": encoding,
+        "checksum_sha256": base64.b64encode(sent.sha256.digest()).decode(),
+    }
+    if options["checksum"] == "md5":
+        prepared["md5"] = sent.md5.hexdigest()
+    if options["etag"]:
+        prepared["etag"] = sent.etag(options["threshold"])
+    return prepared
+
+
+#ExtraArgs for upload_file: Content-Encoding, the content checksum as metadata, and for
+#single-part uploads a SHA-256 checksum header that S3 verifies on receipt
+def upload_args(prepared, options):
+    extra = {"Metadata": {"sha256": prepared["sha256"]}}
+    if prepared.get("md5"):
+        extra["Metadata"]["md5"] = prepared["md5"]
+    if prepared["encoding"]:
+        extra["ContentEncoding"] = prepared["encoding"]
+    if options["checksum"] == "sha256" and prepared["upload_size"] < options["threshold"]:
+        extra["ChecksumSHA256"] = prepared["checksum_sha256"]
+    return extra
+
+
+def discard(prepared):
+    if prepared and prepared["upload_path"] != prepared["path"]:
+        try:
+            os.remove(prepared["upload_path"])
+        except OSError:
+            pass
+
+
+#Content already uploaded in this run, so identical files become server-side copies
+class ContentIndex:
+    def __init__(self):
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def find(self, prepared):
+        with self._lock:
+            return self._keys.get((prepared["sha256"], prepared["encoding"]))
+
+    def add(self, prepared, s3_key):
+        with self._lock:
+            self._keys.setdefault((prepared["sha256"], prepared["encoding"]), s3_key)
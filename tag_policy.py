@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta, timezone
+from fnmatch import fnmatchcase
+
+# Tag policy engine
+# A policy is a list of rules; an instance is selected by the first rule (in config order) it matches.
+# A rule is an AND of conditions. Every condition can be checked locally; the ones EC2 can apply
+# (tag values, tag presence, state, instance type) are also pushed down as describe_instances filters,
+# and rules are merged into as few queries as possible before anything is listed.
+#
+# "tag_policies": [
+#   {"name": "unowned-dev", "all": [{"tag": "env", "equals": "dev"}, {"tag": "owner", "exists": false},
+#                                   {"older_than_days": 7}]},
+#   {"name": "ttl-passed", "state": ["running", "stopped"], "all": [{"tag": "ttl", "expired": true}]}
+# ]
+#
+# Conditions: {"tag", "equals": value or [values]} (EC2 wildcards * and ? allowed), {"tag", "not_equals"},
+# {"tag", "exists": true/false}, {"tag", "expired": true} (tag holds an ISO date/time or epoch seconds),
+# {"older_than_days": n} (launch time), {"instance_type": [types]}.
+
+
+#A single value (or a single condition) written without the list around it
+def as_list(value):
+    return [value] if isinstance(value, (str, dict)) else list(value)
+
+
+def has_wildcard(value):
+    return "*" in value or "?" in value
+
+
+#A date/time tag value as an aware UTC datetime, None if it is not one
+def parse_ttl(value):
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+class Rule:
+    def __init__(self, name, conditions, states=("running",)):
+        self.name = name
+        self.filters = {}       # describe_instances filter name -> allowed values
+        self.predicates = []
+        self.description = []
+        if states:
+            self.push("instance-state-name", states)
+            self.check(lambda record, states=set(states): record.state in states)
+        for condition in conditions:
+            self.compile(condition)
+
+    #Only the first condition on a filter name goes to EC2 (intersecting could leave it with no values);
+    #later ones on the same name are still checked locally
+    def push(self, name, values):
+        if name not in self.filters:
+            self.filters[name] = set(values)
+
+    def check(self, predicate):
+        self.predicates.append(predicate)
+
+    def compile(self, condition):
+        self.description.append(condition)
+        tag = condition.get("tag")
+        if tag and "equals" in condition:
+            values = as_list(condition["equals"])
+            self.push(f"tag:{tag}", values)
+            self.check(lambda record: tag in record.tags and any(fnmatchcase(record.tags[tag], value) for value in values))
+        elif tag and "not_equals" in condition:
+            values = as_list(condition["not_equals"])
+            self.check(lambda record: not any(fnmatchcase(record.tags.get(tag, ""), value) for value in values)
+                       or tag not in record.tags)
+        elif tag and "exists" in condition:
+            if condition["exists"]:
+                self.push("tag-key", [tag])
+                self.check(lambda record: tag in record.tags)
+            else:
+                self.check(lambda record: tag not in record.tags)
+        elif tag and condition.get("expired"):
+            self.push("tag-key", [tag])
+
+            def expired(record):
+                moment = parse_ttl(record.tags.get(tag, ""))
+                return moment is not None and moment < datetime.now(timezone.utc)
+            self.check(expired)
+        elif "older_than_days" in condition:
+            age = timedelta(days=condition["older_than_days"])
+            self.check(lambda record: record.launch_time is not None
+                       and datetime.now(timezone.utc) - record.launch_time > age)
+        elif "instance_type" in condition:
+            types = as_list(condition["instance_type"])
+            self.push("instance-type", types)
+            self.check(lambda record: any(fnmatchcase(record.type or "", value) for value in types))
+        else:
+            raise ValueError(f"Rule {self.name}: unsupported condition {condition}")
+
+    def matches(self, record):
+        return all(predicate(record) for predicate in self.predicates)
+
+
+def load_rules(config, names=None):
+    rules = [Rule(policy["name"], as_list(policy.get("all", [])), as_list(policy.get("state", ["running"])))
+             for policy in config.get("tag_policies") or []]
+    if names:
+        unknown = set(names) - {rule.name for rule in rules}
+        if unknown:
+            raise ValueError(f"Unknown tag policy rule(s): {', '.join(sorted(unknown))}")
+        rules = [rule for rule in rules if rule.name in names]
+    return rules
+
+
+#One tag_key/tag_value pair (CLI or legacy config) as a single-rule policy
+def single_tag_rule(tag_key, tag_value):
+    return Rule(f"{tag_key}={tag_value}", [{"tag": tag_key, "equals": tag_value}])
+
+
+# A query returns a superset of what its rules can match
+class Query:
+    def __init__(self, filters, rules):
+        self.filters = {name: set(values) for name, values in filters.items()}
+        self.rules = rules
+
+    #Everything `other` can return is also returned here
+    def covers(self, other):
+        return all(name in other.filters and other.filters[name] <= values for name, values in self.filters.items())
+
+    def api_filters(self):
+        return [{"Name": name, "Values": sorted(values)} for name, values in sorted(self.filters.items())]
+
+
+#Fewest describe_instances queries that still return every candidate: drop queries covered by another,
+#and union queries that differ in the values of a single filter (EC2 ORs the values of one filter)
+def plan_queries(rules):
+    queries = [Query(rule.filters, [rule]) for rule in rules]
+    merged = True
+    while merged:
+        merged = False
+        for first in queries:
+            for second in queries:
+                if first is second:
+                    continue
+                if first.covers(second):
+                    first.rules += second.rules
+                elif first.filters.keys() == second.filters.keys() and \
+                        sum(first.filters[name] != second.filters[name] for name in first.filters) == 1:
+                    for name in first.filters:
+                        first.filters[name] |= second.filters[name]
+                    first.rules += second.rules
+                else:
+                    continue
+                queries.remove(second)
+                merged = True
+                break
+            if merged:
+                break
+    return queries
+
+
+#First rule, in policy order, that selects the record
+def first_match(rules, record):
+    for rule in rules:
+        if rule.matches(record):
+            return rule
+    return None
@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Fakes shared with the benchmark stand-in; tests import them from here
+from aws_standin import Paginator  # noqa: E402,F401
+
+
+# Keep logs and the audit trail out of the configured log directory
+@pytest.fixture(autouse=True)
+def log_dir(tmp_path, monkeypatch):
+    import logging_setup
+
+    monkeypatch.setattr(logging_setup, "log_path", str(tmp_path))
+    monkeypatch.setattr(logging_setup, "log_file", str(tmp_path / "report.log"))
+    monkeypatch.setattr(logging_setup, "csv_file", str(tmp_path / "report.csv"))
+    monkeypatch.setattr(logging_setup, "_audit_writer", None)
+    yield tmp_path
+    #Drain this test's audit writer while the paths above still point at tmp_path
+    if logging_setup._audit_writer is not None:
+        logging_setup._audit_writer.close()
+
+
+# Put fake clients in the shared client registry: fake_clients("iam", FakeIAM(...)) returns the fake.
+# Registry state (clients, resources, sessions, rate limiters) is restored after the test.
+@pytest.fixture
+def fake_clients(monkeypatch):
+    import aws_clients as registry
+
+    for name in ("_clients", "_resources", "_sessions", "_limiters"):
+        monkeypatch.setattr(registry, name, {})
+
+    def install(service, fake, region=None, account=None, resource=None):
+        registry._clients[(service, region, account)] = fake
+        if resource is not None:
+            registry._resources[(service, region, account)] = resource
+        return fake
+    return install
+
+
+# Run fn in a thread and fail, instead of hanging the suite, if it does not return in time
+def finishes(fn, timeout=10):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = fn()
+        except Exception as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"{getattr(fn, '__name__', 'call')} did not finish in {timeout}s"
+    return outcome
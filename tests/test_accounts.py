@@ -0,0 +1,69 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("botocore.credentials")
+
+import accounts
+import aws_clients
+
+ACCOUNT = {"role_arn": "arn:aws:iam::111111111111:role/OpsAuditor", "id": "111111111111", "name": "111111111111"}
+
+
+# AssumeRole that hands out the given lifetimes in turn
+class FakeSTS:
+    def __init__(self, lifetimes):
+        self.lifetimes = list(lifetimes)
+        self.calls = 0
+
+    def assume_role(self, **params):
+        self.calls += 1
+        return {"Credentials": {"AccessKeyId": f"AKIA{self.calls}", "SecretAccessKey": "secret", "SessionToken": "token",
+                                "Expiration": datetime.now(timezone.utc) + self.lifetimes.pop(0)}}
+
+
+@pytest.fixture
+def sts(fake_clients):
+    return lambda *lifetimes: fake_clients("sts", FakeSTS(lifetimes))
+
+
+def assumed_key():
+    return aws_clients.get_session(ACCOUNT["id"]).get_credentials().get_frozen_credentials().access_key
+
+
+def test_expiring_credentials_are_refreshed_through_assume_role(sts, log_dir):
+    fake = sts(timedelta(minutes=5), timedelta(hours=1))
+    config = {"sts_cache_path": str(log_dir / "sts.json")}
+    accounts.assume_role(ACCOUNT, config, accounts.CredentialCache(config["sts_cache_path"]))
+
+    assert assumed_key() == "AKIA2"
+    assert fake.calls == 2
+    with open(config["sts_cache_path"]) as file:
+        assert [entry["AccessKeyId"] for entry in json.load(file).values()] == ["AKIA2"]
+
+
+def test_cached_credentials_skip_assume_role(sts, log_dir):
+    fake = sts(timedelta(hours=1))
+    cache_path = str(log_dir / "sts.json")
+    accounts.assume_role(ACCOUNT, {}, accounts.CredentialCache(cache_path))
+    accounts.assume_role(ACCOUNT, {}, accounts.CredentialCache(cache_path))
+
+    assert assumed_key() == "AKIA1"
+    assert fake.calls == 1
+
+
+# AssumeRole on the member account's own session would need the role it is refreshing
+class RefusingSTS:
+    def assume_role(self, **params):
+        raise AssertionError("refresh used the member account's credentials")
+
+
+def test_refresh_under_the_member_account_uses_the_default_credentials(sts, fake_clients, log_dir):
+    fake = sts(timedelta(minutes=5), timedelta(hours=1))
+    fake_clients("sts", RefusingSTS(), account=ACCOUNT["id"])
+    accounts.assume_role(ACCOUNT, {}, accounts.CredentialCache(str(log_dir / "sts.json")))
+
+    with aws_clients.use_account(ACCOUNT["id"]):
+        assert assumed_key() == "AKIA2"
+    assert fake.calls == 2
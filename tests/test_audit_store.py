@@ -0,0 +1,48 @@
+import csv
+import gzip
+import multiprocessing
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+import audit_store
+import logging_setup
+
+PROCESSES = 4
+ROWS = 3000
+
+
+def write_rows(path, worker):
+    writer = logging_setup.AuditWriter(path, batch_size=50, flush_interval=0.01, max_bytes=20000)
+    for n in range(ROWS):
+        writer.write(["EC2", f"i-{worker}-{n}", "test", "Success", datetime.now(timezone.utc).isoformat()])
+    writer.flush()
+    writer.close()
+
+
+def rows_in(path, opener=open):
+    with opener(path, "rt", newline="") as file:
+        return [row for row in csv.reader(file) if audit_store.is_row(row)]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork so workers share the patched log directory")
+def test_concurrent_rotation_keeps_every_row(log_dir):
+    path = str(log_dir / "report.csv")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=write_rows, args=(path, worker)) for worker in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    entries = audit_store.read_index()
+    assert len(entries) > 1
+    archived = [row for entry in entries for row in rows_in(os.path.join(audit_store.audit_dir(), entry["segment"]), gzip.open)]
+    active = rows_in(path) if os.path.exists(path) else []
+    resources = [row[audit_store.RESOURCE] for row in archived + active]
+    assert sorted(resources) == sorted(f"i-{worker}-{n}" for worker in range(PROCESSES) for n in range(ROWS))
+    assert sum(entry["rows"] for entry in entries) == len(archived)
+    assert not [name for name in os.listdir(audit_store.audit_dir()) if name.endswith(".tmp")]
+    assert not os.path.exists(f"{path}.rotating")
@@ -0,0 +1,44 @@
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+
+import aws_clients
+
+
+@pytest.fixture
+def session(fake_clients, monkeypatch):
+    monkeypatch.setattr(aws_clients, "_settings", dict(aws_clients.DEFAULT_SETTINGS))
+    monkeypatch.setattr(aws_clients, "_resource_classes", {})
+    default = boto3.Session(aws_access_key_id="test", aws_secret_access_key="test", region_name="us-east-1")
+    created = []
+    client = default.client
+    monkeypatch.setattr(default, "client", lambda *args, **kwargs: created.append(args[0]) or client(*args, **kwargs))
+    aws_clients.register_session(None, default)
+    return created
+
+
+def test_resources_are_built_on_the_registry_client(session):
+    s3 = aws_clients.get_resource("s3")
+    west = aws_clients.get_resource("s3", "us-west-2")
+
+    assert s3.meta.client is aws_clients.get_client("s3")
+    assert west.meta.client is aws_clients.get_client("s3", "us-west-2")
+    #One client per registry key, plus the one boto3 needs to build the resource class the first time
+    assert session == ["s3", "s3", "s3"]
+    assert s3.Bucket("logs").name == "logs"
+
+
+def test_rate_limits_without_a_rate_are_skipped(session):
+    aws_clients.configure({"rate_limits": {"iam:read": {"burst": 5}, "iam:write": {"rate": 2, "burst": 4}, "ec2:read": 10}})
+
+    assert aws_clients.get_limiter("iam:read") is None
+    assert (aws_clients.get_limiter("iam:write").rate, aws_clients.get_limiter("iam:write").capacity) == (2.0, 4.0)
+    assert aws_clients.get_limiter("ec2:read").rate == 10.0
+    #AWS throttles each account separately, so each gets its own bucket
+    assert aws_clients.get_limiter("ec2:read", "111111111111") is not aws_clients.get_limiter("ec2:read")
+
+
+def test_api_families_split_reads_from_writes():
+    assert aws_clients.api_family("ec2", "DescribeInstances") == "ec2:read"
+    assert aws_clients.api_family("s3", "HeadObject") == "s3:read"
+    assert aws_clients.api_family("iam", "DeleteAccessKey") == "iam:write"
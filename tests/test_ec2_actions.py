@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("botocore")
+
+import ec2_actions
+from conftest import Paginator
+
+
+# describe_instances over scripted state sequences; an ID missing from the script does not exist
+class FakeEC2:
+    def __init__(self, states):
+        self.states = {instance_id: list(sequence) for instance_id, sequence in states.items()}
+        self.polls = 0
+
+    def pages(self, Filters):
+        self.polls += 1
+        ids = next(f["Values"] for f in Filters if f["Name"] == "instance-id")
+        instances = []
+        for instance_id in ids:
+            sequence = self.states.get(instance_id)
+            if sequence:
+                state = sequence.pop(0) if len(sequence) > 1 else sequence[0]
+                instances.append({"InstanceId": instance_id, "State": {"Name": state}})
+        yield {"Reservations": [{"Instances": instances}]}
+
+    def get_paginator(self, name):
+        return Paginator(self.pages)
+
+
+def test_terminated_and_missing_instances_stop_the_wait(monkeypatch):
+    monkeypatch.setattr(ec2_actions.time, "sleep", lambda seconds: None)
+    client = FakeEC2({"i-stops": ["stopping", "stopping", "stopped"], "i-terminated": ["shutting-down"]})
+    stopped = ec2_actions.wait_until_stopped(client, ["i-stops", "i-terminated", "i-gone"], timeout=600)
+    assert stopped == ["i-stops"]
+    assert client.polls == 3
+
+
+def test_stuck_instance_times_out(monkeypatch):
+    monkeypatch.setattr(ec2_actions.time, "sleep", lambda seconds: None)
+    client = FakeEC2({"i-stuck": ["stopping"]})
+    assert ec2_actions.wait_until_stopped(client, ["i-stuck"], timeout=0) == []
+
+
+def test_fan_out_over_no_regions_yields_nothing():
+    assert list(ec2_actions.fan_out_regions([], lambda region: ["never"])) == []
+    assert ec2_actions.stop_targets([], {}, timeout=1) == []
+
+
+def test_a_stop_plan_applies_to_its_recorded_region_and_skips_stale_instances(fake_clients, log_dir, monkeypatch):
+    import main
+    from aws_standin import CallCounter, FakeEC2 as StandInEC2
+
+    ec2 = StandInEC2(CallCounter(), 8, region="eu-west-1")
+    fake_clients("ec2", ec2)
+    fake_clients("ec2", ec2, region="eu-west-1")
+    waits = []
+    wait = ec2_actions.wait_until_stopped
+    monkeypatch.setattr(ec2_actions, "wait_until_stopped",
+                        lambda client, ids, timeout: waits.append(timeout) or wait(client, ids, timeout))
+    ids = [ec2.instance(n)["InstanceId"] for n in range(3)]
+    plan = str(log_dir / "plan.jsonl")
+    parser = main.build_parser()
+
+    main.dispatch(parser.parse_args(["--dry-run", "--plan-file", plan, "ec2", "stop-instances", "--instance-ids", *ids]), {})
+    ec2.states[ids[1]] = "stopped"
+    #Applied where the default region is another one: the plan's own region must still be used
+    fake_clients("ec2", StandInEC2(CallCounter(), 0, region="us-west-2"))
+    stopped = main.dispatch(parser.parse_args(["--apply", plan, "--check-stale", "--timeout", "42"]), {})
+
+    assert sorted(stopped) == [ids[0], ids[2]]
+    assert waits == [42]
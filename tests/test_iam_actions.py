@@ -0,0 +1,123 @@
+import csv
+import io
+from collections import Counter
+from datetime import datetime, timezone
+
+from argparse import Namespace
+
+import pytest
+
+pytest.importorskip("botocore")
+from botocore.exceptions import ClientError
+
+import iam_actions
+from conftest import Paginator
+
+NOW = datetime.now(timezone.utc)
+
+
+# A credential report covering report_users, in an account holding account_users
+class FakeIAM:
+    def __init__(self, report_users, account_users):
+        self.report_users = report_users
+        self.account_users = account_users
+        self.calls = Counter()
+
+    def generate_credential_report(self):
+        self.calls["GenerateCredentialReport"] += 1
+        return {"State": "COMPLETE"}
+
+    def get_credential_report(self):
+        self.calls["GetCredentialReport"] += 1
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["user"] + [f"access_key_{slot}_{field}" for slot in (1, 2)
+                                    for field in ("active", "last_rotated", "last_used_date")])
+        writer.writerow(["<root_account>"] + ["N/A"] * 6)
+        for user in self.report_users:
+            writer.writerow([user, "true", NOW.isoformat(), "N/A", "false", "N/A", "N/A"])
+        return {"Content": out.getvalue().encode(), "GeneratedTime": NOW}
+
+    def get_account_summary(self):
+        self.calls["GetAccountSummary"] += 1
+        return {"SummaryMap": {"Users": len(self.account_users)}}
+
+    #Two users per page, one ListUsers call each
+    def user_pages(self, **kwargs):
+        for start in range(0, max(1, len(self.account_users)), 2):
+            self.calls["ListUsers"] += 1
+            yield {"Users": [{"UserName": user} for user in self.account_users[start:start + 2]]}
+
+    def get_paginator(self, name):
+        return Paginator(self.user_pages)
+
+    def list_access_keys(self, UserName):
+        self.calls["ListAccessKeys"] += 1
+        if UserName.startswith("denied"):
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "denied"}}, "ListAccessKeys")
+        return {"AccessKeyMetadata": [{"AccessKeyId": f"AKIA{UserName}", "Status": "Active", "CreateDate": NOW}]}
+
+    def get_access_key_last_used(self, AccessKeyId):
+        self.calls["GetAccessKeyLastUsed"] += 1
+        return {"AccessKeyLastUsed": {"LastUsedDate": NOW} if AccessKeyId.endswith("alice") else {}}
+
+
+@pytest.fixture
+def iam(fake_clients, monkeypatch, log_dir):
+    monkeypatch.setattr(iam_actions, "CREDENTIAL_REPORT_CACHE", str(log_dir / "credential_report.csv"))
+    return lambda report_users, account_users: fake_clients("iam", FakeIAM(report_users, account_users))
+
+
+def test_complete_report_needs_no_user_listing(iam):
+    fake = iam(["alice", "bob"], ["alice", "bob"])
+    keys = list(iam_actions.iter_report_keys({}))
+    assert [key["username"] for key in keys] == ["alice", "bob"]
+    assert fake.calls["ListUsers"] == 0
+
+
+def test_users_newer_than_the_report_are_looked_up(iam):
+    fake = iam(["alice"], ["alice", "carol"])
+    keys = list(iam_actions.iter_report_keys({}))
+    assert [(key["username"], key["uncovered"]) for key in keys] == [("alice", False), ("carol", True)]
+    assert fake.calls["ListUsers"] == 1
+
+
+def test_include_new_users_always_lists(iam):
+    fake = iam(["alice"], ["alice"])
+    list(iam_actions.iter_report_keys({}, include_new_users=True))
+    assert fake.calls["ListUsers"] == 1
+    assert fake.calls["GetAccountSummary"] == 0
+
+
+def test_audit_covers_every_page_of_users_and_skips_the_ones_it_cannot_read(iam):
+    users = ["alice", "bob", "denied-1", "dave", "erin"]
+    fake = iam([], users)
+    keys = list(iam_actions.audit_keys(Namespace(workers=2), {}))
+
+    assert sorted(key["username"] for key in keys) == ["alice", "bob", "dave", "erin"]
+    assert {key["username"]: key["last_used"] for key in keys}["alice"] == NOW
+    assert (fake.calls["ListUsers"], fake.calls["ListAccessKeys"], fake.calls["GetAccessKeyLastUsed"]) == (3, 5, 4)
+
+
+def test_throttle_backs_off_on_throttling_only(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(iam_actions.time, "sleep", sleeps.append)
+    outcomes = iter([ClientError({"Error": {"Code": "Throttling", "Message": "slow down"}}, "ListAccessKeys"),
+                     ClientError({"Error": {"Code": "Throttling", "Message": "slow down"}}, "ListAccessKeys"),
+                     "ok"])
+
+    def list_access_keys():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    throttle = iam_actions.AdaptiveThrottle()
+    assert throttle.call(list_access_keys) == "ok"
+    assert sleeps == [0.25, 0.5]
+    assert throttle.delay == 0.4
+
+    def denied():
+        raise ClientError({"Error": {"Code": "AccessDenied", "Message": "no"}}, "ListAccessKeys")
+    with pytest.raises(ClientError):
+        throttle.call(denied)
+    assert throttle.delay == 0.4
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+
+import idle_detection
+from conftest import Paginator
+
+SETTINGS = dict(idle_detection.DEFAULT_SETTINGS, lookback_days=1)
+HOURS = 24
+
+
+# GetMetricData answering every query with one value per hour, split over two NextToken pages
+class FakeCloudWatch:
+    def __init__(self, cpu=1.0, net=1024.0):
+        self.cpu, self.net = cpu, net
+        self.calls = []
+
+    def metric_pages(self, MetricDataQueries, StartTime, EndTime, **kwargs):
+        self.calls.append(len(MetricDataQueries))
+        stamps = [EndTime - timedelta(hours=hour) for hour in range(1, HOURS + 1)]
+        for half in (stamps[:HOURS // 2], stamps[HOURS // 2:]):
+            yield {"MetricDataResults": [
+                {"Id": query["Id"], "Timestamps": half,
+                 "Values": [self.cpu if query["Id"].endswith("cpu") else self.net] * len(half)}
+                for query in MetricDataQueries]}
+
+    def get_paginator(self, name):
+        return Paginator(self.metric_pages)
+
+
+def test_instances_are_scored_in_batches_of_up_to_500_queries():
+    client = FakeCloudWatch()
+    ids = [f"i-{n}" for n in range(400)]
+    stats = list(idle_detection.instance_stats(client, ids, SETTINGS))
+
+    assert client.calls == [498, 498, 204]
+    assert [entry["id"] for entry in stats] == ids
+    #Both pages of every series are merged
+    assert all(entry["datapoints"] == HOURS for entry in stats)
+
+
+def test_quiet_instances_are_idle_and_busy_or_unknown_ones_are_not():
+    quiet = next(idle_detection.instance_stats(FakeCloudWatch(cpu=1.0), ["i-quiet"], SETTINGS))
+    busy = next(idle_detection.instance_stats(FakeCloudWatch(cpu=50.0), ["i-busy"], SETTINGS))
+    chatty = next(idle_detection.instance_stats(FakeCloudWatch(net=10 * 1024 * 1024), ["i-chatty"], SETTINGS))
+
+    assert idle_detection.score(quiet, SETTINGS)["idle"] and idle_detection.score(quiet, SETTINGS)["score"] == 0.8
+    assert idle_detection.score(busy, SETTINGS)["reason"] == "busy"
+    assert idle_detection.score(chatty, SETTINGS)["reason"] == "busy"
+    sparse = dict(quiet, datapoints=HOURS // 2)
+    assert idle_detection.score(sparse, SETTINGS)["reason"] == "insufficient data"
+
+
+def test_the_window_ends_on_a_period_boundary():
+    now = datetime(2024, 5, 1, 10, 42, 17, tzinfo=timezone.utc)
+    start, end = idle_detection.metric_window(SETTINGS, now)
+    assert end == datetime(2024, 5, 1, 10, tzinfo=timezone.utc)
+    assert start == end - timedelta(days=1)
+    assert idle_detection.metric_window(SETTINGS, now + timedelta(minutes=10)) == (start, end)
@@ -0,0 +1,61 @@
+import pytest
+
+botocore = pytest.importorskip("botocore")
+import botocore.session
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+
+import instrumentation
+
+THROTTLED = (b"<Response><Errors><Error><Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message>"
+             b"</Error></Errors><RequestID>1</RequestID></Response>")
+REGIONS = (b'<DescribeRegionsResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">'
+           b"<requestId>2</requestId><regionInfo/></DescribeRegionsResponse>")
+
+
+class Raw:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+# Answer the client's HTTP requests from a script, after botocore's retry handling has run
+def scripted_client(monkeypatch, responses, mode):
+    monkeypatch.setattr(instrumentation, "metrics", instrumentation.Metrics())
+    monkeypatch.setattr("botocore.endpoint.time.sleep", lambda seconds: None)
+    client = botocore.session.get_session().create_client(
+        "ec2", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test",
+        config=Config(retries={"mode": mode, "max_attempts": 5}))
+    instrumentation.attach(client, "ec2")
+    script = iter(responses)
+
+    def send(request, **kwargs):
+        status, body = next(script)
+        return AWSResponse(request.url, status, {"Content-Length": str(len(body))}, Raw(body))
+    client.meta.events.register("before-send", send)
+    return client
+
+
+def test_failed_call_is_recorded_under_its_operation(monkeypatch):
+    client = scripted_client(monkeypatch, [], "standard")
+    with pytest.raises(StopIteration):
+        client.describe_regions()
+    assert instrumentation.metrics.snapshot()["ec2.DescribeRegions"]["errors"] == 1
+
+
+@pytest.mark.parametrize("mode", ["legacy", "standard", "adaptive"])
+def test_retried_throttles_are_counted(monkeypatch, mode):
+    client = scripted_client(monkeypatch, [(503, THROTTLED), (503, THROTTLED), (200, REGIONS)], mode)
+    client.describe_regions()
+    stats = instrumentation.metrics.snapshot()["ec2.DescribeRegions"]
+    assert (stats["calls"], stats["retries"], stats["throttles"], stats["errors"]) == (1, 2, 2, 0)
+
+
+def test_exhausted_throttles_count_as_an_error(monkeypatch):
+    client = scripted_client(monkeypatch, [(503, THROTTLED)] * 6, "standard")
+    with pytest.raises(botocore.exceptions.ClientError):
+        client.describe_regions()
+    stats = instrumentation.metrics.snapshot()["ec2.DescribeRegions"]
+    assert (stats["calls"], stats["retries"], stats["throttles"], stats["errors"]) == (1, 5, 6, 1)
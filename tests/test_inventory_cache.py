@@ -0,0 +1,79 @@
+import threading
+from collections import deque
+
+import pytest
+
+import inventory_cache
+
+
+@pytest.fixture
+def cache(log_dir):
+    return inventory_cache.InventoryCache(str(log_dir / "inventory.sqlite"), "111111111111")
+
+
+def instances(*ids, env="dev"):
+    return [{"id": instance_id, "tags": {"env": env}} for instance_id in ids]
+
+
+def refresh(cache, region, service, items):
+    deque(cache.refresh(region, service, items, key_fn=lambda item: item["id"], tags_fn=lambda item: item["tags"]), maxlen=0)
+
+
+def test_a_refresh_replaces_the_previous_snapshot_and_its_tags(cache):
+    refresh(cache, "us-east-1", "ec2", instances("i-1", "i-2"))
+    refresh(cache, "us-east-1", "ec2", instances("i-2", "i-3", env="prod"))
+
+    assert cache.is_fresh("us-east-1", "ec2", 60)
+    assert [item["id"] for item in cache.read("us-east-1", "ec2")] == ["i-2", "i-3"]
+    assert list(cache.read_by_tag("us-east-1", "ec2", "env", "dev")) == []
+    assert [item["id"] for item in cache.read_by_tag("us-east-1", "ec2", "env", "prod")] == ["i-2", "i-3"]
+
+
+def test_a_listing_that_fails_halfway_never_looks_fresh(cache):
+    def failing():
+        yield from instances("i-1")
+        raise RuntimeError("listing failed")
+
+    with pytest.raises(RuntimeError):
+        refresh(cache, "us-east-1", "ec2", failing())
+    assert not cache.is_fresh("us-east-1", "ec2", 60)
+
+
+def test_invalidation_covers_sub_services_and_can_target_a_region(cache):
+    refresh(cache, "global", "iam-keys/alice", instances("AKIA1"))
+    refresh(cache, "us-east-1", "ec2", instances("i-1"))
+    refresh(cache, "eu-west-1", "ec2", instances("i-2"))
+
+    cache.invalidate("iam-keys")
+    cache.invalidate("ec2", "us-east-1")
+    assert not cache.is_fresh("global", "iam-keys/alice", 60)
+    assert not cache.is_fresh("us-east-1", "ec2", 60)
+    assert cache.is_fresh("eu-west-1", "ec2", 60)
+
+
+def test_accounts_sharing_the_file_never_see_each_others_rows(cache, log_dir):
+    other = inventory_cache.InventoryCache(str(log_dir / "inventory.sqlite"), "222222222222")
+    refresh(cache, "us-east-1", "ec2", instances("i-1"))
+    assert not other.is_fresh("us-east-1", "ec2", 60)
+    assert list(other.read("us-east-1", "ec2")) == []
+
+
+def test_each_thread_writes_through_its_own_connection(cache):
+    regions = [f"region-{n}" for n in range(8)]
+    connections, errors = [], []
+
+    def work(region):
+        try:
+            refresh(cache, region, "ec2", instances(*(f"{region}-i-{n}" for n in range(50))))
+            connections.append(cache._connect())
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=work, args=(region,)) for region in regions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len({id(db) for db in connections}) == len(regions)
+    assert all(len(list(cache.read(region, "ec2"))) == 50 for region in regions)
@@ -0,0 +1,45 @@
+import csv
+
+import logging_setup
+
+
+def rows_in(path):
+    with open(path, newline="") as file:
+        return list(csv.reader(file))
+
+
+def test_flush_waits_for_every_row_queued_before_it(log_dir):
+    path = str(log_dir / "audit.csv")
+    #A long interval and a large batch: only flush() gets these rows onto disk in time
+    writer = logging_setup.AuditWriter(path, batch_size=10000, flush_interval=60)
+    for n in range(1200):
+        writer.write(["EC2", f"i-{n}", "test", "Success", "2024-01-01T00:00:00+00:00"])
+    assert writer.flush(timeout=5)
+    assert [row[1] for row in rows_in(path)] == [f"i-{n}" for n in range(1200)]
+    writer.close(timeout=5)
+
+
+def test_close_drains_the_queue(log_dir):
+    path = str(log_dir / "audit.csv")
+    writer = logging_setup.AuditWriter(path, batch_size=10000, flush_interval=60)
+    writer.write(["S3", "bucket", "test", "Success", "2024-01-01T00:00:00+00:00"])
+    writer.close(timeout=5)
+    assert len(rows_in(path)) == 1
+    #Once the thread is gone, flush writes on the caller's thread instead of waiting forever
+    writer.write(["S3", "late", "test", "Success", "2024-01-01T00:00:00+00:00"])
+    assert writer.flush(timeout=5)
+    assert rows_in(path)[-1][1] == "late"
+
+
+def test_log_csv_adds_the_account_column_under_an_account(log_dir):
+    logging_setup.log_csv("IAM", "alice", "list-keys", "Success")
+    logging_setup.context.account = "111111111111"
+    try:
+        logging_setup.log_csv("IAM", "bob", "list-keys", "Success")
+    finally:
+        logging_setup.context.account = None
+    logging_setup.get_audit_writer().flush(timeout=5)
+
+    alice, bob = rows_in(logging_setup.csv_file)
+    assert len(alice) == 5
+    assert bob[1:4] == ["bob", "list-keys", "Success"] and bob[5] == "111111111111"
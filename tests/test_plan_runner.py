@@ -0,0 +1,75 @@
+import json
+from argparse import Namespace
+
+import pytest
+
+import main
+import plan_runner
+
+
+# Action tables standing in for the service modules: every call is recorded in order
+class Actions:
+    def __init__(self):
+        self.calls = []
+
+    def action(self, name, result=None, fails=False):
+        def run(args, config, *inputs):
+            self.calls.append((name, inputs))
+            if fails:
+                raise RuntimeError(f"{name} failed")
+            return result
+        return run
+
+    def tables(self):
+        return {
+            "ec2": {"filter-instances": self.action("filter", ["i-1", "i-2"]),
+                    "stop-instances": self.action("stop", ["i-1"]),
+                    "list-instances": self.list_instances},
+            "iam": {"list-users": self.action("users", fails=True),
+                    "audit-keys": self.action("audit")},
+        }
+
+    def list_instances(self, args, config):
+        self.calls.append(("list", ()))
+        yield from ("i-1", "i-2")
+
+
+def run(tmp_path, steps):
+    path = tmp_path / "plan.json"
+    path.write_text(json.dumps({"max_parallel": 1, "steps": steps}))
+    actions = Actions()
+    args = Namespace(plan=str(path), max_parallel=None, dry_run=False, report=None, max_age=None)
+    report = plan_runner.run_plan(args, {}, main.build_parser(), actions.tables().get, main.run_action)
+    return actions.calls, report
+
+
+def test_steps_run_after_their_dependencies_and_skip_after_a_failure(tmp_path):
+    calls, report = run(tmp_path, [
+        {"id": "stop", "service": "ec2", "action": "stop-instances", "input": "find"},
+        {"id": "audit", "service": "iam", "action": "audit-keys", "depends_on": ["users"]},
+        {"id": "find", "service": "ec2", "action": "filter-instances", "args": {"tag_key": "env", "tag_value": "dev"}},
+        {"id": "users", "service": "iam", "action": "list-users"},
+    ])
+
+    order = [name for name, _ in calls]
+    assert order.index("filter") < order.index("stop")
+    assert dict(calls)["stop"] == (["i-1", "i-2"],)
+    assert "audit" not in order
+    assert {step: entry["status"] for step, entry in report.items()} == {
+        "find": "Success", "stop": "Success", "users": "Failed", "audit": "Skipped"}
+
+
+def test_a_streaming_step_cannot_be_an_input(tmp_path):
+    with pytest.raises(ValueError, match="streams its results"):
+        run(tmp_path, [
+            {"id": "all", "service": "ec2", "action": "list-instances"},
+            {"id": "stop", "service": "ec2", "action": "stop-instances", "input": "all"},
+        ])
+
+
+def test_dependency_cycles_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match="cycle"):
+        run(tmp_path, [
+            {"id": "a", "service": "iam", "action": "audit-keys", "depends_on": ["b"]},
+            {"id": "b", "service": "iam", "action": "list-users", "depends_on": ["a"]},
+        ])
@@ -0,0 +1,27 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+import s3_inventory
+
+MANIFEST = os.path.join(os.path.dirname(__file__), "fixtures", "inventory", "manifest.json")
+CUT_OFF = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def test_local_manifest_yields_decoded_current_objects_older_than_the_cut_off():
+    objects = list(s3_inventory.iter_inventory_objects(MANIFEST, "inventory-bucket", CUT_OFF))
+    assert objects == [
+        ("logs/old file.txt", 10, "2020-01-01T00:00:00.000Z"),
+        ("logs/café +1.txt", 20, "2024-12-31T23:59:59.999Z"),
+    ]
+
+
+def test_manifest_for_another_bucket_is_refused():
+    with pytest.raises(ValueError, match="inventory-bucket"):
+        list(s3_inventory.iter_inventory_objects(MANIFEST, "other-bucket", CUT_OFF))
+
+
+def test_stale_manifest_is_refused():
+    with pytest.raises(ValueError, match="old"):
+        list(s3_inventory.iter_inventory_objects(MANIFEST, "inventory-bucket", CUT_OFF, max_age_hours=48))
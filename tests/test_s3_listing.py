@@ -0,0 +1,85 @@
+import pytest
+
+import s3_listing
+from conftest import Paginator, finishes
+
+
+# list_objects_v2 over a fixed key set, with Prefix, Delimiter, StartAfter and small pages
+class FakeListing:
+    def __init__(self, keys, page_size=2):
+        self.keys = sorted(keys)
+        self.page_size = page_size
+
+    def pages(self, Bucket, Prefix="", Delimiter=None, StartAfter=None, **kwargs):
+        entries, seen = [], set()
+        for key in self.keys:
+            if not key.startswith(Prefix) or (StartAfter and key <= StartAfter):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common = Prefix + rest[:rest.index(Delimiter) + 1]
+                if common not in seen:
+                    seen.add(common)
+                    entries.append({"Prefix": common})
+                continue
+            entries.append({"Key": key, "Size": 1})
+        for start in range(0, max(1, len(entries)), self.page_size):
+            page = entries[start:start + self.page_size]
+            yield {"Contents": [entry for entry in page if "Key" in entry],
+                   "CommonPrefixes": [entry for entry in page if "Prefix" in entry],
+                   "IsTruncated": start + self.page_size < len(entries)}
+
+    def get_paginator(self, name):
+        return Paginator(self.pages)
+
+
+def listed(keys, **kwargs):
+    client = FakeListing(keys)
+    return [obj["Key"] for obj in s3_listing.iter_objects(client, "bucket", workers=4, **kwargs)]
+
+
+def test_ordered_listing_interleaves_direct_objects_and_prefixes():
+    keys = ["a.txt", "b/1", "b/2", "c.txt", "d/x/1", "z.txt"]
+    assert listed(keys, ordered=True) == sorted(keys)
+
+
+def test_ordered_listing_is_sorted_with_nested_levels():
+    keys = [f"{top}/{sub}/{n}" for top in "abc" for sub in "xy" for n in range(3)]
+    keys += ["a.log", "a/x.log", "b", "b0", "c/z.txt", "d"]
+    assert listed(keys, ordered=True) == sorted(keys)
+
+
+def test_unordered_listing_is_complete():
+    keys = ["a.txt", "b/1", "b/2", "c.txt", "d/x/1", "z.txt"]
+    assert sorted(listed(keys)) == sorted(keys)
+
+
+def test_range_shards_cover_a_level_too_big_to_discover(monkeypatch):
+    monkeypatch.setattr(s3_listing, "MAX_DISCOVERY_PAGES", 1)
+    keys = [f"{char}{n}" for char in "05AZaz" for n in range(3)]
+    assert listed(keys, ordered=True) == sorted(keys)
+
+
+MANY_SHARDS = [f"p{n:04d}/{i}" for n in range(600) for i in range(3)]
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_closing_early_with_more_shards_than_queue_slots_does_not_hang(ordered):
+    def first_then_close():
+        objects = s3_listing.iter_objects(FakeListing(MANY_SHARDS, page_size=1000), "bucket", workers=4, ordered=ordered)
+        first = next(objects)
+        objects.close()
+        return first
+    assert finishes(first_then_close)["result"]["Key"].startswith("p")
+
+
+class FailingListing(FakeListing):
+    def pages(self, Prefix="", Delimiter=None, **kwargs):
+        if Prefix == "p0300/" and not Delimiter:
+            raise RuntimeError("shard failed")
+        return super().pages(Prefix=Prefix, Delimiter=Delimiter, **kwargs)
+
+
+def test_failing_shard_raises_instead_of_hanging():
+    outcome = finishes(lambda: list(s3_listing.iter_objects(FailingListing(MANY_SHARDS, page_size=1000), "bucket", workers=4)))
+    assert str(outcome["error"]) == "shard failed"
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from argparse import Namespace
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import s3_actions
+from aws_standin import CallCounter, FakeS3, FakeS3Resource
+from conftest import finishes
+
+FILES = 20
+
+
+# Remembers every uploaded key and how many uploads were running at once
+class RecordingS3(FakeS3):
+    def __init__(self):
+        super().__init__(CallCounter(), 0)
+        self.keys_uploaded = []
+        self.running = self.most_running = 0
+
+    def upload_file(self, path, bucket, key, Config=None, ExtraArgs=None):
+        with self._lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.01)
+        try:
+            super().upload_file(path, bucket, key, Config, ExtraArgs)
+            with self._lock:
+                self.keys_uploaded.append(key)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def s3(fake_clients):
+    fake = RecordingS3()
+    fake_clients("s3", fake, resource=FakeS3Resource(fake))
+    return fake
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "files"
+    root.mkdir()
+    for n in range(FILES):
+        (root / f"file-{n:02d}.txt").write_bytes(b"x" * (n + 1))
+    return root
+
+
+def upload(tree, config=None, **options):
+    args = Namespace(bucket_name="bucket", prefix="p", local_file_path=str(tree), sync=False, concurrency=2)
+    for name, value in options.items():
+        setattr(args, name, value)
+    return s3_actions.upload_files_s3(args, config or {})
+
+
+def test_nested_files_upload_under_their_relative_keys_within_the_concurrency(s3, tree):
+    nested = tree / "a" / "b"
+    nested.mkdir(parents=True)
+    (nested / "deep.txt").write_bytes(b"deep")
+
+    totals = finishes(lambda: upload(tree, concurrency=4))["result"]
+    assert totals["uploaded"] == FILES + 1
+    assert totals["bytes"] == s3.uploaded_bytes == sum(n + 1 for n in range(FILES)) + 4
+    keys = {key.split("/", 2)[2] for key in s3.keys_uploaded}   #p/<date>/<relative path>
+    assert keys == {f"file-{n:02d}.txt" for n in range(FILES)} | {"a/b/deep.txt"}
+    assert 1 < s3.most_running <= 4
+
+
+def test_files_that_vanish_after_the_walk_fail_without_blocking_the_pool(s3, tree, monkeypatch):
+    walk = s3_actions.walk_files
+
+    #Every other file is deleted between the walk's stat and its upload
+    def vanishing(root):
+        for n, (path, key, stat) in enumerate(walk(root)):
+            if n % 2:
+                os.remove(path)
+            yield path, key, stat
+    monkeypatch.setattr(s3_actions, "walk_files", vanishing)
+
+    totals = finishes(lambda: upload(tree))["result"]
+    assert (totals["uploaded"], totals["failed"]) == (FILES // 2, FILES // 2)
+    assert totals["source_bytes"] == sum(n + 1 for n in range(0, FILES, 2))
+
+
+def test_a_crashing_upload_task_still_releases_its_slot(s3, tree, monkeypatch):
+    def crash(*args, **kwargs):
+        raise RuntimeError("worker crashed")
+    monkeypatch.setattr(s3_actions, "plain_upload", crash)
+
+    totals = finishes(lambda: upload(tree))["result"]
+    assert (totals["uploaded"], totals["failed"]) == (0, FILES)
+
+
+def test_sync_skips_unchanged_files_and_uploads_changed_ones(s3, tree, log_dir):
+    config = {"manifest_dir": str(log_dir)}
+    first = upload(tree, config, sync=True)
+    assert (first["uploaded"], first["skipped"]) == (FILES, 0)
+    assert all(key.startswith("p/file-") for key in s3.keys_uploaded)
+
+    #Same content with a new mtime is hashed and skipped; new content is uploaded again
+    os.utime(tree / "file-00.txt", (1, 1))
+    (tree / "file-01.txt").write_bytes(b"changed")
+    del s3.keys_uploaded[:]
+    second = upload(tree, config, sync=True)
+    assert (second["uploaded"], second["skipped"]) == (1, FILES - 1)
+    assert s3.keys_uploaded == ["p/file-01.txt"]
+
+    manifest, stale = s3_actions.load_manifest(s3_actions.get_manifest_path("bucket", "p", config), 24)
+    assert not stale and manifest["files"]["p/file-00.txt"]["mtime"] == 1
+
+
+def test_reconciling_drops_entries_missing_or_resized_in_the_bucket():
+    manifest = {"reconciled_at": 0, "files": {"p/kept": {"size": 3}, "p/resized": {"size": 3}, "p/gone": {"size": 3}}}
+    s3_actions.reconcile_manifest(manifest, {"p/kept": {"size": 3, "etag": "x"}, "p/resized": {"size": 4, "etag": "y"}})
+    assert list(manifest["files"]) == ["p/kept"]
+    assert manifest["reconciled_at"] > 0
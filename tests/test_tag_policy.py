@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import tag_policy
+
+
+def record(tags, state="running", type="t3.micro"):
+    return SimpleNamespace(tags=tags, state=state, type=type, launch_time=None)
+
+
+def test_conditions_on_the_same_filter_never_push_empty_values():
+    rule = tag_policy.Rule("both", [{"tag": "env", "exists": True}, {"tag": "owner", "exists": True},
+                                    {"tag": "stage", "equals": "dev*"}, {"tag": "stage", "equals": "dev1"}])
+    assert all(values for values in rule.filters.values())
+    assert rule.matches(record({"env": "x", "owner": "y", "stage": "dev1"}))
+    assert not rule.matches(record({"env": "x", "stage": "dev1"}))
+    assert not rule.matches(record({"env": "x", "owner": "y", "stage": "dev2"}))
+
+
+def test_parse_ttl_rejects_out_of_range_values():
+    assert tag_policy.parse_ttl("1e300") is None
+    assert tag_policy.parse_ttl("not a date") is None
+    assert tag_policy.parse_ttl("2020-01-01").year == 2020
+
+
+def test_load_rules_accepts_a_single_state_and_condition():
+    config = {"tag_policies": [{"name": "stopped-dev", "state": "stopped", "all": {"tag": "env", "equals": "dev"}}]}
+    [rule] = tag_policy.load_rules(config)
+    assert rule.filters == {"instance-state-name": {"stopped"}, "tag:env": {"dev"}}
+    assert rule.matches(record({"env": "dev"}, state="stopped"))
+    assert not rule.matches(record({"env": "dev"}))